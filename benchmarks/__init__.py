@@ -0,0 +1 @@
+"""Benchmarks of edges_cal, runnable with airspeed velocity (asv)."""
@@ -0,0 +1,122 @@
+"""Benchmarks of the speed, memory and flagging quality of the RFI flaggers.
+
+Run with ``asv run`` (see ``asv.conf.json``), or for a quick table of the current
+tree, with ``python -m benchmarks.bench_xrfi``.
+
+The waterfalls have EDGES-scale spectra (32768 channels). The numbers of integrations
+are given by the ``XRFI_BENCH_NTIMES`` environment variable (a comma-separated list,
+by default ``1,1000``; full-day observations have up to 1e4 integrations). A single
+integration is flagged as a 1D spectrum.
+"""
+import numpy as np
+import os
+import time
+
+from edges_cal import xrfi
+from edges_cal.flags import PackedFlags
+
+from .synthetic import make_waterfall, score
+
+N_TIMES = [int(n) for n in os.environ.get("XRFI_BENCH_NTIMES", "1,1000").split(",")]
+
+FLAGGERS = {
+    "medfilt": (xrfi.xrfi_medfilt, {"kf": 16, "kt": 0}),
+    "model": (xrfi.xrfi_model, {}),
+    "model_sweep": (xrfi.xrfi_model_sweep, {}),
+}
+
+
+def get_data(n_times):
+    """Get the benchmark spectra (1D for a single integration) and injected RFI."""
+    _, spectra, rfi_snr = make_waterfall(n_times)
+    if n_times == 1:
+        return spectra[0], rfi_snr[0]
+    return spectra, rfi_snr
+
+
+def run_flagger(name, spectra):
+    """Run one of the :data:`FLAGGERS` on the spectra, returning its flags."""
+    func, kwargs = FLAGGERS[name]
+    out = func(spectra.copy(), **kwargs)
+    return out[0] if isinstance(out, tuple) else out
+
+
+class FlaggedFilter:
+    """Flagged median and mean filters, with a tenth of the samples flagged."""
+
+    params = (["median", "mean"], ["numpy", "numba"], N_TIMES)
+    param_names = ["kind", "backend", "n_times"]
+    timeout = 600
+
+    def setup(self, kind, backend, n_times):
+        if backend == "numba" and xrfi._xrfi_numba is None:
+            raise NotImplementedError("numba is not installed")
+        self.backend = xrfi.BACKEND
+        xrfi.BACKEND = backend
+
+        self.spectra, _ = get_data(n_times)
+        self.flags = np.random.default_rng(0).random(self.spectra.shape) < 0.1
+        self.size = 33 if n_times == 1 else (5, 33)
+
+    def teardown(self, kind, backend, n_times):
+        xrfi.BACKEND = self.backend
+
+    def time_flagged_filter(self, kind, backend, n_times):
+        xrfi.flagged_filter(self.spectra, self.size, kind=kind, flags=self.flags)
+
+
+class Flaggers:
+    """The iterative flaggers, run with their default settings."""
+
+    params = (list(FLAGGERS), N_TIMES)
+    param_names = ["flagger", "n_times"]
+    timeout = 1200
+
+    def setup(self, name, n_times):
+        self.spectra, self.rfi_snr = get_data(n_times)
+
+    def time_flagger(self, name, n_times):
+        run_flagger(name, self.spectra)
+
+    def peakmem_flagger(self, name, n_times):
+        run_flagger(name, self.spectra)
+
+    def track_recall(self, name, n_times):
+        return score(run_flagger(name, self.spectra), self.rfi_snr)[0]
+
+    def track_precision(self, name, n_times):
+        return score(run_flagger(name, self.spectra), self.rfi_snr)[1]
+
+    track_recall.unit = "fraction"
+    track_precision.unit = "fraction"
+
+
+class Watershed:
+    """Watershed of the flags of the injected RFI (with some random flags)."""
+
+    params = ([False, True], [n for n in N_TIMES if n > 1])
+    param_names = ["packed", "n_times"]
+
+    def setup(self, packed, n_times):
+        _, rfi_snr = get_data(n_times)
+        flags = (rfi_snr > 3) | (np.random.default_rng(0).random(rfi_snr.shape) < 0.1)
+        self.flags = PackedFlags.from_bool(flags) if packed else flags
+
+    def time_xrfi_watershed(self, packed, n_times):
+        xrfi.xrfi_watershed(flags=self.flags, tol=0.2)
+
+
+if __name__ == "__main__":
+    print(
+        f"{'flagger':<14}{'n_times':>8}{'time [s]':>10}{'recall':>8}{'precision':>11}"
+    )
+    for n_times in N_TIMES:
+        spectra, rfi_snr = get_data(n_times)
+        for name in FLAGGERS:
+            start = time.perf_counter()
+            flags = run_flagger(name, spectra)
+            elapsed = time.perf_counter() - start
+            recall, precision = score(flags, rfi_snr)
+            print(
+                f"{name:<14}{n_times:>8}{elapsed:>10.2f}{recall:>8.3f}{precision:>11.3f}"
+            )
@@ -0,0 +1,139 @@
+"""Synthetic EDGES-like spectra with injected RFI, for benchmarking the RFI flaggers.
+
+The spectra are a power-law foreground (whose amplitude and index change over the
+day) with radiometer noise, into which narrowband RFI (FM stations, ORBCOMM satellite
+passes and single-sample transients) and broadband RFI bursts are injected. The
+injected RFI is returned in units of the thermal noise, so that the recall and
+precision of a set of flags can be measured with :func:`score`.
+"""
+import numpy as np
+from typing import Tuple
+
+# The EDGES spectrometer has 32768 channels over 0-200 MHz. The spectra are generated
+# over the part of the band that is usually calibrated.
+N_FREQ = 32768
+F_MIN = 40.0
+F_MAX = 200.0
+INTEGRATION_TIME = 13.0
+
+# Injected RFI at least this many times the noise should be found by any flagger.
+DETECTABLE = 5
+
+# FM stations are centred on odd multiples of 100 kHz, from 88.1 to 107.9 MHz.
+FM_STATIONS = np.arange(88.1, 108, 0.2)
+ORBCOMM_LINES = np.array([137.2, 137.25, 137.44, 137.46, 137.56, 137.66, 137.74])
+
+
+def _add_line(rfi, freq, f0, amplitude, width=1.0):
+    """Add a line of Gaussian profile (width in channels) to each row of rfi."""
+    df = freq[1] - freq[0]
+    centre = int(np.round((f0 - freq[0]) / df))
+    half = int(np.ceil(3 * width))
+    channels = np.arange(max(centre - half, 0), min(centre + half + 1, len(freq)))
+    profile = np.exp(-0.5 * ((freq[channels] - f0) / (width * df)) ** 2)
+    rfi[:, channels] += np.outer(amplitude, profile)
+
+
+def make_waterfall(
+    n_times: int = 1, n_freq: int = N_FREQ, seed: int = 1234
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Make a waterfall of EDGES-like spectra with injected RFI.
+
+    Parameters
+    ----------
+    n_times : int, optional
+        The number of integrations, spread evenly over one day.
+    n_freq : int, optional
+        The number of channels between 40 and 200 MHz.
+    seed : int, optional
+        The random seed. The same seed always gives the same waterfall.
+
+    Returns
+    -------
+    freq : np.ndarray
+        The frequencies of the channels, in MHz.
+    spectra : np.ndarray
+        The spectra, of shape ``(n_times, n_freq)``, in K.
+    rfi_snr : np.ndarray
+        The injected RFI (same shape as ``spectra``), in units of the thermal noise.
+    """
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(F_MIN, F_MAX, n_freq)
+    lst = np.linspace(0, 2 * np.pi, n_times, endpoint=False)
+    n_samples = np.sqrt((freq[1] - freq[0]) * 1e6 * INTEGRATION_TIME)
+
+    rfi = np.zeros((n_times, n_freq), dtype=np.float32)
+
+    # About a third of the FM stations are visible, with a strength that slowly
+    # changes through the day.
+    for f0 in FM_STATIONS[rng.random(len(FM_STATIONS)) < 0.3]:
+        strength = 10 ** rng.uniform(0.5, 2.5)
+        phase = rng.uniform(0, 2 * np.pi)
+        _add_line(rfi, freq, f0, strength * (0.75 + 0.25 * np.sin(lst + phase)), 2)
+
+    # ORBCOMM satellites pass overhead for ~10 minutes, a few times per day.
+    duration = max(1, int(600 / INTEGRATION_TIME * n_times / 6646))
+    for _ in range(max(1, n_times // 200)):
+        start = rng.integers(0, max(1, n_times - duration))
+        amplitude = np.zeros(n_times)
+        amplitude[start : start + duration] = 10 ** rng.uniform(1, 3) * np.sin(
+            np.linspace(0, np.pi, duration + 2)[1:-1]
+        )
+        for f0 in ORBCOMM_LINES:
+            _add_line(rfi, freq, f0, amplitude)
+
+    # Single-sample transients anywhere in the band.
+    n_transient = rng.poisson(1e-4 * rfi.size)
+    rows = rng.integers(0, n_times, n_transient)
+    cols = rng.integers(0, n_freq, n_transient)
+    rfi[rows, cols] += rng.exponential(20, n_transient)
+
+    # Broadband bursts, covering a few MHz to tens of MHz, in about 1% of integrations.
+    for row in np.nonzero(rng.random(n_times) < 0.01)[0]:
+        centre, width = rng.uniform(F_MIN, F_MAX), rng.uniform(2, 30)
+        rfi[row] += rng.uniform(3, 20) * np.exp(-0.5 * ((freq - centre) / width) ** 2)
+
+    # The thermal noise has standard deviation sky / sqrt(bandwidth * time), so the
+    # spectra are sky * (1 + (noise + rfi) / sqrt(bandwidth * time)).
+    spectra = rng.standard_normal((n_times, n_freq))
+    spectra += rfi
+    spectra /= n_samples
+    spectra += 1
+    for row, (amp, index) in enumerate(
+        zip(1750 * (1 + 0.6 * np.sin(lst)), -2.55 + 0.05 * np.cos(lst))
+    ):
+        spectra[row] *= amp * (freq / 75) ** index
+
+    return freq, spectra, rfi
+
+
+def score(
+    flags: np.ndarray, rfi_snr: np.ndarray, in_flags: [None, np.ndarray] = None
+) -> Tuple[float, float]:
+    """Score a set of flags against the injected RFI.
+
+    Parameters
+    ----------
+    flags : np.ndarray
+        The flags to score (same shape as ``rfi_snr``).
+    rfi_snr : np.ndarray
+        The injected RFI, in units of the thermal noise.
+    in_flags : np.ndarray, optional
+        Flags that were given to the flagger, which are not scored.
+
+    Returns
+    -------
+    recall : float
+        The fraction of samples with injected RFI of at least :data:`DETECTABLE` times
+        the noise that are flagged.
+    precision : float
+        The fraction of flagged samples that have any injected RFI.
+    """
+    flags = np.asarray(flags, dtype=bool)
+    if in_flags is not None:
+        flags = flags & ~in_flags
+
+    detectable = rfi_snr >= DETECTABLE
+    recall = np.sum(flags & detectable) / max(np.sum(detectable), 1)
+    precision = np.sum(flags & (rfi_snr > 0)) / max(np.sum(flags), 1)
+    return recall, precision
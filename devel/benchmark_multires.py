@@ -0,0 +1,99 @@
+"""Compare coarse-to-fine RFI flagging with flagging at full resolution.
+
+Injects single-channel lines of a range of amplitudes (in units of the thermal noise)
+into a synthetic power-law spectrum at EDGES-like resolution, and reports the time
+taken, the recall as a function of line amplitude and the false-positive rate for
+each flagger run with and without :func:`edges_cal.xrfi.xrfi_multires`.
+"""
+import numpy as np
+import time
+
+from edges_cal import xrfi
+
+NFREQ = 16384
+NLINES = 200
+NBANDS = 4
+AMPLITUDE_BINS = [5, 10, 15, 20, 30, 50]
+FACTORS = [4, 8, 16]
+FLAGGERS = {
+    "model": {},
+    "medfilt": {"kf": 16, "kt": None},
+    "medfilt (poly)": {"kf": 16, "kt": None, "poly_order": 5},
+}
+
+
+def make_spectrum(seed=1234):
+    """Make a noisy power-law spectrum with injected lines.
+
+    Most of the lines are clustered in a few bands (like the FM band or satellite
+    transmissions), and the rest are scattered over the spectrum.
+    """
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(50, 200, NFREQ)
+    sky = 1750 * (freq / 75) ** -2.55
+    noise = sky / 300
+    spectrum = sky + rng.normal(scale=noise)
+
+    starts = rng.choice(NFREQ - 500, NBANDS, replace=False)
+    in_bands = np.concatenate([np.arange(start, start + 500) for start in starts])
+    n_clustered = int(0.7 * NLINES)
+    channels = np.unique(
+        np.concatenate(
+            [
+                rng.choice(in_bands, n_clustered, replace=False),
+                rng.choice(NFREQ, NLINES - n_clustered, replace=False),
+            ]
+        )
+    )
+    amplitudes = rng.uniform(AMPLITUDE_BINS[0], AMPLITUDE_BINS[-1], len(channels))
+    spectrum[channels] += amplitudes * noise[channels]
+    return spectrum, channels, amplitudes
+
+
+def score(flags, channels, amplitudes):
+    """Get the recall in each amplitude bin, and the false-positive rate."""
+    found = flags[channels]
+    recall = [
+        np.mean(found[(amplitudes >= low) & (amplitudes < high)])
+        for low, high in zip(AMPLITUDE_BINS[:-1], AMPLITUDE_BINS[1:])
+    ]
+    false_positive = (np.sum(flags) - np.sum(found)) / (NFREQ - len(channels))
+    return recall, false_positive
+
+
+def timed(func, *args, **kwargs):
+    """Call a flagger, returning its flags, info and the time it took."""
+    start = time.perf_counter()
+    flags, info = func(*args, **kwargs)
+    return flags, info, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    spectrum, channels, amplitudes = make_spectrum()
+
+    header = " ".join(
+        f"{low:>2}-{high:<3}"
+        for low, high in zip(AMPLITUDE_BINS[:-1], AMPLITUDE_BINS[1:])
+    )
+    print(f"{'flagger':<16}{'factor':>7}{'time [s]':>10}{'refined':>9}  {header}  FPR")
+
+    for name, kwargs in FLAGGERS.items():
+        method = name.split()[0]
+        flags, _, t = timed(getattr(xrfi, f"xrfi_{method}"), spectrum.copy(), **kwargs)
+        recall, fpr = score(flags, channels, amplitudes)
+        print(
+            f"{name:<16}{'-':>7}{t:>10.3f}{1:>9.2f}  "
+            + " ".join(f"{r:>6.2f}" for r in recall)
+            + f"  {fpr:.1e}"
+        )
+
+        for factor in FACTORS:
+            flags, info, t = timed(
+                xrfi.xrfi_multires, method, spectrum.copy(), factor=factor, **kwargs
+            )
+            recall, fpr = score(flags, channels, amplitudes)
+            print(
+                f"{name:<16}{factor:>7}{t:>10.3f}{info['refined_fraction']:>9.2f}  "
+                + " ".join(f"{r:>6.2f}" for r in recall)
+                + f"  {fpr:.1e}"
+            )
@@ -0,0 +1,251 @@
+"""Numba-compiled kernels for the loops in :mod:`edges_cal.xrfi`.
+
+This module can only be imported if numba is installed. The kernels are used in place
+of the equivalent numpy code when ``xrfi.BACKEND == "numba"``, and give identical
+flags.
+"""
+import numba
+import numpy as np
+
+
+@numba.njit(cache=True, nogil=True)
+def _select(buf, n, k):
+    """Partially sort ``buf[:n]`` in place so that ``buf[k]`` is its k-th smallest."""
+    lo, hi = 0, n - 1
+    while lo < hi:
+        pivot = buf[(lo + hi) // 2]
+        i, j = lo, hi
+        while i <= j:
+            while buf[i] < pivot:
+                i += 1
+            while buf[j] > pivot:
+                j -= 1
+            if i <= j:
+                buf[i], buf[j] = buf[j], buf[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return buf[k]
+
+
+@numba.njit(cache=True, nogil=True)
+def _median(buf, n):
+    """Get the median of ``buf[:n]``, which is overwritten (NaN if n is zero)."""
+    if n == 0:
+        return np.nan
+
+    k = n // 2
+    hi = _select(buf, n, k)
+    if n % 2:
+        return hi
+
+    # After the selection, the next-smallest value is the maximum of the lower part.
+    lo = buf[0]
+    for i in range(1, k):
+        if buf[i] > lo:
+            lo = buf[i]
+    return (lo + hi) / 2
+
+
+@numba.njit(cache=True, nogil=True)
+def _window_median(extended, i, j, s0, s1, buf):
+    """Get the median of the non-NaN values of the window starting at ``[i, j]``."""
+    n = 0
+    for a in range(s0):
+        for b in range(s1):
+            value = extended[i + a, j + b]
+            if not np.isnan(value):
+                buf[n] = value
+                n += 1
+    return _median(buf, n)
+
+
+@numba.njit(cache=True, nogil=True)
+def median_filter(extended, s0, s1, out):
+    """Median-filter a 2D array (extended beyond its edges), ignoring NaNs."""
+    buf = np.empty(s0 * s1)
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            out[i, j] = _window_median(extended, i, j, s0, s1, buf)
+
+
+@numba.njit(cache=True, nogil=True)
+def median_filter_at(extended, s0, s1, rows, cols, out):
+    """Median-filter a 2D array only at the given positions."""
+    buf = np.empty(s0 * s1)
+    for n in range(len(rows)):
+        i, j = rows[n], cols[n]
+        out[i, j] = _window_median(extended, i, j, s0, s1, buf)
+
+
+@numba.njit(cache=True, nogil=True)
+def watershed_flags(flags, abs_resid, model_std, threshold, kernel, out):
+    """Flag the samples around each flag that are above the watershed threshold.
+
+    All arrays are 2D. The centre of ``kernel`` is placed on each flagged sample, and
+    NaN entries of the kernel are ignored.
+    """
+    n0, n1 = flags.shape
+    k0, k1 = kernel.shape
+    c0, c1 = k0 // 2, k1 // 2
+
+    for i in range(n0):
+        for j in range(n1):
+            if not flags[i, j]:
+                continue
+
+            for a in range(k0):
+                p = i + a - c0
+                if p < 0 or p >= n0:
+                    continue
+                for b in range(k1):
+                    q = j + b - c1
+                    value = kernel[a, b]
+                    if q < 0 or q >= n1 or np.isnan(value):
+                        continue
+                    if abs_resid[p, q] > value * threshold * model_std[p, q]:
+                        out[p, q] = True
+
+
+@numba.njit(cache=True, nogil=True)
+def _cholesky(lhs):
+    """Factor the lower triangle of ``lhs`` in place, as ``L @ L.T``."""
+    n = len(lhs)
+    for j in range(n):
+        for i in range(j, n):
+            value = lhs[i, j]
+            for k in range(j):
+                value -= lhs[i, k] * lhs[j, k]
+            lhs[i, j] = np.sqrt(value) if i == j else value / lhs[j, j]
+
+
+@numba.njit(cache=True, nogil=True)
+def _cholesky_solve(chol, rhs, out):
+    """Solve ``L @ L.T @ out = rhs`` given the Cholesky factor ``L``."""
+    n = len(rhs)
+    for i in range(n):
+        value = rhs[i]
+        for k in range(i):
+            value -= chol[i, k] * out[k]
+        out[i] = value / chol[i, i]
+
+    for i in range(n - 1, -1, -1):
+        value = out[i]
+        for k in range(i + 1, n):
+            value -= chol[k, i] * out[k]
+        out[i] = value / chol[i, i]
+
+
+@numba.njit(cache=True, nogil=True)
+def _normal_matrix(basis, flags, lhs):
+    """Get the lower triangle of the normal matrix of the basis over unflagged rows."""
+    lhs[:] = 0
+    for i in range(len(basis)):
+        if flags[i]:
+            continue
+        for a in range(basis.shape[1]):
+            for b in range(a + 1):
+                lhs[a, b] += basis[i, a] * basis[i, b]
+
+
+@numba.njit(cache=True, nogil=True)
+def _window_residuals(data, flags, basis, chol, resid):
+    """Get the residuals of a fit of the basis to the unflagged data of a window.
+
+    ``chol`` is the Cholesky factor of the normal matrix, or None to compute it from
+    the flags. Windows with no more data than terms are fit exactly.
+    """
+    width, n_terms = basis.shape
+    resid[:] = 0
+    if width - np.sum(flags) <= n_terms:
+        return
+
+    if chol is None:
+        chol = np.empty((n_terms, n_terms))
+        _normal_matrix(basis, flags, chol)
+        _cholesky(chol)
+
+    rhs = np.zeros(n_terms)
+    for i in range(width):
+        if not flags[i]:
+            for a in range(n_terms):
+                rhs[a] += data[i] * basis[i, a]
+
+    par = np.empty(n_terms)
+    _cholesky_solve(chol, rhs, par)
+    for i in range(width):
+        if not flags[i]:
+            model = 0.0
+            for a in range(n_terms):
+                model += par[a] * basis[i, a]
+            resid[i] = data[i] - model
+
+
+@numba.njit(cache=True, nogil=True)
+def _window_std(resid, flags, use_median, buf, n_terms):
+    """Get the standard deviation of the unflagged residuals.
+
+    It is NaN if there are no more unflagged samples than ``n_terms`` (as then the
+    window is fit exactly). If ``use_median``, it is estimated from the median absolute
+    deviation.
+    """
+    count = len(resid) - np.sum(flags)
+    if count <= n_terms:
+        return np.nan
+
+    if not use_median:
+        mean = np.sum(resid) / count
+        var = 0.0
+        for i in range(len(resid)):
+            if not flags[i]:
+                var += (resid[i] - mean) ** 2
+        return np.sqrt(var / count)
+
+    n = 0
+    for i in range(len(resid)):
+        if not flags[i]:
+            buf[n] = resid[i]
+            n += 1
+    med = _median(buf, n)
+    for i in range(n):
+        buf[i] = abs(buf[i] - med)
+    return _median(buf, n) / np.sqrt(0.456)
+
+
+@numba.njit(cache=True, nogil=True)
+def sweep_flags(spectrum, flags, basis, n_sigma, use_median, r_std, first, out):
+    """Flag a 1D spectrum with a sweep of polynomial fits in sliding windows.
+
+    Each window (starting from ``first``) is fit and its outliers flagged, using the
+    standard deviation of the residuals of the previous window that had data (or
+    ``r_std``, for the first two windows). See :func:`edges_cal.xrfi.xrfi_model_sweep`.
+    """
+    width, n_terms = basis.shape
+    resid = np.empty(width)
+    buf = np.empty(width)
+
+    # Windows without flags all share the same (factored) normal matrix.
+    full = np.empty((n_terms, n_terms))
+    _normal_matrix(basis, np.zeros(width, dtype=np.bool_), full)
+    _cholesky(full)
+
+    prev = r_std
+    for w in range(first, len(spectrum) - width + 1):
+        data, mask = spectrum[w : w + width], flags[w : w + width]
+        _window_residuals(data, mask, basis, None if np.any(mask) else full, resid)
+        std = _window_std(resid, mask, use_median, buf, n_terms)
+
+        thresh = n_sigma * prev
+        for i in range(width):
+            if not mask[i] and abs(resid[i]) > thresh:
+                out[w + i] = True
+
+        if w == first:
+            std = r_std
+        if not np.isnan(std):
+            prev = std
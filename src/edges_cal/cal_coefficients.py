@@ -27,6 +27,7 @@ from . import reflection_coefficient as rc
 from . import s11_correction as s11
 from . import tools, xrfi
 from .cached_property import cached_property
+from .flags import FlagProvenance
 from .tools import EdgesFrequencyRange, FrequencyRange
 
 
@@ -295,25 +296,16 @@ class SwitchCorrection:
 
         s11_correction = self.s11_correction
 
-        def get_model(mag):
-            # Returns a callable function that will evaluate a model onto a set of
-            # un-normalised frequencies.
-            if mag:
-                d = np.abs(s11_correction)
-            else:
-                d = np.unwrap(np.angle(s11_correction))
-
-            fit = mdl.ModelFit(
-                model_type, xdata=self.freq.freq_recentred, ydata=d, n_terms=n_terms
-            )
-            return lambda x: fit.evaluate(x)
-
-        mag = get_model(True)
-        ang = get_model(False)
+        fit = mdl.ComplexModelFit(
+            model_type,
+            xdata=self.freq.freq_recentred,
+            ydata=s11_correction,
+            n_terms=n_terms,
+            polar=True,
+        )
 
         def model(f):
-            ff = self.freq.normalize(f)
-            return mag(ff) * (np.cos(ang(ff)) + 1j * np.sin(ang(ff)))
+            return fit.evaluate(self.freq.normalize(f))
 
         return model
 
@@ -494,7 +486,7 @@ class LoadSpectrum:
         f_low: float = 40.0,
         f_high: Optional[float] = None,
         ignore_times_percent: float = 5.0,
-        rfi_removal: str = "1D2D",
+        rfi_removal: Union[str, xrfi.XRFIPipeline] = "1D2D",
         rfi_kernel_width_time: int = 16,
         rfi_kernel_width_freq: int = 16,
         rfi_threshold: float = 6,
@@ -518,16 +510,22 @@ class LoadSpectrum:
         ignore_times_percent : float
             Must be between 0 and 100. Number of time-samples in a file to reject
             from the start of the file.
-        rfi_removal : str
-            Either '1D', '2D' or '1D2D'. If given, will perform median and mean-filtered
-            xRFI over either the
+        rfi_removal : str or :class:`~xrfi.XRFIPipeline`
+            Either '1D', '2D', '1D2D', 'stream', or an :class:`~xrfi.XRFIPipeline`.
+            If given, will perform median and mean-filtered xRFI over either the
             2D waterfall, or integrated 1D spectrum. The latter is usually reasonable
             for calibration sources, while the former is good for field data. "1D2D"
             is a hybrid approach in which the variance per-frequency is determined
-            from the 2D data, but filtering occurs only over frequency.
+            from the 2D data, but filtering occurs only over frequency. "stream" passes
+            the integrations through a :class:`~xrfi.StreamingFlagger` in time order,
+            as they would be flagged during acquisition. A pipeline is run on the 2D
+            waterfall of each spectrum (the ``rfi_kernel_width_*`` and
+            ``rfi_threshold`` are then not used, since the stages define their own).
         rfi_kernel_width_time : int
             The kernel width for the detrending of data for
             RFI removal in the time dimension (only used if `rfi_removal` is "2D").
+            For "stream", the number of previous integrations kept for the rolling
+            statistics is twice this plus one (and at least two).
         rfi_kernel_width_freq : int
             The kernel width for the detrending of data for
             RFI removal in the frequency dimension.
@@ -558,13 +556,17 @@ class LoadSpectrum:
         self.rfi_kernel_width_freq = rfi_kernel_width_freq
         self.rfi_threshold = rfi_threshold
 
-        assert rfi_removal in [
+        assert isinstance(rfi_removal, xrfi.XRFIPipeline) or rfi_removal in [
             "1D",
             "2D",
             "1D2D",
+            "stream",
             False,
             None,
-        ], "rfi_removal must be either '1D', '2D', '1D2D, or False/None"
+        ], (
+            "rfi_removal must be either '1D', '2D', '1D2D', 'stream', an XRFIPipeline "
+            "or False/None"
+        )
 
         self.rfi_removal = rfi_removal
 
@@ -705,14 +707,18 @@ class LoadSpectrum:
             )
             means = {}
             variances = {}
+            provenance = {}
             with h5py.File(fname, "r") as fl:
                 for kind in kinds:
                     means[kind] = fl[kind + "_mean"][...]
                     variances[kind] = fl[kind + "_var"][...]
-            return means, variances
+                for kind, group in fl.get("flag_provenance", {}).items():
+                    provenance[kind] = FlagProvenance.read(group)
+            return means, variances, provenance
 
         logger.info(f"Reducing {self.load_name} spectra...")
-        spectra = self.get_spectra()
+        provenance = {}
+        spectra = self.get_spectra(provenance=provenance)
 
         means = {}
         variances = {}
@@ -740,6 +746,9 @@ class LoadSpectrum:
                 mean[flags] = np.nan
                 var[flags] = np.nan
 
+                provenance[key] = FlagProvenance(flags.shape)
+                provenance[key].record(flags, "1D2D")
+
             means[key] = mean
             variances[key] = var
 
@@ -751,12 +760,30 @@ class LoadSpectrum:
             for kind in kinds:
                 fl[kind + "_mean"] = means[kind]
                 fl[kind + "_var"] = variances[kind]
+            for kind, prov in provenance.items():
+                prov.write(fl.create_group(f"flag_provenance/{kind}"))
 
-        return means, variances
+        return means, variances, provenance
 
-    def get_spectra(self) -> dict:
+    @property
+    def flag_provenance(self) -> dict:
+        """The provenance of the RFI flags of each kind of spectrum (p0, p1, p2, Q).
+
+        Each value is a :class:`~.flags.FlagProvenance` recording the flags of each
+        stage of RFI removal, of the flags of the spectra in (time, frequency), or of the
+        averaged spectra if ``rfi_removal`` is "1D2D".
+        """
+        return self._ave_and_var_spec[2]
+
+    def get_spectra(self, provenance: Optional[dict] = None) -> dict:
         """Read all spectra and remove RFI.
 
+        Parameters
+        ----------
+        provenance : dict, optional
+            If given, a :class:`~.flags.FlagProvenance` of the flags of each kind of
+            spectrum (in (time, frequency)) is added to it.
+
         Returns
         -------
         dict :
@@ -765,7 +792,20 @@ class LoadSpectrum:
         """
         spec = self._read_spectrum()
 
-        if self.rfi_removal == "2D":
+        if isinstance(self.rfi_removal, xrfi.XRFIPipeline):
+            for key, val in spec.items():
+                # Spectra are stored as (nfreq, ntime), but flagged as (ntime, nfreq).
+                prov = FlagProvenance(val.T.shape)
+                flags, _ = self.rfi_removal.run(
+                    val.T,
+                    flags=~np.isfinite(val.T) | ((val.T == 0) if key != "Q" else False),
+                    freq=self.freq.freq,
+                    provenance=prov,
+                )
+                val[flags.T] = np.nan
+                if provenance is not None:
+                    provenance[key] = prov
+        elif self.rfi_removal == "2D":
             for key, val in spec.items():
                 # Need to set nans and zeros to inf so that median/mean detrending can work.
                 val[np.isnan(val)] = np.inf
@@ -773,14 +813,38 @@ class LoadSpectrum:
                 if key != "Q":
                     val[val == 0] = np.inf
 
+                # Flag the transposed (time, frequency) view, so that the flags of
+                # each iteration are recorded along frequency. The kernel widths are
+                # swapped to keep the same kernel over each axis of the spectra.
+                prov = FlagProvenance(val.T.shape)
                 flags, _ = xrfi.xrfi_medfilt(
-                    val,
+                    val.T,
                     threshold=self.rfi_threshold,
-                    kt=self.rfi_kernel_width_time,
-                    kf=self.rfi_kernel_width_freq,
+                    kt=self.rfi_kernel_width_freq,
+                    kf=self.rfi_kernel_width_time,
+                    provenance=prov,
                 )
-                val[flags] = np.nan
+                val[flags.T] = np.nan
                 spec[key] = val
+                if provenance is not None:
+                    provenance[key] = prov
+        elif self.rfi_removal == "stream":
+            # The rolling statistics need at least two integrations.
+            n_history = max(2 * self.rfi_kernel_width_time + 1, 2)
+            for key, val in spec.items():
+                flagger = xrfi.StreamingFlagger(
+                    len(val),
+                    threshold=self.rfi_threshold,
+                    kf=self.rfi_kernel_width_freq,
+                    n_history=n_history,
+                    min_history=min(8, n_history),
+                )
+                # Spectra are stored as (nfreq, ntime), but are streamed in time.
+                flags = flagger.run(val.T, flags=(val.T == 0) if key != "Q" else None)
+                val[flags.T] = np.nan
+                if provenance is not None:
+                    provenance[key] = FlagProvenance(flags.shape)
+                    provenance[key].record(flags, "stream")
         return spec
 
     def _read_spectrum(self) -> dict:
@@ -934,40 +998,17 @@ class HotLoadCorrection:
         self.freq = FrequencyRange(f, f_low, f_high)
         self.data = data[self.freq.mask, 1::2] + 1j * data[self.freq.mask, 2::2]
 
-    def _get_model_part(self, kind: str, mag: bool = True):
-        """
-        Compute an evaluated S11 model, having fit to the data.
-
-        Parameters
-        ----------
-        kind : str
-            String specifying whether to get s11, s12, or s22.
-        mag : bool
-            Whether to return the magnitude (otherwise, the angle)
-
-        Returns
-        -------
-        array_like : The model S-parameter
-        """
-        d = self.data[:, self._kinds[kind]]
-        d = np.abs(d) if mag else np.unwrap(np.angle(d))
-        mag = mdl.ModelFit(
-            "polynomial", xdata=self.freq.freq_recentred, ydata=d, n_terms=21
-        )
-
-        def out(f):
-            ff = self.freq.normalize(f)
-            return mag.evaluate(ff)
-
-        return out
-
     def _get_model_kind(self, kind):
-        mag = self._get_model_part(kind)
-        ang = self._get_model_part(kind, False)
+        fit = mdl.ComplexModelFit(
+            "polynomial",
+            xdata=self.freq.freq_recentred,
+            ydata=self.data[:, self._kinds[kind]],
+            n_terms=21,
+            polar=True,
+        )
 
         def out(f):
-            a = ang(f)
-            return mag(f) * (np.cos(a) + 1j * np.sin(a))
+            return fit.evaluate(self.freq.normalize(f))
 
         return out
 
@@ -1975,6 +2016,10 @@ class CalibrationObservation:
             fl["lna_s11_real"] = self.lna.s11_model(self.freq.freq).real
             fl["lna_s11_imag"] = self.lna.s11_model(self.freq.freq).imag
 
+            for name, load in self._loads.items():
+                for kind, prov in load.spectrum.flag_provenance.items():
+                    prov.write(fl.create_group(f"flag_provenance/{name}/{kind}"))
+
 
 class Calibration:
     def __init__(self, filename: [str, Path]):
@@ -2003,6 +2048,12 @@ class Calibration:
             self._lna_s11_rl = Spline(self.freq.freq, fl["lna_s11_real"][...])
             self._lna_s11_im = Spline(self.freq.freq, fl["lna_s11_imag"][...])
 
+            # The provenance of the RFI flags of the spectra of each load.
+            self.flag_provenance = {
+                name: {kind: FlagProvenance.read(group) for kind, group in load.items()}
+                for name, load in fl.get("flag_provenance", {}).items()
+            }
+
             try:
                 self.internal_switch = io.SwitchingState(
                     fl.attrs["switch_path"], run_num=fl.attrs["switch_run_num"],
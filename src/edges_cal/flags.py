@@ -0,0 +1,426 @@
+"""Compact containers for boolean flags."""
+import numpy as np
+from typing import List, Tuple, Union
+
+# The number of set bits in each possible byte.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class PackedFlags:
+    def __init__(self, bits: np.ndarray, shape: Tuple[int]):
+        """Boolean flags stored as bits, eight flags to a byte.
+
+        Flags are packed along the last (frequency) axis with :func:`numpy.packbits`,
+        so each row of flags is padded to a whole number of bytes. The padding bits are
+        always zero.
+
+        Parameters
+        ----------
+        bits : np.ndarray
+            The packed flags, as returned by ``np.packbits(flags, axis=-1)``.
+        shape : tuple of int
+            The shape of the unpacked flags.
+
+        Raises
+        ------
+        ValueError
+            If the shape of ``bits`` does not match ``shape``.
+        """
+        shape = tuple(shape)
+        if bits.dtype != np.uint8 or bits.shape != shape[:-1] + (-(-shape[-1] // 8),):
+            raise ValueError(f"bits must be a uint8 array packing flags of {shape}")
+
+        self.bits = bits
+        self.shape = shape
+
+    @classmethod
+    def from_bool(cls, flags: np.ndarray) -> "PackedFlags":
+        """Pack a boolean array of flags."""
+        flags = np.asarray(flags, dtype=bool)
+        return cls(np.packbits(flags, axis=-1), flags.shape)
+
+    @classmethod
+    def zeros(cls, shape: Tuple[int]) -> "PackedFlags":
+        """Create a set of flags that are all False."""
+        shape = tuple(np.atleast_1d(shape))
+        return cls(np.zeros(shape[:-1] + (-(-shape[-1] // 8),), dtype=np.uint8), shape)
+
+    @property
+    def ndim(self) -> int:
+        """The number of dimensions of the flags."""
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used to store the flags."""
+        return self.bits.nbytes
+
+    @property
+    def _row_mask(self) -> np.ndarray:
+        """The packed bits of a row with every flag set (and no padding bits)."""
+        return np.packbits(np.ones(self.shape[-1], dtype=bool))
+
+    def to_bool(self) -> np.ndarray:
+        """Unpack the flags into a boolean array.
+
+        The flags are unpacked into a single new array, which is then viewed as a
+        boolean array without a further copy.
+        """
+        return np.unpackbits(self.bits, axis=-1, count=self.shape[-1]).view(bool)
+
+    def __array__(self, dtype=None):
+        """Unpack the flags for use as a numpy array."""
+        out = self.to_bool()
+        return out if dtype is None else out.astype(dtype)
+
+    def __len__(self):
+        """The length of the first axis of the flags."""
+        return self.shape[0]
+
+    def __repr__(self):
+        """Representation of the flags."""
+        return f"PackedFlags(shape={self.shape}, n_flagged={self.count()})"
+
+    def __getitem__(self, indx) -> "PackedFlags":
+        """Get the flags of a subset of rows (only the leading axes can be indexed)."""
+        if not isinstance(indx, tuple):
+            indx = (indx,)
+        if len(indx) >= self.ndim:
+            raise IndexError("only the leading axes of PackedFlags can be indexed")
+        bits = self.bits[indx]
+        return PackedFlags(bits, bits.shape[:-1] + self.shape[-1:])
+
+    def __eq__(self, other):
+        """Whether two sets of flags are identical."""
+        if not isinstance(other, PackedFlags):
+            return NotImplemented
+        return self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+    def copy(self) -> "PackedFlags":
+        """Get a copy of the flags."""
+        return PackedFlags(self.bits.copy(), self.shape)
+
+    def _other_bits(self, other) -> np.ndarray:
+        if isinstance(other, PackedFlags):
+            return other.bits
+        other = np.asarray(other, dtype=bool)
+        return np.packbits(other, axis=-1)
+
+    def __or__(self, other) -> "PackedFlags":
+        """Flags set in either set of flags."""
+        return PackedFlags(self.bits | self._other_bits(other), self.shape)
+
+    def __and__(self, other) -> "PackedFlags":
+        """Flags set in both sets of flags."""
+        return PackedFlags(self.bits & self._other_bits(other), self.shape)
+
+    def __xor__(self, other) -> "PackedFlags":
+        """Flags set in only one of the sets of flags."""
+        return PackedFlags(self.bits ^ self._other_bits(other), self.shape)
+
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def __ior__(self, other) -> "PackedFlags":
+        """Set the flags that are set in other."""
+        self.bits |= self._other_bits(other)
+        return self
+
+    def __iand__(self, other) -> "PackedFlags":
+        """Unset the flags that are not set in other."""
+        self.bits &= self._other_bits(other)
+        return self
+
+    def __ixor__(self, other) -> "PackedFlags":
+        """Toggle the flags that are set in other."""
+        self.bits ^= self._other_bits(other)
+        return self
+
+    def __invert__(self) -> "PackedFlags":
+        """The flags that are not set."""
+        return PackedFlags(~self.bits & self._row_mask, self.shape)
+
+    def count(self, axis: [None, int] = None) -> [int, np.ndarray]:
+        """Count the number of flags that are set.
+
+        Parameters
+        ----------
+        axis : int, optional
+            The axis along which to count the flags. By default, count all the flags.
+            Counting along the last (frequency) axis counts the set bits of each row,
+            while counting along other axes sums each bit over the rows.
+
+        Returns
+        -------
+        count : int or np.ndarray
+            The number of set flags, with ``axis`` removed from the shape.
+        """
+        if axis is None:
+            return int(np.sum(_POPCOUNT[self.bits], dtype=np.int64))
+
+        axis = axis % self.ndim
+        if axis == self.ndim - 1:
+            return np.sum(_POPCOUNT[self.bits], axis=-1, dtype=np.int64)
+
+        counts = np.zeros(
+            tuple(s for i, s in enumerate(self.bits.shape[:-1]) if i != axis)
+            + (self.bits.shape[-1] * 8,),
+            dtype=np.int64,
+        )
+        for bit in range(8):
+            counts[..., bit::8] = np.sum(
+                (self.bits >> (7 - bit)) & 1, axis=axis, dtype=np.int64
+            )
+        return counts[..., : self.shape[-1]]
+
+    def any(self, axis: [None, int] = None) -> [bool, np.ndarray]:
+        """Whether any flags are set (along an axis)."""
+        if axis is None:
+            return bool(np.any(self.bits))
+        return self.count(axis) > 0
+
+    def set_rows(self, mask: np.ndarray):
+        """Flag every channel of the rows (along the leading axes) given by a mask."""
+        self.bits[mask] = self._row_mask
+
+    def set_channels(self, mask: np.ndarray):
+        """Flag the channels (along the last axis) given by a mask, for every row."""
+        self.bits |= np.packbits(np.asarray(mask, dtype=bool))
+
+
+class FlagProvenance:
+    def __init__(self, shape: Tuple[int]):
+        """A record of which stage (and iteration) of flagging set each flag.
+
+        The flags of each stage are stored as run-length-encoded intervals of flagged
+        channels along the last (frequency) axis, so that a record costs memory in
+        proportion to the number of contiguous runs of flags rather than the size of
+        the data. Each record is labelled with the name of the stage that set the flags,
+        and the iteration of that stage.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            The shape of the flags that are recorded.
+
+        Examples
+        --------
+        >>> provenance = FlagProvenance(spectrum.shape)
+        >>> flags, info = xrfi_medfilt(spectrum, max_iter=3, provenance=provenance)
+        >>> provenance.query((10, 1200))
+        [('medfilt', 0), ('medfilt', 1)]
+        """
+        self.shape = tuple(np.atleast_1d(shape))
+        self.stages: List[str] = []
+        self.iterations: List[int] = []
+
+        # The (row, start, stop) of each run of flags of each record, where row is the
+        # index of the flattened leading axes, and stop is exclusive.
+        self._runs: List[np.ndarray] = []
+
+    @property
+    def n_rows(self) -> int:
+        """The number of rows (the size of the leading axes) of the flags."""
+        return int(np.prod(self.shape[:-1], dtype=int))
+
+    def __len__(self):
+        """The number of records."""
+        return len(self.stages)
+
+    def __repr__(self):
+        """Representation of the provenance."""
+        return (
+            f"FlagProvenance(shape={self.shape}, n_records={len(self)}, "
+            f"n_runs={self.n_runs})"
+        )
+
+    @property
+    def n_runs(self) -> int:
+        """The total number of runs of flags over all records."""
+        return sum(len(runs) for runs in self._runs)
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used to store the runs of flags."""
+        return sum(runs.nbytes for runs in self._runs)
+
+    @staticmethod
+    def _encode(flags: np.ndarray) -> np.ndarray:
+        """Get the (row, start, stop) of each run of flags in a 2D boolean array."""
+        padded = np.zeros((len(flags), flags.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = flags
+        edges = np.diff(padded, axis=1)
+
+        # Runs are found in row-major order, so starts and stops pair up.
+        rows, starts = np.nonzero(edges == 1)
+        stops = np.nonzero(edges == -1)[1]
+        return np.column_stack((rows, starts, stops)).astype(np.int32)
+
+    def record(
+        self, flags: Union[np.ndarray, PackedFlags], stage: str, iteration: int = 0
+    ):
+        """Record the flags set by a stage of flagging.
+
+        Parameters
+        ----------
+        flags : array-like or :class:`PackedFlags`
+            The flags set by the stage, with the same shape as the provenance.
+        stage : str
+            The name of the stage.
+        iteration : int, optional
+            The iteration of the stage.
+
+        Raises
+        ------
+        ValueError
+            If the flags have the wrong shape.
+        """
+        flags = np.asarray(flags, dtype=bool)
+        if flags.shape != self.shape:
+            raise ValueError(
+                f"flags have shape {flags.shape}, but provenance has shape {self.shape}"
+            )
+
+        self._runs.append(self._encode(flags.reshape(-1, self.shape[-1])))
+        self.stages.append(stage)
+        self.iterations.append(int(iteration))
+
+    def _select(
+        self, stages: [None, str, List[str]], iterations: [None, int, List[int]]
+    ) -> List[int]:
+        """Get the indices of the records of given stages and iterations."""
+        if isinstance(stages, str):
+            stages = [stages]
+        if isinstance(iterations, (int, np.integer)):
+            iterations = [iterations]
+
+        return [
+            i
+            for i, (stage, iteration) in enumerate(zip(self.stages, self.iterations))
+            if (stages is None or stage in stages)
+            and (iterations is None or iteration in iterations)
+        ]
+
+    def to_bool(
+        self,
+        stages: [None, str, List[str]] = None,
+        iterations: [None, int, List[int]] = None,
+        rows=None,
+    ) -> np.ndarray:
+        """Decode the union of the flags of some records into a boolean array.
+
+        Parameters
+        ----------
+        stages : str or list of str, optional
+            Only decode the records of these stages. By default, all stages.
+        iterations : int or list of int, optional
+            Only decode the records of these iterations. By default, all iterations.
+        rows : int, slice or array-like, optional
+            Only decode these rows (indices into the flattened leading axes). By
+            default, all the flags are decoded.
+
+        Returns
+        -------
+        flags : np.ndarray
+            The flags, with the shape of the provenance if ``rows`` is not given, or
+            shape ``(n_selected_rows, n_channels)`` otherwise.
+        """
+        selected = self._select(stages, iterations)
+        runs = (
+            np.concatenate([self._runs[i] for i in selected])
+            if selected
+            else np.zeros((0, 3), dtype=np.int32)
+        )
+
+        if rows is None:
+            n_rows = self.n_rows
+            row = runs[:, 0]
+        else:
+            rows = np.arange(self.n_rows)[rows]
+            n_rows = rows.size
+            position = np.full(self.n_rows, -1)
+            position[rows] = np.arange(n_rows)
+            row = position[runs[:, 0]]
+            runs = runs[row >= 0]
+            row = row[row >= 0]
+
+        # Mark the start and end of each run, and then count the runs covering each
+        # channel with a cumulative sum.
+        edges = np.zeros((n_rows, self.shape[-1] + 1), dtype=np.int32)
+        np.add.at(edges, (row, runs[:, 1]), 1)
+        np.add.at(edges, (row, runs[:, 2]), -1)
+        flags = np.cumsum(edges[:, :-1], axis=1) > 0
+
+        return flags.reshape(self.shape) if rows is None else flags
+
+    def __array__(self, dtype=None):
+        """Decode all the flags for use as a numpy array."""
+        out = self.to_bool()
+        return out if dtype is None else out.astype(dtype)
+
+    def query(self, index: Tuple[int]) -> List[Tuple[str, int]]:
+        """Get the (stage, iteration) of each record that flagged a given sample.
+
+        Parameters
+        ----------
+        index : tuple of int
+            The full index of the sample (including its channel).
+
+        Returns
+        -------
+        records : list of tuple
+            The ``(stage, iteration)`` of every record in which the sample is flagged,
+            in the order they were recorded.
+        """
+        index = tuple(np.atleast_1d(index))
+        row = np.ravel_multi_index(index[:-1], self.shape[:-1]) if index[:-1] else 0
+        channel = index[-1] % self.shape[-1]
+
+        return [
+            (self.stages[i], self.iterations[i])
+            for i, runs in enumerate(self._runs)
+            if np.any(
+                (runs[:, 0] == row) & (runs[:, 1] <= channel) & (channel < runs[:, 2])
+            )
+        ]
+
+    def union(self, other: "FlagProvenance") -> "FlagProvenance":
+        """Get the provenance with the records of both this and another provenance.
+
+        Raises
+        ------
+        ValueError
+            If the provenances are of flags of different shapes.
+        """
+        if other.shape != self.shape:
+            raise ValueError("cannot combine provenance of flags of different shapes")
+
+        out = FlagProvenance(self.shape)
+        out.stages = self.stages + other.stages
+        out.iterations = self.iterations + other.iterations
+        out._runs = self._runs + other._runs
+        return out
+
+    __or__ = union
+
+    def write(self, group):
+        """Write the provenance to a :class:`h5py.Group`."""
+        group.attrs["shape"] = self.shape
+        group["stages"] = np.array(self.stages, dtype="S")
+        group["iterations"] = np.array(self.iterations, dtype=int)
+        group["n_runs"] = np.array([len(runs) for runs in self._runs], dtype=int)
+        group["runs"] = (
+            np.concatenate(self._runs) if self._runs else np.zeros((0, 3), np.int32)
+        )
+
+    @classmethod
+    def read(cls, group) -> "FlagProvenance":
+        """Read a provenance written by :meth:`write` from a :class:`h5py.Group`."""
+        out = cls(tuple(group.attrs["shape"]))
+        out.stages = [stage.decode() for stage in group["stages"][...]]
+        out.iterations = [int(i) for i in group["iterations"][...]]
+        if out.stages:
+            n_runs = group["n_runs"][...]
+            out._runs = np.split(group["runs"][...], np.cumsum(n_runs)[:-1])
+        return out
@@ -1,13 +1,136 @@
 # -*- coding: utf-8 -*-
 """Functions for generating least-squares model fits for linear models."""
+import hashlib
 import numpy as np
 from abc import abstractmethod
 from cached_property import cached_property
-from statsmodels import api as sm
-from typing import Sequence, Type, Union
+from collections import OrderedDict
+from scipy import linalg
+from typing import List, NamedTuple, Sequence, Tuple, Type, Union
 
 F_CENTER = 75.0
 
+# The default backend used to solve the least-squares problem of a ModelFit: one of
+# "qr", "cholesky" (both native numpy/scipy solvers) or "statsmodels" (which requires
+# statsmodels to be installed, and gives its full regression results).
+BACKEND = "qr"
+
+
+class BasisCache:
+    def __init__(self, max_bytes: int = 2 ** 28):
+        """A least-recently-used cache of model bases, shared by all models.
+
+        Bases are keyed by the class of the model, its hyper-parameters (eg. the
+        ``f_center`` and ``offset`` of a polynomial), the indices of the terms and a
+        fingerprint of the co-ordinates, so that any two models of the same kind
+        evaluated on the same grid share their basis. Cached bases are read-only.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The maximum total size of the cached bases. The least recently used bases
+            are dropped when this is exceeded.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        """The number of cached bases."""
+        return len(self._cache)
+
+    @staticmethod
+    def fingerprint(x: np.ndarray) -> tuple:
+        """A key that identifies a set of co-ordinates."""
+        shape = np.shape(x)  # ascontiguousarray makes scalars 1D.
+        x = np.ascontiguousarray(x)
+        return shape, x.dtype.str, hashlib.sha1(x.view(np.uint8)).hexdigest()
+
+    def get(self, key: tuple) -> [None, np.ndarray]:
+        """Get a cached basis (or None if it is not cached)."""
+        basis = self._cache.get(key)
+        if basis is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return basis
+
+    @staticmethod
+    def _arrays(value) -> list:
+        """The arrays in a cached value (which may be nested in tuples)."""
+        if isinstance(value, np.ndarray):
+            return [value]
+        if isinstance(value, tuple):
+            return [arr for item in value for arr in BasisCache._arrays(item)]
+        return []
+
+    def _nbytes(self, value) -> int:
+        return sum(arr.nbytes for arr in self._arrays(value))
+
+    def put(self, key: tuple, basis: np.ndarray):
+        """Cache a basis (which is made read-only), dropping old bases if required."""
+        nbytes = self._nbytes(basis)
+        if nbytes > self.max_bytes or key in self._cache:
+            return
+
+        for arr in self._arrays(basis):
+            arr.flags.writeable = False
+        self._cache[key] = basis
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self._nbytes(self._cache.popitem(last=False)[1])
+
+    def clear(self):
+        """Remove all cached bases and reset the statistics."""
+        self._cache.clear()
+        self.nbytes = self.hits = self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        """The number of hits, misses, cached bases and bytes used by the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "n_bases": len(self),
+            "nbytes": self.nbytes,
+        }
+
+
+class FactorizationCache(BasisCache):
+    def __init__(self, max_bytes: int = 2 ** 27):
+        """A least-recently-used cache of the factorizations of least-squares problems.
+
+        Factorizations are keyed by the solver, and fingerprints of the basis and
+        weights of a :class:`ModelFit`, so that fits of different data with the same
+        basis and weights re-use the same factorization, and only solve for the new
+        data. Cached factors are read-only.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The maximum total size of the cached factors. The least recently used
+            factors are dropped when this is exceeded (set to zero to disable caching).
+        """
+        super().__init__(max_bytes=max_bytes)
+
+    @property
+    def stats(self) -> dict:
+        """The number of hits, misses, cached factorizations and bytes used."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "n_factorizations": len(self),
+            "nbytes": self.nbytes,
+        }
+
+
+# The caches used by every model and fit.
+basis_cache = BasisCache()
+factorization_cache = FactorizationCache()
+
 
 class Model:
     _models = {}
@@ -65,6 +188,17 @@ class Model:
         if not is_meta:
             cls._models[cls.__name__.lower()] = cls
 
+        # The whole basis can be built at once only if the class that last defined
+        # the basis terms also defined how to build them all together (a subclass
+        # that only overrides _get_basis_term must be evaluated term by term).
+        for klass in cls.__mro__:
+            if klass is Model:
+                cls._vectorized_basis = False
+                break
+            if "_get_basis" in vars(klass) or "_get_basis_term" in vars(klass):
+                cls._vectorized_basis = "_get_basis" in vars(klass)
+                break
+
     @property
     def default_basis(self) -> [None, np.ndarray]:
         """The (cached) basis functions at default_x.
@@ -110,7 +244,46 @@ class Model:
         if len(indices) > self.n_terms:
             raise ValueError("Cannot get more indices than n_terms.")
 
-        return np.array([self.get_basis_term(indx, x) for indx in indices])
+        key = self._basis_key(x, indices)
+        if key is not None:
+            basis = basis_cache.get(key)
+            if basis is not None:
+                return basis
+
+        if self._vectorized_basis:
+            basis = self._get_basis(np.asarray(indices, dtype=int), np.asarray(x))
+        else:
+            basis = np.array([self.get_basis_term(indx, x) for indx in indices])
+
+        if key is not None:
+            basis_cache.put(key, basis)
+        return basis
+
+    def _basis_key(self, x: np.ndarray, indices: list) -> [None, tuple]:
+        """The key of a basis in the :data:`basis_cache` (None if it can't be cached).
+
+        The hyper-parameters of the model are taken to be all its public attributes
+        other than its parameters and default co-ordinates. If any of them are not
+        hashable, the basis is not cached.
+        """
+        hyper = tuple(
+            sorted(
+                (name, val)
+                for name, val in vars(self).items()
+                if not name.startswith("_")
+                and name not in ("parameters", "n_terms", "default_x")
+            )
+        )
+        try:
+            hash(hyper)
+        except TypeError:
+            return None
+
+        indices = tuple(int(i) for i in indices)
+        if indices == tuple(range(len(indices))):
+            indices = len(indices)
+
+        return type(self), hyper, indices, basis_cache.fingerprint(x)
 
     def update_nterms(self, n_terms: int):
         """Update the number of terms in the model.
@@ -122,10 +295,12 @@ class Model:
         elif n_terms < self.n_terms:
             self.default_basis = self.default_basis[:n_terms]
         else:
+            basis = self.default_basis
+            self.n_terms = n_terms
             self.default_basis = np.vstack(
                 (
-                    self.default_basis,
-                    self.get_basis(self.default_x, list(range(self.n_terms, n_terms))),
+                    basis,
+                    self.get_basis(self.default_x, list(range(len(basis), n_terms))),
                 )
             )
 
@@ -196,6 +371,18 @@ class Model:
     def _get_basis_term(self, indx: int, x: np.ndarray) -> np.ndarray:
         pass
 
+    # Set for each subclass on creation: whether it defines _get_basis.
+    _vectorized_basis = False
+
+    def _get_basis(self, indices: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Get the basis terms of the given indices, all at once.
+
+        Subclasses may define this to compute the whole basis more quickly than
+        term-by-term (eg. with recurrences between the terms). It must agree with
+        :meth:`_get_basis_term`.
+        """
+        raise NotImplementedError
+
     def fit(
         self, ydata: np.ndarray, weights: [None, np.ndarray, float] = None, xdata=None
     ):
@@ -280,6 +467,21 @@ class PhysicalLin(Foreground):
         else:
             raise ValueError("too many terms supplied!")
 
+    def _get_basis(self, indices: np.ndarray, x: np.ndarray) -> np.ndarray:
+        if np.any(indices > 4):
+            raise ValueError("too many terms supplied!")
+
+        y = x / self.f_center
+        terms = np.empty((5,) + y.shape)
+        terms[0] = y ** -2.5
+        if np.any((indices == 1) | (indices == 2)):
+            logy = np.log(y)
+            terms[1] = terms[0] * logy
+            terms[2] = terms[1] * logy
+        terms[3] = terms[0] / (y * y)
+        terms[4] = 1 / (y * y)
+        return terms[indices]
+
 
 class Polynomial(Foreground):
     def __init__(self, log_x: bool = False, offset: float = 0, **kwargs):
@@ -313,6 +515,28 @@ class Polynomial(Foreground):
 
         return y ** (indx + self.offset)
 
+    def _y(self, x: np.ndarray) -> np.ndarray:
+        y = x / self.f_center
+        return np.log(y) if self.log_x else y
+
+    def _get_basis(self, indices: np.ndarray, x: np.ndarray) -> np.ndarray:
+        y = self._y(x)
+
+        # For negative or fractional offsets, y^offset * y^i is not always the same
+        # as y^(i + offset) (eg. at y=0), so take the powers directly.
+        if self.offset < 0 or self.offset != int(self.offset):
+            return y ** (indices.reshape((-1,) + (1,) * y.ndim) + self.offset)
+
+        # Powers of y as a cumulative product.
+        n = indices.max() + 1 if len(indices) else 0
+        powers = np.empty((n,) + y.shape)
+        powers[:1] = 1
+        powers[1:] = y
+        np.cumprod(powers, axis=0, out=powers)
+        if self.offset:
+            powers *= y ** self.offset
+        return powers[indices]
+
 
 class EdgesPoly(Polynomial):
     def __init__(self, offset: float = -2.5, **kwargs):
@@ -341,6 +565,9 @@ class LinLog(Polynomial):
         term = super()._get_basis_term(indx, x)
         return term * (x / self.f_center) ** self.beta
 
+    def _get_basis(self, indices: np.ndarray, x: np.ndarray) -> np.ndarray:
+        return super()._get_basis(indices, x) * (x / self.f_center) ** self.beta
+
 
 class Fourier(Model):
     """A Fourier-basis model."""
@@ -353,6 +580,118 @@ class Fourier(Model):
         else:
             return np.sin((indx + 1) // 2 * x)
 
+    def _get_basis(self, indices: np.ndarray, x: np.ndarray) -> np.ndarray:
+        # cos(kx) and sin(kx) by angle-addition from cos(x) and sin(x).
+        n_freqs = (indices.max() + 1) // 2 if len(indices) else 0
+        terms = np.empty((2 * n_freqs + 1,) + x.shape)
+        terms[0] = 1
+        if n_freqs:
+            cos, sin = np.cos(x), np.sin(x)
+            terms[1], terms[2] = cos, sin
+        for k in range(2, n_freqs + 1):
+            prev_cos, prev_sin = terms[2 * k - 3], terms[2 * k - 2]
+            terms[2 * k - 1] = prev_cos * cos - prev_sin * sin
+            terms[2 * k] = prev_sin * cos + prev_cos * sin
+        return terms[indices]
+
+
+class LeastSquaresResult(NamedTuple):
+    """The result of a fit by a native least-squares solver.
+
+    The attributes have the same names as those of the statsmodels results.
+    """
+
+    params: np.ndarray
+    normalized_cov_params: np.ndarray
+    resid: np.ndarray
+
+
+def _factorize_qr(a: np.ndarray) -> Tuple[tuple, np.ndarray]:
+    """Factorize a (whitened) least-squares problem with a QR decomposition.
+
+    Returns the factors and the normalized covariance of the parameters,
+    ``(A^T A)^-1``.
+    """
+    q, r = np.linalg.qr(a)
+    r_inv = linalg.solve_triangular(r, np.eye(len(r)))
+    return (q, r), r_inv @ r_inv.T
+
+
+def _solve_qr(factors: tuple, y: np.ndarray) -> np.ndarray:
+    q, r = factors
+    return linalg.solve_triangular(r, q.T @ y)
+
+
+def _factorize_cholesky(a: np.ndarray) -> Tuple[tuple, np.ndarray]:
+    """Factorize a (whitened) least-squares problem with its normal equations.
+
+    This is faster than :func:`_factorize_qr` when there are many more data than
+    terms, but squares the condition number of the problem.
+    """
+    factor = linalg.cho_factor(a.T @ a)
+    return (a, factor), linalg.cho_solve(factor, np.eye(a.shape[1]))
+
+
+def _solve_cholesky(factors: tuple, y: np.ndarray) -> np.ndarray:
+    a, factor = factors
+    return linalg.cho_solve(factor, a.T @ y)
+
+
+# The functions to factorize a whitened design matrix, and then solve with the factors.
+_SOLVERS = {
+    "qr": (_factorize_qr, _solve_qr),
+    "cholesky": (_factorize_cholesky, _solve_cholesky),
+}
+
+
+def _append_qr_columns(
+    q: np.ndarray, r: np.ndarray, columns: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Update the thin QR decomposition of a matrix for columns appended to it.
+
+    Each new column is orthogonalized against the previous ones by Gram-Schmidt, with
+    a second pass of re-orthogonalization to keep the columns of ``q`` orthonormal.
+
+    Parameters
+    ----------
+    q, r : np.ndarray
+        The thin QR decomposition of a matrix, shapes ``(n, k)`` and ``(k, k)``.
+    columns : np.ndarray
+        The columns to append, shape ``(n, m)``.
+
+    Returns
+    -------
+    q, r : np.ndarray
+        The thin QR decomposition of the extended matrix.
+    """
+    k, m = r.shape[0], columns.shape[1]
+    q = np.hstack((q, np.zeros_like(columns, dtype=float)))
+    r_new = np.zeros((k + m, k + m))
+    r_new[:k, :k] = r
+
+    for i in range(k, k + m):
+        vec = columns[:, i - k].astype(float)
+        for _ in range(2):
+            coeffs = q[:, :i].T @ vec
+            vec -= q[:, :i] @ coeffs
+            r_new[:i, i] += coeffs
+        r_new[i, i] = np.linalg.norm(vec)
+        q[:, i] = vec / r_new[i, i]
+    return q, r_new
+
+
+def _whiten(whitener: [None, np.ndarray], x: np.ndarray) -> np.ndarray:
+    """Whiten data (or a design matrix) along its first axis.
+
+    The whitener is either None (no weights), the square root of 1D weights, or the
+    transposed Cholesky factor of the inverse covariance.
+    """
+    if whitener is None:
+        return x
+    if whitener.ndim == 1:
+        return (x.T * whitener).T
+    return whitener @ x
+
 
 class ModelFit:
     def __init__(
@@ -363,6 +702,7 @@ class ModelFit:
         xdata: [None, np.ndarray] = None,
         weights: [None, np.ndarray] = None,
         n_terms: int = None,
+        backend: [None, str] = None,
         **kwargs,
     ):
         """A class representing a fit of model to data.
@@ -374,7 +714,10 @@ class ModelFit:
         xdata
             The co-ordinates of the measured data.
         ydata
-            The values of the measured data.
+            The values of the measured data. This may be 2D, of shape
+            ``(n_vectors, len(xdata))``, to fit several data vectors with the same
+            weights at once: the least-squares problem is factorized once, and all the
+            vectors are solved for together.
         weights
             The weight of the measured data at each point. This corresponds to the
             *variance* of the measurement (not the standard deviation). This is appropriate
@@ -383,14 +726,28 @@ class ModelFit:
         n_terms
             The number of terms to use in the model (useful for models with an
             arbitrary number of terms).
+        backend
+            The least-squares solver: "qr", "cholesky" or "statsmodels". By default,
+            :data:`BACKEND`. The native solvers ("qr" and "cholesky") only give the
+            parameters, residuals and normalized covariance of the fit, and are much
+            faster for small fits. The "statsmodels" backend gives its full regression
+            results as :attr:`fit`.
         kwargs
             All other arguments are passed to the chosen model.
 
         Raises
         ------
         ValueError
-            If model_type is not str, or a subclass of :class:`Model`.
+            If model_type is not str, or a subclass of :class:`Model`, the backend
+            is unknown, or ydata has the wrong shape.
         """
+        self.backend = backend or BACKEND
+        if self.backend not in _SOLVERS and self.backend != "statsmodels":
+            raise ValueError(
+                f"backend must be one of {sorted(_SOLVERS) + ['statsmodels']}. "
+                f"Got '{self.backend}'."
+            )
+
         if not isinstance(model_type, Model) and xdata is None:
             raise ValueError(
                 "You must pass xdata unless the model_type is an instance."
@@ -412,7 +769,9 @@ class ModelFit:
             )
 
         self.xdata = self.model.default_x
-        self.ydata = ydata
+        self.ydata = np.asarray(ydata)
+        if self.ydata.ndim not in (1, 2) or self.ydata.shape[-1] != len(self.xdata):
+            raise ValueError("ydata must have shape (len(xdata),) or (n, len(xdata))")
         self.weights = weights
 
         if weights is None:
@@ -439,13 +798,69 @@ class ModelFit:
         self.degrees_of_freedom = len(self.xdata) - self.n_terms - 1
 
     @cached_property
-    def fit(self) -> sm.regression.linear_model.RegressionResults:
-        """The model fit."""
+    def fit(self) -> LeastSquaresResult:
+        """The model fit.
+
+        For the "statsmodels" backend, this is its
+        :class:`~statsmodels.regression.linear_model.RegressionResults`.
+        """
+        if self.backend == "statsmodels":
+            return self._fit_statsmodels()
+
+        # Data vectors are solved for together, as the columns of the right-hand side.
+        basis = self.model.default_basis.T
+        ydata = self.ydata.T
+        if not np.isscalar(self.weights):
+            basis = basis[~self.flags]
+            ydata = ydata[~self.flags]
+
+        whitener, factors, cov_params = self._factorization(basis)
+        params = _SOLVERS[self.backend][1](factors, _whiten(whitener, ydata))
+        return LeastSquaresResult(params, cov_params, ydata - basis @ params)
+
+    def _whitener(self) -> [None, np.ndarray]:
+        """The whitener of the unflagged data (see :func:`_whiten`)."""
+        if np.isscalar(self.weights):
+            return None
+        elif self.weights.ndim == 1:
+            return np.sqrt(self.weights[~self.flags])
+
+        # Whiten with the Cholesky factor of the inverse covariance (like GLS).
+        cov = 1 / self.weights
+        cov = cov[~self.flags][:, ~self.flags]
+        return np.linalg.cholesky(np.linalg.inv(cov)).T
+
+    def _factorization(self, basis: np.ndarray) -> tuple:
+        """Get the whitener, factors and normalized covariance of the fit.
+
+        These only depend on the basis and weights, and are re-used from the
+        :data:`factorization_cache` if they have been computed before.
+        """
+        key = (
+            self.backend,
+            factorization_cache.fingerprint(self.model.default_basis),
+            None
+            if np.isscalar(self.weights)
+            else factorization_cache.fingerprint(self.weights),
+        )
+        factorization = factorization_cache.get(key)
+        if factorization is not None:
+            return factorization
+
+        whitener = self._whitener()
+        factors, cov_params = _SOLVERS[self.backend][0](_whiten(whitener, basis))
+        factorization = (whitener, factors, cov_params)
+        factorization_cache.put(key, factorization)
+        return factorization
+
+    def _fit_statsmodels(self):
+        from statsmodels import api as sm
+
         if np.isscalar(self.weights):
-            model = sm.OLS(self.ydata, self.model.default_basis.T)
+            model = sm.OLS(self.ydata.T, self.model.default_basis.T)
         elif self.weights.ndim == 1:
             model = sm.WLS(
-                self.ydata[~self.flags],
+                self.ydata.T[~self.flags],
                 self.model.default_basis.T[~self.flags],
                 weights=self.weights[~self.flags],
             )
@@ -454,7 +869,7 @@ class ModelFit:
             cov = cov[~self.flags][:, ~self.flags]
 
             model = sm.GLS(
-                self.ydata[~self.flags],
+                self.ydata.T[~self.flags],
                 self.model.default_basis.T[~self.flags],
                 sigma=cov,
             )
@@ -462,8 +877,11 @@ class ModelFit:
 
     @cached_property
     def model_parameters(self):
-        """The best-fit model parameters."""
-        return self.fit.params
+        """The best-fit model parameters.
+
+        If ``ydata`` is 2D, an array of shape ``(n_vectors, n_terms)``.
+        """
+        return np.asarray(self.fit.params).T
 
     def evaluate(self, x: [np.ndarray, None] = None) -> np.ndarray:
         """Evaluate the best-fit model.
@@ -477,12 +895,20 @@ class ModelFit:
         Returns
         -------
         y : np.ndarray
-            The best-fit model evaluated at ``x``.
+            The best-fit model evaluated at ``x``. If ``ydata`` is 2D, the model of
+            each data vector, shape ``(n_vectors, len(x))``.
         """
-        # Set the parameters on the underlying object (solves for them if not solved yet)
-        self.model.parameters = list(self.model_parameters)
         if x is None:
             x = self.xdata
+
+        if self.ydata.ndim == 2:
+            basis = self.model.get_basis(x)
+            return np.array(
+                [self.model(basis=basis, parameters=p) for p in self.model_parameters]
+            )
+
+        # Set the parameters on the underlying object (solves for them if not solved yet)
+        self.model.parameters = list(self.model_parameters)
         return self.model(x)
 
     @cached_property
@@ -492,7 +918,9 @@ class ModelFit:
 
     @cached_property
     def weighted_chi2(self) -> float:
-        """The chi^2 of the weighted fit."""
+        """The chi^2 of the weighted fit (of each data vector, if ydata is 2D)."""
+        if self.ydata.ndim == 2:
+            return np.array([np.dot(r.T, self.weights * r) for r in self.residual])
         return np.dot(self.residual.T, self.weights * self.residual)
 
     def reduced_weighted_chi2(self) -> float:
@@ -507,9 +935,150 @@ class ModelFit:
         """The covariance of the parameter estimates at the solution."""
         return self.fit.normalized_cov_params
 
+    def extend_terms(self, n_new: int) -> Tuple[List[np.ndarray], np.ndarray]:
+        """Fit the model with each of up to ``n_new`` more terms than this fit.
+
+        The QR decomposition of the (whitened) basis of this fit is updated with the
+        columns of each new term in turn, rather than re-fitting from scratch for each
+        number of terms, so fitting every order from ``n_terms`` to
+        ``n_terms + n_new`` costs about as much as a single fit with the most terms.
+        This fit itself (and its model) are unchanged.
+
+        Parameters
+        ----------
+        n_new : int
+            The maximum number of terms to add.
+
+        Returns
+        -------
+        params : list of np.ndarray
+            The best-fit parameters with each number of terms, from ``n_terms`` to
+            ``n_terms + n_new`` (with the same shape as :attr:`model_parameters`).
+        chi2 : np.ndarray
+            The weighted chi^2 of the fit (the squared norm of the whitened residuals)
+            with each number of terms, shape ``(n_new + 1,)`` (or
+            ``(n_new + 1, n_vectors)`` if ``ydata`` is 2D).
+
+        Examples
+        --------
+        Fit each order from 5 to 40:
+
+        >>> fit = ModelFit("polynomial", xdata=x, ydata=y, n_terms=5)
+        >>> params, chi2 = fit.extend_terms(35)
+        """
+        n_terms = self.model.n_terms
+        self.model.update_nterms(n_terms + n_new)
+        basis = self.model.default_basis.T
+        self.model.update_nterms(n_terms)
+
+        ydata = self.ydata.T
+        if not np.isscalar(self.weights):
+            basis = basis[~self.flags]
+            ydata = ydata[~self.flags]
+
+        if self.backend == "qr":
+            whitener, (q, r), _ = self._factorization(basis[:, :n_terms])
+        else:
+            whitener = self._whitener()
+            q, r = np.linalg.qr(_whiten(whitener, basis[:, :n_terms]))
+
+        q, r = _append_qr_columns(q, r, _whiten(whitener, basis[:, n_terms:]))
+
+        y = _whiten(whitener, ydata)
+        qty = q.T @ y
+
+        # The residual of each order is that of the previous order, minus the
+        # projection of the data onto the new orthonormal column.
+        resid = y - q[:, :n_terms] @ qty[:n_terms]
+        params = [linalg.solve_triangular(r[:n_terms, :n_terms], qty[:n_terms]).T]
+        chi2 = [np.sum(resid ** 2, axis=0)]
+        for i in range(n_terms, n_terms + n_new):
+            resid -= np.multiply.outer(q[:, i], qty[i])
+            params.append(linalg.solve_triangular(r[: i + 1, : i + 1], qty[: i + 1]).T)
+            chi2.append(np.sum(resid ** 2, axis=0))
+
+        return params, np.array(chi2)
+
     def reset(self):
         """Resets the fit."""
         del self.residual
         del self.weighted_chi2
         del self.model_parameters
         del self.fit
+
+
+class ComplexModelFit(ModelFit):
+    def __init__(
+        self,
+        model_type: [str, Type[Model], Model],
+        *,
+        ydata: np.ndarray,
+        polar: bool = False,
+        **kwargs,
+    ):
+        """A fit of a real model to complex data.
+
+        The two real parts of the data (real and imaginary, or magnitude and phase) are
+        fit with the same basis in a single solve (see :class:`ModelFit`), and the
+        model evaluates directly to complex values.
+
+        Parameters
+        ----------
+        model_type
+            The type of model to fit to the data.
+        ydata
+            The complex values of the measured data (1D).
+        polar
+            Whether to fit the magnitude and (unwrapped) phase of the data, rather than
+            its real and imaginary parts.
+        kwargs
+            All other arguments are passed to :class:`ModelFit`.
+
+        Raises
+        ------
+        ValueError
+            If ``ydata`` is not 1D.
+        """
+        ydata = np.asarray(ydata)
+        if ydata.ndim != 1:
+            raise ValueError("ydata must be 1D for a complex model fit")
+
+        self.polar = polar
+        self.complex_ydata = ydata
+        if polar:
+            parts = [np.abs(ydata), np.unwrap(np.angle(ydata))]
+        else:
+            parts = [ydata.real, ydata.imag]
+
+        super().__init__(model_type, ydata=np.array(parts), **kwargs)
+
+    def evaluate(self, x: [np.ndarray, None] = None) -> np.ndarray:
+        """Evaluate the best-fit complex model.
+
+        Parameters
+        ----------
+        x : np.ndarray, optional
+            The co-ordinates at which to evaluate the model. By default, use the input
+            data co-ordinates.
+
+        Returns
+        -------
+        y : np.ndarray
+            The complex best-fit model evaluated at ``x``.
+        """
+        first, second = super().evaluate(x)
+        if self.polar:
+            return first * np.exp(1j * second)
+        return first + 1j * second
+
+    __call__ = evaluate
+
+    @cached_property
+    def residual(self) -> np.ndarray:
+        """Complex residuals of data to model."""
+        return self.complex_ydata - self.evaluate()
+
+    @cached_property
+    def weighted_chi2(self) -> float:
+        """The chi^2 of the weighted fit, in the complex plane."""
+        return np.dot(self.residual.conj(), self.weights * self.residual).real
@@ -8,7 +8,7 @@ from pathlib import Path
 from typing import Tuple
 
 from . import reflection_coefficient as rc
-from .modelling import Model, ModelFit
+from .modelling import ComplexModelFit, Model
 
 
 def _get_parameters_at_temperature(data_path, temp):
@@ -197,9 +197,7 @@ def get_switch_correction(
     ):
         model.update_nterms(n)
 
-        fits[kind] = ModelFit(model, ydata=np.real(val)).evaluate(
-            fn_in
-        ) + 1j * ModelFit(model, ydata=np.imag(val)).evaluate(fn_in)
+        fits[kind] = ComplexModelFit(model, ydata=val).evaluate(fn_in)
 
     # Corrected antenna S11
     return rc.gamma_de_embed(fits["s11"], fits["s12s21"], fits["s22"], ant_s11), fits
@@ -1,12 +1,95 @@
 """Functions for excising RFI."""
+import copy
+import functools
+import hashlib
+import inspect
 import numpy as np
+import os
+import time
+import tracemalloc
 import warnings
 import yaml
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy import ndimage
-from typing import Tuple
+from typing import Callable, List, Tuple
 
+from .flags import FlagProvenance, PackedFlags
 from .modelling import Model, ModelFit
 
+try:
+    from . import _xrfi_numba
+except ImportError:
+    _xrfi_numba = None
+
+# Maximum number of window elements to hold in memory at once in the sliding-window
+# filter engines.
+_WINDOW_CHUNK_SIZE = 2 ** 22
+
+# The backend for the loops that cannot be cleanly vectorized with numpy (the flagged
+# median filter, the watershed and the model sweep): either "numba" (compiled kernels,
+# the default if numba is installed) or "numpy". Both give identical flags.
+BACKEND = "numba" if _xrfi_numba is not None else "numpy"
+
+
+def _use_numba() -> bool:
+    """Whether to use the numba kernels, according to :data:`BACKEND`."""
+    if BACKEND not in ("numba", "numpy"):
+        raise ValueError(f"BACKEND must be 'numba' or 'numpy', got '{BACKEND}'")
+    if BACKEND == "numba" and _xrfi_numba is None:
+        raise ImportError("numba must be installed to use the 'numba' backend")
+    return BACKEND == "numba"
+
+
+def _accepts_packed_flags(returns_flags: bool = True):
+    """Allow the ``flags`` passed to a function to be :class:`~.flags.PackedFlags`.
+
+    The function is run on the unpacked flags, and any in-place updates it makes to
+    them are packed back into the input. If ``returns_flags``, the returned flags
+    (the first returned value, if a tuple) are also packed.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        var_kw = [
+            name
+            for name, param in signature.parameters.items()
+            if param.kind == param.VAR_KEYWORD
+        ]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not any(
+                isinstance(arg, PackedFlags) for arg in args + tuple(kwargs.values())
+            ):
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            arguments = bound.arguments
+            if "flags" not in signature.parameters and var_kw:
+                arguments = arguments.get(var_kw[0], {})
+
+            packed = arguments.get("flags")
+            if not isinstance(packed, PackedFlags):
+                return func(*args, **kwargs)
+
+            flags = packed.to_bool()
+            arguments["flags"] = flags
+            result = func(*bound.args, **bound.kwargs)
+            packed.bits[...] = np.packbits(flags, axis=-1)
+
+            if not returns_flags:
+                return result
+
+            out = result[0] if isinstance(result, tuple) else result
+            out = packed if out is flags else PackedFlags.from_bool(out)
+            return (out,) + result[1:] if isinstance(result, tuple) else out
+
+        return wrapper
+
+    return decorator
+
 
 def _check_convolve_dims(data, half_size: [None, Tuple[int, None]] = None):
     """Check the kernel sizes to be used in various convolution-like operations.
@@ -55,7 +138,7 @@ def _check_convolve_dims(data, half_size: [None, Tuple[int, None]] = None):
     return tuple(out)
 
 
-def robust_divide(num, den):
+def robust_divide(num, den, out=None):
     """Prevent division by zero.
 
     This function will compute division between two array-like objects by setting
@@ -69,6 +152,9 @@ def robust_divide(num, den):
         The numerator.
     den : array
         The denominator.
+    out : array, optional
+        An array in which to put the result. It may be ``num`` itself, to divide in
+        place.
 
     Returns
     -------
@@ -78,16 +164,357 @@ def robust_divide(num, den):
     """
     thresh = np.finfo(den.dtype).eps
 
-    den_mask = np.abs(den) > thresh
+    small = np.abs(den) <= thresh
 
-    out = np.true_divide(num, den, where=den_mask)
-    out[~den_mask] = np.inf
+    out = np.true_divide(num, den, where=~small, out=out)
 
     # If numerator is also small, set to zero (better for smooth stuff)
-    out[~den_mask & (np.abs(num) <= thresh)] = 0
+    out[small] = np.where(np.abs(num[small]) <= thresh, 0, np.inf)
+    return out
+
+
+def _get_buffer(workspace: [None, dict], name: str, like: np.ndarray) -> np.ndarray:
+    """Get a floating-point buffer of the shape of ``like`` from a workspace.
+
+    The buffer is allocated (and saved in the workspace) only if the workspace doesn't
+    already have one of the right shape and type.
+    """
+    dtype = np.promote_types(like.dtype, np.float16)
+    if workspace is None:
+        return np.empty(like.shape, dtype=dtype)
+
+    buffer = workspace.get(name)
+    if buffer is None or buffer.shape != like.shape or buffer.dtype != dtype:
+        buffer = workspace[name] = np.empty(like.shape, dtype=dtype)
+    return buffer
+
+
+def _fused_significance(
+    resid: np.ndarray, var: np.ndarray, factor: float = 1.0, out=None
+) -> np.ndarray:
+    """Compute ``robust_divide(resid, sqrt(var / factor))`` without full-size temporaries.
+
+    The result is computed in blocks along the first axis, and may be written into
+    ``resid`` itself. It is identical to the unfused expression.
+    """
+    if out is None:
+        out = np.empty(resid.shape, dtype=np.result_type(resid, var))
+    if resid.ndim == 0:
+        out[...] = robust_divide(resid, np.sqrt(var / factor))
+        return out
+
+    step = max(1, _WINDOW_CHUNK_SIZE // max(1, int(np.prod(resid.shape[1:]))))
+    for start in range(0, len(resid), step):
+        block = slice(start, start + step)
+        robust_divide(resid[block], np.sqrt(var[block] / factor), out=out[block])
+    return out
+
+
+def _normalize_kernel(data, size, origin=0):
+    """Get the kernel size and origin as tuples with one entry per dimension."""
+    size = (size,) * data.ndim if np.isscalar(size) else tuple(size)
+    origin = (origin,) * data.ndim if np.isscalar(origin) else tuple(origin)
+
+    if len(size) != data.ndim or len(origin) != data.ndim:
+        raise ValueError(
+            "Number of kernel dimensions does not match number of data dimensions."
+        )
+
+    for s, o in zip(size, origin):
+        if s < 1:
+            raise ValueError("Kernel size must be at least one in every dimension.")
+        if not -(s // 2) <= o <= (s - 1) // 2:
+            raise ValueError("Invalid origin: the origin must be within the kernel.")
+
+    return tuple(int(s) for s in size), tuple(int(o) for o in origin)
+
+
+def _extension_indices(n: int, size: int, mode: str, origin: int = 0) -> np.ndarray:
+    """Get indices into a line of length ``n`` extended for a filter of ``size``.
+
+    The extension follows the boundary ``mode`` conventions of ``scipy.ndimage``. Indices
+    falling outside the line in 'constant' mode are set to ``n``, so that the caller can
+    append the constant value to the end of the line.
+    """
+    left = size // 2 + origin
+    c = np.arange(-left, n + size - 1 - left)
+
+    if mode == "nearest":
+        return np.clip(c, 0, n - 1)
+    elif mode == "wrap":
+        return c % n
+    elif mode == "reflect":
+        c = c % (2 * n)
+        return np.where(c >= n, 2 * n - 1 - c, c)
+    elif mode == "mirror":
+        if n == 1:
+            return np.zeros_like(c)
+        c = c % (2 * n - 2)
+        return np.where(c >= n, 2 * n - 2 - c, c)
+    elif mode == "constant":
+        return np.where((c < 0) | (c >= n), n, c)
+    else:
+        raise ValueError(f"Unknown filter mode '{mode}'.")
+
+
+def _extend_for_filter(data, size, mode, cval=0.0, origin=0):
+    """Pad an array on every side so that each filter window is a contiguous block."""
+    if mode != "constant" and data.size:
+        # Gather the extended array in one go, rather than one copy per axis.
+        return data[
+            np.ix_(
+                *(
+                    _extension_indices(n, s, mode, o)
+                    for n, s, o in zip(data.shape, size, origin)
+                )
+            )
+        ]
+
+    out = data
+    for axis, (n, s, o) in enumerate(zip(data.shape, size, origin)):
+        if mode == "constant":
+            shape = list(out.shape)
+            shape[axis] = 1
+            out = np.concatenate(
+                (out, np.full(shape, cval, dtype=out.dtype)), axis=axis
+            )
+
+        out = np.take(out, _extension_indices(n, s, mode, o), axis=axis)
+    return out
+
+
+def _masked_window_median(windows: np.ndarray) -> np.ndarray:
+    """Compute the median of each row of a 2D array, ignoring NaNs.
+
+    Equivalent to ``np.nanmedian(windows, axis=1)``, but without sorting each window.
+    Ignored entries are replaced with an equal number of -inf and +inf values (up to
+    the parity of the number of valid entries), such that the median of the valid
+    entries always falls at the two central ranks of the full window. A single
+    partition of the window then yields the result. Note that ``windows`` is
+    overwritten.
+    """
+    n_windows, width = windows.shape
+
+    invalid = np.isnan(windows)
+    n_valid = width - np.sum(invalid, axis=1)
+
+    if width == 1:
+        return windows[:, 0]
+
+    # Put the first n_neg invalid entries of each window at -inf, the rest at +inf.
+    n_neg = width // 2 - n_valid // 2
+    rank = np.cumsum(invalid, axis=1, dtype=np.int32)
+    windows[invalid] = np.inf
+    windows[invalid & (rank <= n_neg[:, None])] = -np.inf
+
+    kth = width // 2
+    windows.partition((kth - 1, kth), axis=1)
+
+    lo, hi = windows[:, kth - 1], windows[:, kth]
+    with np.errstate(invalid="ignore"):
+        med = np.where(n_valid % 2, hi, (lo + hi) / 2)
+
+    med[n_valid == 0] = np.nan
+    return med
+
+
+@_accepts_packed_flags(returns_flags=False)
+def flagged_median_filter(
+    data: np.ndarray,
+    size: [int, Tuple[int]],
+    flags: [None, np.ndarray] = None,
+    mode: str = "nearest",
+    cval: float = 0.0,
+    origin: [int, Tuple[int]] = 0,
+    where: [None, np.ndarray] = None,
+    out: [None, np.ndarray] = None,
+):
+    """Perform a running median filter over data, ignoring flagged samples.
+
+    This gives the same results as using ``scipy.ndimage.generic_filter`` with
+    ``np.nanmedian`` (after setting flagged data to NaN), but all windows are
+    processed with vectorized operations, rather than calling a Python function
+    for each window.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The data to filter. Can be of arbitrary dimension.
+    size : int or tuple
+        The size of the filtering kernel. If tuple, one entry per dimension in `data`.
+    flags : np.ndarray or :class:`~.flags.PackedFlags`, optional
+        A boolean array (same shape as ``data``) specifying data to omit from the
+        filter. NaN values in ``data`` are also ignored.
+    mode : str, optional
+        How to extend the data beyond its boundaries. See
+        ``scipy.ndimage.generic_filter`` for details on the available modes.
+    cval : float, optional
+        Value with which to extend the data if ``mode='constant'``.
+    origin : int or tuple, optional
+        Placement of the filter window. See ``scipy.ndimage.generic_filter``.
+    where : np.ndarray, optional
+        A boolean array (same shape as ``data``). If given, the filter is only
+        evaluated at positions where this is True, and the remaining entries of
+        ``out`` are left untouched. This is useful for cheaply updating a filtered
+        array when only a few samples have changed.
+    out : np.ndarray, optional
+        An array (same shape as ``data``) into which to write the result.
+
+    Returns
+    -------
+    np.ndarray :
+        The filtered array, of the same shape and type as ``data``. Windows in which
+        all data are flagged are NaN.
+    """
+    size, origin = _normalize_kernel(data, size, origin)
+    window_size = int(np.prod(size))
+
+    if out is None:
+        out = np.empty(data.shape, dtype=data.dtype)
+
+    # Always do the calculation in double precision, as nanmedian would.
+    extended = _extend_for_filter(data, size, mode, cval, origin).astype(
+        float, copy=False
+    )
+    if flags is not None:
+        extended[_extend_for_filter(flags, size, mode, False, origin)] = np.nan
+
+    if data.ndim <= 2 and _use_numba():
+        # The kernels filter 2D arrays, so treat a 1D array as a single row.
+        row = (None,) * (2 - data.ndim)
+        s0, s1 = (1,) * len(row) + size
+        if where is None:
+            _xrfi_numba.median_filter(extended[row], s0, s1, out[row])
+        else:
+            indices = np.nonzero(np.atleast_2d(where))
+            _xrfi_numba.median_filter_at(extended[row], s0, s1, *indices, out[row])
+        return out
+
+    windows = sliding_window_view(extended, size)
+
+    if where is not None:
+        indices = np.nonzero(where)
+        step = max(1, _WINDOW_CHUNK_SIZE // window_size)
+        for start in range(0, len(indices[0]), step):
+            index = tuple(indx[start : start + step] for indx in indices)
+            out[index] = _masked_window_median(
+                windows[index].reshape((-1, window_size))
+            )
+        return out
+
+    if not data.size:
+        return out
+
+    row_size = window_size * int(np.prod(data.shape[1:]))
+    step = max(1, _WINDOW_CHUNK_SIZE // row_size)
+    for start in range(0, data.shape[0], step):
+        chunk = np.array(windows[start : start + step]).reshape((-1, window_size))
+        out[start : start + step] = _masked_window_median(chunk).reshape(
+            out[start : start + step].shape
+        )
+
+    return out
+
+
+@_accepts_packed_flags(returns_flags=False)
+def flagged_mean_filter(
+    data: np.ndarray,
+    size: [int, Tuple[int]],
+    flags: [None, np.ndarray] = None,
+    mode: str = "nearest",
+    cval: float = 0.0,
+    origin: [int, Tuple[int]] = 0,
+    out: [None, np.ndarray] = None,
+):
+    """Perform a running mean (boxcar) filter over data, ignoring flagged samples.
+
+    The masked mean in each window is computed as the windowed mean of the (zeroed)
+    data divided by the windowed mean of the unflagged samples, both of which are
+    running means (``scipy.ndimage.uniform_filter``), so this gives the same results
+    (up to floating point round-off) as ``scipy.ndimage.generic_filter`` with
+    ``np.nanmean``, but at a cost linear in the size of the data (and independent of
+    the size of the kernel).
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The data to filter. Can be of arbitrary dimension.
+    size : int or tuple
+        The size of the filtering kernel. If tuple, one entry per dimension in `data`.
+    flags : np.ndarray or :class:`~.flags.PackedFlags`, optional
+        A boolean array (same shape as ``data``) specifying data to omit from the
+        filter. NaN values in ``data`` are also ignored.
+    mode : str, optional
+        How to extend the data beyond its boundaries. See
+        ``scipy.ndimage.generic_filter`` for details on the available modes.
+    cval : float, optional
+        Value with which to extend the data if ``mode='constant'``.
+    origin : int or tuple, optional
+        Placement of the filter window. See ``scipy.ndimage.generic_filter``.
+    out : np.ndarray, optional
+        An array (same shape as ``data``) into which to write the result. It may be
+        ``data`` itself.
+
+    Returns
+    -------
+    np.ndarray :
+        The filtered array, of the same shape and type as ``data``. Windows in which
+        all data are flagged are NaN.
+    """
+    size, origin = _normalize_kernel(data, size, origin)
+    n_window = int(np.prod(size))
+
+    def window_mean(x, c):
+        return ndimage.uniform_filter(
+            x.astype(float), size=size, mode=mode, cval=c, origin=origin
+        )
+
+    def window_count(x, c):
+        # Running means of zeros and ones are only exact up to round-off.
+        return np.rint(window_mean(x, float(c)) * n_window)
+
+    unflagged = ~flags if flags is not None else np.ones(data.shape, dtype=bool)
+    finite = np.isfinite(data)
+    valid = unflagged & finite
+
+    total = window_mean(np.where(valid, data, 0), np.nan_to_num(cval))
+    weight = window_mean(valid, float(np.isfinite(cval)))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.divide(total, weight, out=total)
+    mean[np.rint(weight * n_window) == 0] = np.nan
+    del weight
+
+    # Infinite (unflagged) data dominate any window they are in, just like for nanmean.
+    if not np.all(finite | ~unflagged) or np.isinf(cval):
+        pos = window_count(unflagged & (data == np.inf), cval == np.inf)
+        neg = window_count(unflagged & (data == -np.inf), cval == -np.inf)
+        mean[pos > 0] = np.inf
+        mean[neg > 0] = -np.inf
+        mean[(pos > 0) & (neg > 0)] = np.nan
+
+    if out is None:
+        return mean.astype(data.dtype, copy=False)
+    out[...] = mean
     return out
 
 
+def _get_default_mode(data: np.ndarray, size: [int, Tuple[int]]) -> str:
+    """Get the default filter mode for :func:`flagged_filter`."""
+    if (isinstance(size, int) and size >= min(data.shape)) or (
+        isinstance(size, tuple) and any(s > d for s, d in zip(size, data.shape))
+    ):
+        return "reflect"
+    else:
+        return "nearest"
+
+
+def _changed_windows(changed: np.ndarray, size: Tuple[int], mode: str) -> np.ndarray:
+    """Find the filter windows that contain at least one changed sample."""
+    return ndimage.maximum_filter(changed, size=size, mode=mode, cval=False)
+
+
+@_accepts_packed_flags(returns_flags=False)
 def flagged_filter(
     data: np.ndarray,
     size: [int, Tuple[int]],
@@ -95,6 +522,8 @@ def flagged_filter(
     flags: [None, np.ndarray] = None,
     mode: [None, str] = None,
     interp_flagged=True,
+    engine: str = "sliding",
+    out: [None, np.ndarray] = None,
     **kwargs,
 ):
     """
@@ -111,7 +540,7 @@ def flagged_filter(
         The function to apply in each window. Typical options are `mean` and `median`.
         For this function to work, the function kind chosen here must have a corresponding
         `nan<function>` implementation in numpy.
-    flags : np.ndarray, optional
+    flags : np.ndarray or :class:`~.flags.PackedFlags`, optional
         A boolean array specifying data to omit from the filtering.
     mode : str, optional
         The mode of the filter. See ``scipy.ndimage.generic_filter`` for details. By default,
@@ -119,6 +548,15 @@ def flagged_filter(
     interp_flagged : bool, optional
         Whether to fill in flagged entries with its filtered value. Otherwise,
         flagged entries are set to their original value.
+    engine : str, optional
+        The engine to use for a flagged median or mean filter. By default, use the
+        vectorized :func:`flagged_median_filter` or :func:`flagged_mean_filter`. Set
+        to 'generic' to use ``scipy.ndimage.generic_filter`` (which is much slower,
+        but gives the same result). Other kinds of filter always use the generic
+        filter.
+    out : np.ndarray, optional
+        An array (same shape as ``data``) into which to write the result. It may be
+        ``data`` itself.
     kwargs :
         Other options to pass to the generic filter function.
 
@@ -153,17 +591,32 @@ def flagged_filter(
     Finally, flags near the edges can have strange behaviour, depending on the mode.
     """
     if mode is None:
-        if (isinstance(size, int) and size >= min(data.shape)) or (
-            isinstance(size, tuple) and any(s > d for s, d in zip(size, data.shape))
-        ):
+        mode = _get_default_mode(data, size)
+        if mode == "reflect":
             warnings.warn(
                 "Setting default mode to reflect because a large size was set."
             )
-            mode = "reflect"
-        else:
-            mode = "nearest"
 
-    if flags is not None and np.any(flags):
+    if engine not in ("sliding", "generic"):
+        raise ValueError("engine must be 'sliding' or 'generic'")
+
+    fast_filters = {"median": flagged_median_filter, "mean": flagged_mean_filter}
+
+    if (
+        flags is not None
+        and np.any(flags)
+        and kind in fast_filters
+        and engine == "sliding"
+    ):
+        assert flags.shape == data.shape
+        orig_flagged_data = None if interp_flagged else data[flags]
+        filtered = fast_filters[kind](
+            data, size, flags=flags, mode=mode, out=out, **kwargs
+        )
+        if not interp_flagged:
+            filtered[flags] = orig_flagged_data
+
+    elif flags is not None and np.any(flags):
         fnc = getattr(np, "nan" + kind)
         assert flags.shape == data.shape
         orig_flagged_data = data[flags].copy()
@@ -173,20 +626,35 @@ def flagged_filter(
             filtered[flags] = orig_flagged_data
         data[flags] = orig_flagged_data
 
+        if out is not None:
+            out[...] = filtered
+            filtered = out
+
     else:
         if kind == "mean":
             kind = "uniform"
+
+        # ndimage can't filter in place, so filter into a new array in that case.
+        in_place = out is not None and np.shares_memory(out, data)
         filtered = getattr(ndimage, kind + "_filter")(
-            data, size=size, mode=mode, **kwargs
+            data, size=size, mode=mode, output=None if in_place else out, **kwargs
         )
+        if out is not None:
+            if in_place:
+                out[...] = filtered
+            filtered = out
 
     return filtered
 
 
+@_accepts_packed_flags(returns_flags=False)
 def detrend_medfilt(
     data: np.ndarray,
     flags: [None, np.ndarray] = None,
     half_size: [None, Tuple[int, None]] = None,
+    cache: [None, dict] = None,
+    out: [None, np.ndarray] = None,
+    workspace: [None, dict] = None,
 ):
     """Detrend array using a median filter.
 
@@ -196,7 +664,7 @@ def detrend_medfilt(
     ----------
     data : array
         Data to detrend. Can be an array of any number of dimensions.
-    flags : boolean array, optional
+    flags : boolean array or :class:`~.flags.PackedFlags`, optional
         Flags specifying data to ignore in the detrend. If not given, don't ignore
         anything.
     half_size : tuple of int/None
@@ -205,6 +673,20 @@ def detrend_medfilt(
         applying the detrending for each subarray along that axis. Value of None will
         effectively (but slowly) perform a median along the entire axis before running
         the kernel over the other axis.
+    cache : dict, optional
+        A dictionary in which to keep the filtered median and local MAD between calls.
+        Pass an empty dict on the first call, and the same dict on subsequent calls
+        with the *same* ``data`` but updated ``flags``: only the windows that overlap
+        samples whose flags have changed will be re-computed. If the shape or type of
+        the data (or the kernel) differ from those of the cached filter, the detrend is
+        computed from scratch, replacing the cache.
+    out : array, optional
+        An array (same shape as ``data``) into which to write the significance.
+    workspace : dict, optional
+        A dictionary of scratch buffers. Pass an empty dict on the first call, and
+        the same dict on subsequent calls on data of the same shape, so that no new
+        full-size arrays are allocated (besides those inside the median filter). The
+        same workspace can be shared with :func:`detrend_meanfilt`.
 
     Returns
     -------
@@ -231,9 +713,22 @@ def detrend_medfilt(
     half_size = _check_convolve_dims(data, half_size)
     size = tuple(2 * s + 1 for s in half_size)
 
-    d_sm = flagged_filter(data, size=size, kind="median", flags=flags)
-    d_rs = data - d_sm
-    d_sq = d_rs ** 2
+    # The cached filter can only be updated for the same kernel and kind of data.
+    cache_key = (size, data.shape, data.dtype)
+    if cache is not None and cache.get("key") == cache_key:
+        return _update_detrend_medfilt(data, flags, size, cache, out, workspace)
+
+    if cache is None:
+        # The median is not needed once we have the residuals, so the MAD can be
+        # filtered into the same buffer.
+        d_sm = d_mad = _get_buffer(workspace, "filtered", data)
+    else:
+        d_sm = _get_buffer(cache, "median", data)
+        d_mad = _get_buffer(cache, "mad", data)
+
+    flagged_filter(data, size=size, kind="median", flags=flags, out=d_sm)
+    d_rs = np.subtract(data, d_sm, out=out)
+    d_sq = np.square(d_rs, out=d_mad)
 
     # Remember that d_sq will be zero for any window in which the data is monotonic (but
     # could also be zero for non-monotonic windows where the two halves of the window
@@ -243,17 +738,64 @@ def detrend_medfilt(
     # monotonic. Nevertheless, any RFI that is large enough will cause the value of
     # that channel to *not* be the central value, and it will have d_sq > 0.
 
+    flagged_filter(d_sq, size=size, kind="median", flags=flags, out=d_mad)
+
+    if cache is not None:
+        cache.update(
+            key=cache_key,
+            flags=np.zeros(data.shape, dtype=bool) if flags is None else flags.copy(),
+        )
+
     # Factor of .456 is to put mod-z scores on same scale as standard deviation.
-    sig = np.sqrt(flagged_filter(d_sq, size=size, kind="median", flags=flags) / 0.456)
+    # Don't divide by zero, instead turn those entries into +inf.
+    return _fused_significance(d_rs, d_mad, 0.456, out=d_rs)
 
-    # don't divide by zero, instead turn those entries into +inf
-    return robust_divide(d_rs, sig)
+
+def _update_detrend_medfilt(data, flags, size, cache, out=None, workspace=None):
+    """Update a previous :func:`detrend_medfilt` for a new set of flags."""
+    if flags is None:
+        flags = np.zeros(data.shape, dtype=bool)
+
+    mode = _get_default_mode(data, size)
+    d_sm = cache["median"]
+    d_mad = cache["mad"]
+
+    # Windows whose set of unflagged data has changed need a new median.
+    changed = flags ^ cache["flags"]
+    if np.any(changed):
+        affected = _changed_windows(changed, size, mode)
+        old = d_sm[affected]
+        flagged_median_filter(
+            data, size, flags=flags, mode=mode, where=affected, out=d_sm
+        )
+
+        # The MAD changes wherever the flags, or the median (and so d_sq) changed.
+        moved = changed.copy()
+        moved[affected] |= d_sm[affected] != old
+        affected = _changed_windows(moved, size, mode)
+    else:
+        affected = None
+
+    d_rs = np.subtract(data, d_sm, out=out)
+    if affected is not None:
+        d_sq = np.square(d_rs, out=_get_buffer(workspace, "filtered", data))
+        flagged_median_filter(
+            d_sq, size, flags=flags, mode=mode, where=affected, out=d_mad
+        )
+
+    np.copyto(cache["flags"], flags)
+
+    # Factor of .456 is to put mod-z scores on same scale as standard deviation.
+    return _fused_significance(d_rs, d_mad, 0.456, out=d_rs)
 
 
+@_accepts_packed_flags(returns_flags=False)
 def detrend_meanfilt(
     data: np.ndarray,
     flags: [None, np.ndarray] = None,
     half_size: [None, Tuple[int, None]] = None,
+    out: [None, np.ndarray] = None,
+    workspace: [None, dict] = None,
 ):
     """Detrend array using a mean filter.
 
@@ -261,7 +803,7 @@ def detrend_meanfilt(
     ----------
     data : array
         Data to detrend. Can be an array of any number of dimensions.
-    flags : boolean array, optional
+    flags : boolean array or :class:`~.flags.PackedFlags`, optional
         Flags specifying data to ignore in the detrend. If not given, don't ignore
         anything.
     half_size : tuple of int/None
@@ -270,6 +812,10 @@ def detrend_meanfilt(
         applying the detrending for each subarray along that axis. Value of None will
         effectively (but slowly) perform a median along the entire axis before running
         the kernel over the other axis.
+    out : array, optional
+        An array (same shape as ``data``) into which to write the significance.
+    workspace : dict, optional
+        A dictionary of scratch buffers, as for :func:`detrend_medfilt`.
 
     Returns
     -------
@@ -285,17 +831,24 @@ def detrend_meanfilt(
     half_size = _check_convolve_dims(data, half_size)
     size = tuple(2 * s + 1 for s in half_size)
 
-    d_sm = flagged_filter(data, size=size, kind="mean", flags=flags)
-    d_rs = data - d_sm
-    d_sq = d_rs ** 2
-
-    # Factor of .456 is to put mod-z scores on same scale as standard deviation.
-    sig = np.sqrt(flagged_filter(d_sq, size=size, kind="mean", flags=flags))
+    # The mean is not needed once we have the residuals, so the variance can be
+    # filtered into the same buffer.
+    d_sm = _get_buffer(workspace, "filtered", data)
+    flagged_filter(data, size=size, kind="mean", flags=flags, out=d_sm)
+    d_rs = np.subtract(data, d_sm, out=out)
+    d_var = np.square(d_rs, out=d_sm)
+    flagged_filter(d_var, size=size, kind="mean", flags=flags, out=d_var)
 
     # don't divide by zero, instead turn those entries into +inf
-    return robust_divide(d_rs, sig)
+    return _fused_significance(d_rs, d_var, out=d_rs)
 
 
+def _outside(significance: np.ndarray, threshold: float) -> np.ndarray:
+    """Find where ``abs(significance) > threshold``, without a temporary float array."""
+    return (significance > threshold) | (significance < -threshold)
+
+
+@_accepts_packed_flags()
 def xrfi_medfilt(
     spectrum: np.ndarray,
     threshold: float = 6,
@@ -307,6 +860,8 @@ def xrfi_medfilt(
     poly_order=0,
     accumulate=False,
     use_meanfilt=True,
+    incremental=True,
+    provenance: [None, FlagProvenance] = None,
 ):
     """Generate RFI flags for a given spectrum using a median filter.
 
@@ -320,8 +875,9 @@ def xrfi_medfilt(
         `kt=0`.
     threshold : float, optional
         Number of effective sigma at which to clip RFI.
-    flags : array-like, optional
-        Boolean array of pre-existing flagged data to ignore in the filtering.
+    flags : array-like or :class:`~.flags.PackedFlags`, optional
+        Boolean array of pre-existing flagged data to ignore in the filtering. If
+        packed, the returned flags are also packed.
     kt, kf : tuple of int/None
         The half-size of the kernel to convolve (eg. kernel size over frequency
         will be ``2*kt+1``).
@@ -349,6 +905,14 @@ def xrfi_medfilt(
         good at getting RFI, but can also pick up non-RFI if the spectrum is steep
         compared to the noise. The mean filter is better at only getting RFI if the RFI
         has already been flagged.
+    incremental : bool, optional
+        Whether to keep the median filter from the previous iteration and only update
+        the windows that contain samples whose flags have changed. This gives the same
+        flags as re-computing the filter over the whole spectrum, but is much faster
+        when only a few new flags are found on each iteration. It is not used if
+        ``poly_order > 0``, since then the detrended data change between iterations.
+    provenance : :class:`~.flags.FlagProvenance`, optional
+        If given, the flags of each iteration are recorded in it (as stage "medfilt").
 
     Returns
     -------
@@ -392,6 +956,11 @@ def xrfi_medfilt(
     resid = spectrum.copy()
 
     size = (kf,) if spectrum.ndim == 1 else (kt, kf)
+    medfilt_cache = {} if incremental else None
+
+    # Buffers that are re-used on every iteration.
+    workspace = {}
+    med_significance = significance = None
     while ii < max_iter and np.sum(new_flags) > nflags:
         nflags = np.sum(new_flags)
 
@@ -413,27 +982,44 @@ def xrfi_medfilt(
                 spectrum[~new_flags]
                 - ModelFit(
                     "polynomial",
-                    f[~new_flags],
-                    spectrum[~new_flags],
+                    xdata=f[~new_flags],
+                    ydata=spectrum[~new_flags],
                     n_terms=poly_order,
                 ).evaluate()
             )
             resid_list.append(resid)
+            medfilt_cache = None
         else:
             resid = spectrum
 
-        med_significance = detrend_medfilt(resid, half_size=size, flags=new_flags)
+        med_significance = detrend_medfilt(
+            resid,
+            half_size=size,
+            flags=new_flags,
+            cache=medfilt_cache,
+            out=med_significance,
+            workspace=workspace,
+        )
 
         if use_meanfilt:
-            medfilt_flags = np.abs(med_significance) > threshold
-            significance = detrend_meanfilt(resid, half_size=size, flags=medfilt_flags)
+            medfilt_flags = _outside(med_significance, threshold)
+            significance = detrend_meanfilt(
+                resid,
+                half_size=size,
+                flags=medfilt_flags,
+                out=significance,
+                workspace=workspace,
+            )
         else:
             significance = med_significance
 
         if accumulate:
-            new_flags |= np.abs(significance) > threshold
+            new_flags |= _outside(significance, threshold)
         else:
-            new_flags = np.abs(significance) > threshold
+            new_flags = _outside(significance, threshold)
+
+        if provenance is not None:
+            provenance.record(new_flags, "medfilt", ii)
 
         ii += 1
         nflags_list.append(np.sum(new_flags))
@@ -453,6 +1039,243 @@ def xrfi_medfilt(
     )
 
 
+def _sumthreshold_pass(
+    significance: np.ndarray, flags: np.ndarray, width: int, threshold: float, axis: int
+) -> np.ndarray:
+    """Flag every run of ``width`` samples along an axis whose mean exceeds threshold.
+
+    Flagged samples are excluded from the runs, i.e. a run is flagged if the sum of
+    its unflagged samples is larger than ``threshold`` times their number.
+    """
+    n = significance.shape[axis]
+    if width > n:
+        return np.zeros_like(flags)
+
+    values = np.moveaxis(np.where(flags, 0, significance), axis, -1)
+    counts = np.moveaxis((~flags).astype(int), axis, -1)
+
+    # Sums over each run of samples, from the difference of cumulative sums.
+    pad = [(0, 0)] * (values.ndim - 1) + [(1, 0)]
+    sums = np.cumsum(np.pad(values, pad), axis=-1)
+    sums = sums[..., width:] - sums[..., :-width]
+    counts = np.cumsum(np.pad(counts, pad), axis=-1)
+    counts = counts[..., width:] - counts[..., :-width]
+
+    hits = ((np.abs(sums) > threshold * counts) & (counts > 0)).astype(int)
+
+    # A sample is flagged if any of the runs containing it is flagged.
+    pad = [(0, 0)] * (hits.ndim - 1) + [(width, width - 1)]
+    n_hits = np.cumsum(np.pad(hits, pad), axis=-1)
+    new_flags = n_hits[..., width:] - n_hits[..., :-width] > 0
+
+    return np.moveaxis(new_flags, -1, axis)
+
+
+@_accepts_packed_flags()
+def xrfi_sumthreshold(
+    spectrum: np.ndarray,
+    threshold: float = 6,
+    flags: [None, np.ndarray] = None,
+    kf: [int, None] = 8,
+    kt: [int, None] = 8,
+    n_levels: int = 7,
+    rho: float = 1.5,
+    detrend: bool = True,
+    inplace: bool = True,
+):
+    r"""Generate RFI flags using the SumThreshold algorithm.
+
+    Runs of 1, 2, 4, ... samples (along frequency, and also time in 2D) are flagged if
+    their mean significance exceeds a threshold that shrinks with the length of the
+    run. This finds weak, extended RFI that is below the threshold in each individual
+    sample (e.g. broadband bursts in a waterfall), and is much cheaper than the
+    iterative model fits.
+
+    Parameters
+    ----------
+    spectrum : array-like
+        Either a 1D array of shape ``(NFREQS,)`` or a 2D array of shape
+        ``(NTIMES, NFREQS)`` defining the measured raw spectrum (or significance,
+        if ``detrend`` is False).
+    threshold : float, optional
+        Number of effective sigma at which to clip RFI for single samples.
+    flags : array-like or :class:`~.flags.PackedFlags`, optional
+        Boolean array of pre-existing flagged data to ignore. If packed, the returned
+        flags are also packed.
+    kf, kt : int or None, optional
+        The half-size of the kernel of the median filter used to detrend the spectrum
+        (see :func:`detrend_medfilt`).
+    n_levels : int, optional
+        The number of run lengths to use, i.e. the longest runs have
+        ``2**(n_levels - 1)`` samples.
+    rho : float, optional
+        The factor by which the threshold decreases each time the run length doubles.
+    detrend : bool, optional
+        Whether to detrend the spectrum with :func:`detrend_medfilt` to get the
+        significance of each sample. If False, ``spectrum`` must already be a
+        significance (e.g. residuals divided by their standard deviation).
+    inplace : bool, optional
+        If True, and flags are given, update the flags in-place instead of creating a
+        new array.
+
+    Returns
+    -------
+    flags : array-like
+        Boolean array of the same shape as ``spectrum`` indicated which channels/times
+        have flagged RFI (including the input flags).
+    info : dict
+        Information about the flagging: the ``significance``, the run lengths
+        (``widths``) and their ``thresholds``, and the total number of flags after
+        each level (``nflags``).
+
+    Notes
+    -----
+    See Offringa et al. (2010), MNRAS 405, 155. The threshold for runs of length
+    :math:`M` is :math:`\chi_M = \chi_1 / \rho^{\log_2 M}`. The samples flagged by one
+    run length are excluded from the runs of the longer lengths. Each run length takes
+    a single cumulative-sum pass over the data, so the whole algorithm is
+    :math:`O(n \log n)` (on top of the detrending).
+
+    The median filter only removes a local trend, so RFI that is extended along an
+    axis is only found if it is narrow along another axis that the filter covers
+    (e.g. broadband bursts lasting a few integrations). For a 1D spectrum, broadband
+    RFI can only be distinguished from the sky by a global model: in that case pass
+    the residuals of such a model, divided by their standard deviation, with
+    ``detrend=False``.
+    """
+    if flags is None:
+        new_flags = np.zeros(spectrum.shape, dtype=bool)
+    else:
+        new_flags = flags if inplace else flags.copy()
+
+    if detrend:
+        size = (kf,) if spectrum.ndim == 1 else (kt, kf)
+        significance = detrend_medfilt(spectrum, flags=new_flags, half_size=size)
+    else:
+        significance = spectrum
+
+    # Samples that are infinitely significant are RFI, and would break the sums.
+    new_flags |= ~np.isfinite(significance)
+
+    widths = 2 ** np.arange(n_levels)
+    thresholds = threshold / rho ** np.arange(n_levels)
+
+    nflags = []
+    for width, thresh in zip(widths, thresholds):
+        for axis in range(spectrum.ndim - 1, -1, -1):
+            new_flags |= _sumthreshold_pass(
+                significance, new_flags, width, thresh, axis
+            )
+        nflags.append(np.sum(new_flags))
+
+    return (
+        new_flags,
+        {
+            "significance": significance,
+            "widths": widths,
+            "thresholds": thresholds,
+            "nflags": nflags,
+        },
+    )
+
+
+class RFIBandRegistry:
+    def __init__(self, ranges: List[Tuple[float, float]], max_cache: int = 16):
+        """A set of frequency bands of known RFI, for flagging spectra explicitly.
+
+        The bands are merged and sorted once, and the mask of flagged channels is
+        cached for each frequency grid it is computed for, so that flagging many
+        spectra on the same grid costs nothing after the first.
+
+        Parameters
+        ----------
+        ranges : list of 2-tuples
+            The (min, max) frequency of each band, in MHz. Channels strictly inside a
+            band are flagged (the edges of the band are not).
+        max_cache : int, optional
+            The maximum number of frequency grids whose masks are cached. The least
+            recently used mask is dropped when this is exceeded.
+        """
+        self.bands = self._merge(ranges)
+        self.max_cache = max_cache
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def _merge(ranges: List[Tuple[float, float]]) -> np.ndarray:
+        """Sort the bands and merge those that overlap, giving disjoint bands.
+
+        Since the bands are open intervals, bands that only touch are not merged
+        (their common edge is not flagged).
+        """
+        ranges = np.array(ranges, dtype=float).reshape((-1, 2))
+        ranges = ranges[ranges[:, 0] < ranges[:, 1]]
+        ranges = ranges[np.argsort(ranges[:, 0], kind="stable")]
+
+        merged = []
+        for low, high in ranges:
+            if merged and low < merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], high)
+            else:
+                merged.append([low, high])
+        return np.array(merged, dtype=float).reshape((-1, 2))
+
+    @classmethod
+    def from_yaml(
+        cls, fname: [str, os.PathLike], extra_rfi: [None, List] = None, **kwargs
+    ) -> "RFIBandRegistry":
+        """Read the bands from the 'rfi_ranges' of a YAML file (plus any extra ones)."""
+        with open(fname, "r") as fl:
+            ranges = yaml.load(fl, Loader=yaml.FullLoader)["rfi_ranges"]
+        return cls(ranges + list(extra_rfi or []), **kwargs)
+
+    def __len__(self):
+        """The number of (merged) bands."""
+        return len(self.bands)
+
+    @staticmethod
+    def _fingerprint(f: np.ndarray) -> tuple:
+        """A key that identifies a frequency grid."""
+        f = np.ascontiguousarray(f)
+        return f.shape, f.dtype.str, hashlib.sha1(f.view(np.uint8)).hexdigest()
+
+    def mask(self, f: np.ndarray) -> np.ndarray:
+        """Get the (read-only) mask of the channels of a frequency grid in the bands.
+
+        Parameters
+        ----------
+        f : array-like
+            Frequencies, in MHz. They need not be sorted.
+
+        Returns
+        -------
+        mask : array-like
+            Boolean array of the same shape as ``f``, True for channels in a band.
+        """
+        f = np.asarray(f)
+        key = self._fingerprint(f)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        # The last band starting below each frequency is the only one it can be in.
+        indx = np.searchsorted(self.bands[:, 0], f, side="left") - 1
+        mask = (indx >= 0) & (f < self.bands[np.maximum(indx, 0), 1])
+        mask.flags.writeable = False
+
+        self._cache[key] = mask
+        if len(self._cache) > self.max_cache:
+            self._cache.popitem(last=False)
+        return mask
+
+
+@functools.lru_cache(maxsize=16)
+def _get_rfi_registry(rfi_file: [None, str], mtime: int, extra_rfi: tuple):
+    """Get the registry of RFI bands in a file, re-reading it only if it changed."""
+    if rfi_file:
+        return RFIBandRegistry.from_yaml(rfi_file, extra_rfi=extra_rfi)
+    return RFIBandRegistry(extra_rfi)
+
+
 def xrfi_explicit(f, rfi_file=None, extra_rfi=None):
     """
     Excise RFI from given data using a explicitly set list of flag ranges.
@@ -473,20 +1296,20 @@ def xrfi_explicit(f, rfi_file=None, extra_rfi=None):
     flags : array-like
         Boolean array of the same shape as ``spectrum`` indicated which channels/times
         have flagged RFI.
-    """
-    rfi_freqs = []
-    if rfi_file:
-        with open(rfi_file, "r") as fl:
-            rfi_freqs += yaml.load(fl, Loader=yaml.FullLoader)["rfi_ranges"]
-
-    if extra_rfi:
-        rfi_freqs += extra_rfi
 
-    flags = np.zeros(len(f), dtype=bool)
-    for low, high in rfi_freqs:
-        flags[(f > low) & (f < high)] = True
-
-    return flags
+    Notes
+    -----
+    The file is only read again if it has been modified, and the flags for each
+    frequency grid are cached (see :class:`RFIBandRegistry`), so repeated calls with
+    the same arguments only cost a copy of the flags.
+    """
+    rfi_file = os.fspath(rfi_file) if rfi_file else None
+    registry = _get_rfi_registry(
+        rfi_file,
+        os.stat(rfi_file).st_mtime_ns if rfi_file else 0,
+        tuple(tuple(band) for band in extra_rfi or ()),
+    )
+    return registry.mask(f).copy()
 
 
 def _get_mad(x):
@@ -495,6 +1318,122 @@ def _get_mad(x):
     return np.median(np.abs(x - med)) / np.sqrt(0.456)
 
 
+class NoDataError(Exception):
+    """Exception raised when there is not enough unflagged data to flag RFI."""
+
+    pass
+
+
+def _forward_fill(x: np.ndarray, first: float) -> np.ndarray:
+    """Replace each NaN in x with the last preceding non-NaN value (or ``first``)."""
+    x = np.concatenate(([first], x))
+    indx = np.where(np.isnan(x), 0, np.arange(len(x)))
+    return x[np.maximum.accumulate(indx)][1:]
+
+
+def _sweep_residuals(data, mask, basis):
+    """Fit a linear basis to each window of data and return the residuals.
+
+    ``data`` and ``mask`` have shape ``(n_windows, window_width)`` and ``basis`` has
+    shape ``(window_width, n_terms)``. Masked-out (or un-fittable) samples get zero
+    residual.
+    """
+    n_terms = basis.shape[1]
+    data = np.where(mask, data, 0)
+    count = np.sum(mask, axis=1)
+
+    # Normal equations for every window at once.
+    outer = (basis[:, :, None] * basis[:, None, :]).reshape((len(basis), -1))
+    lhs = (mask.astype(float) @ outer).reshape((-1, n_terms, n_terms))
+    rhs = data @ basis
+
+    # Windows with no more data than terms are fit exactly.
+    resid = np.zeros_like(data)
+    fit = count > n_terms
+    if np.any(fit):
+        par = np.linalg.solve(lhs[fit], rhs[fit][..., None])[..., 0]
+        resid[fit] = (data[fit] - par @ basis.T) * mask[fit]
+    return resid
+
+
+def _xrfi_model_sweep_1d(
+    spectrum, flags, window_width, n_poly, n_bootstrap, n_sigma, use_median
+):
+    """Perform a model sweep over a 1D spectrum (see :func:`xrfi_model_sweep`)."""
+    nf = len(spectrum)
+    out = flags.copy()
+
+    # Use a Legendre basis (rather than powers of f) to keep the fits well-conditioned.
+    # It spans the same space, so gives the same residuals as a simple polynomial fit.
+    basis = np.polynomial.legendre.legvander(
+        np.linspace(-1, 1, window_width), n_poly - 1
+    )
+
+    if nf < window_width:
+        raise NoDataError("There are fewer channels than the window width.")
+
+    data = sliding_window_view(spectrum, window_width)
+    mask = ~sliding_window_view(flags, window_width)
+
+    has_data = np.any(mask, axis=1)
+    if not np.any(has_data):
+        raise NoDataError(
+            "There were no windows of data with enough data to perform xrfi."
+        )
+    first = np.argmax(has_data)
+
+    # Computation of STD for initial section.
+    r = _sweep_residuals(data[first : first + 1], mask[first : first + 1], basis)
+    r = r[0][mask[first]]
+    if not use_median:
+        r_choice_std = [
+            np.std(np.random.choice(r, len(r) // 2)) for _ in range(n_bootstrap)
+        ]
+        r_std = np.median(r_choice_std)
+    else:
+        r_std = _get_mad(r)
+
+    if _use_numba():
+        _xrfi_numba.sweep_flags(
+            spectrum, flags, basis, n_sigma, use_median, r_std, first, out
+        )
+        return out
+
+    # Each window is flagged using the std. dev. of the residuals in the previous window
+    # that had data (or the initial estimate, for the first window).
+    step = max(1, _WINDOW_CHUNK_SIZE // window_width)
+    for start in range(first, len(data), step):
+        d = data[start : start + step]
+        m = mask[start : start + step]
+        r = _sweep_residuals(d, m, basis)
+
+        count = np.sum(m, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if use_median:
+                rr = np.where(m, r, np.nan)
+                med = _masked_window_median(rr.copy())
+                std = _masked_window_median(np.abs(rr - med[:, None])) / np.sqrt(0.456)
+            else:
+                mean = np.sum(r, axis=1) / count
+                std = np.sqrt(np.sum(((r - mean[:, None]) * m) ** 2, axis=1) / count)
+
+        # Windows with no more data than terms are fit exactly, so have no estimate
+        # of the scatter: use that of the previous window instead.
+        std[count <= basis.shape[1]] = np.nan
+        if start == first:
+            std[0] = r_std
+
+        thresh = n_sigma * _forward_fill(np.concatenate(([r_std], std[:-1])), r_std)
+        hits = m & (np.abs(r) > thresh[:, None])
+
+        for i in range(window_width):
+            out[start + i : start + i + len(hits)] |= hits[:, i]
+
+        r_std = _forward_fill(std, r_std)[-1]
+
+    return out
+
+
 def xrfi_model_sweep(
     spectrum,
     weights=None,
@@ -516,7 +1455,7 @@ def xrfi_model_sweep(
     ----------
     spectrum : array-like
         A 1D or 2D array, where the last axis corresponds to frequency. The data
-        measured at those frequencies.
+        measured at those frequencies. If 2D, each row is swept independently.
     weights : array-like
         The weights associated with the data (same shape as `spectrum`).
     window_width : int, optional
@@ -540,74 +1479,42 @@ def xrfi_model_sweep(
     flags : array-like
         Boolean array of the same shape as ``spectrum`` indicated which channels/times
         have flagged RFI.
+
+    Raises
+    ------
+    NoDataError
+        If a 1D spectrum has no window with any unflagged data.
+
+    Notes
+    -----
+    The polynomial fits for all windows are independent of each other: each one
+    excludes only the channels that are flagged on input (i.e. those with zero
+    weight, or non-finite data, which are always flagged). They are therefore solved
+    all at once using strided views of the data.
+
+    A channel is flagged if it is an outlier in *any* window that contains it. Each
+    window is thresholded using the standard deviation of the residuals in the
+    previous window that had any data. In 2D, rows that are entirely flagged are
+    skipped.
     """
-    nf = spectrum.shape[-1]
-    f = np.linspace(-1, 1, window_width)
-    flags = np.zeros(spectrum.shape, dtype=bool)
+    # Non-finite data would corrupt the fit of every window containing it.
+    flags = ~np.isfinite(spectrum)
 
     if weights is not None:
         flags |= weights <= 0
 
-    class NoDataError(Exception):
-        pass
-
-    def compute_resid(d, flagged):
-        mask = ~flagged
-        if np.any(mask):
-            par = np.polyfit(f[mask], d[mask], n_poly - 1)
-            return d[mask] - np.polyval(par, f[mask]), mask
-        else:
-            raise NoDataError
-
-    # Compute residuals for initial section
-    got_init = False
-    window = np.arange(window_width)
-    while not got_init and window[-1] < nf:
-        try:
-            r, mask = compute_resid(spectrum[window], flags[window])
-            got_init = True
-
-        except NoDataError:
-            window += 1
-
-    if not got_init:
-        raise NoDataError(
-            "There were no windows of data with enough data to perform xrfi."
-        )
-
-    # Computation of STD for initial section using the median statistic
-    if not use_median:
-        r_choice_std = [
-            np.std(np.random.choice(r, len(r) // 2)) for _ in range(n_bootstrap)
-        ]
-        r_std = np.median(r_choice_std)
+    args = (window_width, n_poly, n_bootstrap, n_sigma, use_median)
+    if spectrum.ndim == 1:
+        flags = _xrfi_model_sweep_1d(spectrum, flags, *args)
     else:
-        r_std = _get_mad(r)
-
-    print(r_std)
-
-    # Set this window's flags to true.
-    flags[:window_width][mask] |= np.abs(r) > n_sigma * r_std
-
-    # Initial window limits
-    window += 1
-    while window[-1] < nf:
-        # Selecting section of data of width "window_width"
-        try:
-            r, fmask = compute_resid(spectrum[window], flags[window])
-        except NoDataError:
-            continue
-
-        flags[window][fmask][np.abs(r) > n_sigma * r_std] = True
-
-        # Update std dev. estimate for the next window.
-        r_std = _get_mad(r) if use_median else np.std(r)
-        window += 1
+        for i, (spec, flg) in enumerate(zip(spectrum, flags)):
+            if not np.all(flg):
+                flags[i] = _xrfi_model_sweep_1d(spec, flg, *args)
 
     if flip:
         flip_flags = xrfi_model_sweep(
-            np.flip(spectrum),
-            np.flip(weights) if weights is not None else None,
+            np.flip(spectrum, axis=-1),
+            np.flip(weights, axis=-1) if weights is not None else None,
             window_width=window_width,
             n_poly=n_poly,
             n_bootstrap=n_bootstrap,
@@ -615,11 +1522,101 @@ def xrfi_model_sweep(
             use_median=use_median,
             flip=False,
         )
-        flags |= np.flip(flip_flags)
+        flags |= np.flip(flip_flags, axis=-1)
 
     return flags
 
 
+def _get_watershed_kernel(
+    watershed: [int, Tuple[int, float], np.ndarray], ndim: int = 1
+) -> np.ndarray:
+    """Convert any of the accepted watershed specifications to a kernel array."""
+    if isinstance(watershed, (int, np.integer)):
+        # By default, just kill all surrounding channels
+        kernel = np.zeros(watershed * 2 + 1)
+        kernel[watershed] = 1
+    elif not isinstance(watershed, np.ndarray) and len(watershed) == 2:
+        # Otherwise, can provide weights per-channel.
+        kernel = np.ones(watershed[0] * 2 + 1) * watershed[1]
+    else:
+        kernel = np.asarray(watershed, dtype=float)
+
+    if kernel.ndim > ndim:
+        raise ValueError(
+            f"watershed has {kernel.ndim} dimensions, but the flags only have {ndim}"
+        )
+    if any(s % 2 == 0 for s in kernel.shape):
+        raise ValueError("watershed must have an odd size along every axis")
+
+    # Lower-dimensional kernels apply along the trailing (frequency) axes.
+    return kernel.reshape((1,) * (ndim - kernel.ndim) + kernel.shape)
+
+
+@_accepts_packed_flags()
+def watershed_flags(
+    flags: np.ndarray,
+    abs_resid: np.ndarray,
+    model_std: np.ndarray,
+    threshold: float,
+    watershed: [int, Tuple[int, float], np.ndarray],
+) -> np.ndarray:
+    """Find samples surrounding flagged samples that are themselves likely RFI.
+
+    A sample is flagged if it lies within the watershed of a flagged sample and its
+    absolute residual is larger than the value of the watershed at that position
+    multiplied by ``threshold * model_std``. This is computed as a binary dilation of
+    the flags for each distinct value in the watershed, so it does not depend on the
+    number of flagged samples.
+
+    Parameters
+    ----------
+    flags : array-like or :class:`~.flags.PackedFlags`
+        Boolean array of existing flags, 1D (a spectrum) or 2D (a waterfall). If
+        packed, the returned flags are also packed.
+    abs_resid : array-like
+        The absolute residuals of the data, same shape as ``flags``.
+    model_std : array-like
+        The model of the standard deviation of the residuals (same shape as ``flags``).
+    threshold : float
+        The threshold for flagging, in units of ``model_std``.
+    watershed : int, tuple or ndarray
+        If an int, that many samples on each side of the flagged sample will be
+        flagged. If a tuple, should be (int, float), where the int specifies the
+        number of samples on each side, and the float specifies a threshold *with
+        respect to* the overall threshold for flagging. If an array, the values
+        represent this threshold where the central element of the array is placed on
+        the flagged sample. The array may be 2D (time, frequency) for 2D flags, while
+        all 1D forms are applied along the frequency axis only.
+
+    Returns
+    -------
+    flags : array-like
+        Boolean array of the same shape as ``flags``, with the samples flagged by the
+        watershed (not including the original flags).
+    """
+    flags = np.asarray(flags, dtype=bool)
+    kernel = _get_watershed_kernel(watershed, flags.ndim)
+
+    out = np.zeros_like(flags)
+    if flags.ndim <= 2 and _use_numba():
+        args = [
+            np.atleast_2d(np.broadcast_to(x, flags.shape))
+            for x in (flags, abs_resid, model_std)
+        ]
+        _xrfi_numba.watershed_flags(
+            *args, float(threshold), np.atleast_2d(kernel), np.atleast_2d(out)
+        )
+        return out
+
+    for value in np.unique(kernel[~np.isnan(kernel)]):
+        # Samples at positions in the watershed with this value, relative to any flag.
+        near = ndimage.binary_dilation(flags, structure=kernel == value)
+        out |= near & (abs_resid > value * threshold * model_std)
+
+    return out
+
+
+@_accepts_packed_flags()
 def xrfi_model(
     spectrum: np.ndarray,
     model_type: [str, Model] = "polynomial",
@@ -652,11 +1649,14 @@ def xrfi_model(
     ----------
     spectrum : array-like
         A 1D spectrum. Note that instead of a spectrum, model residuals can be passed.
-        The function does *not* assume the input is positive.
+        The function does *not* assume the input is positive. If 2D, it should be a
+        waterfall of shape (ntime, nfreq), and each integration is flagged
+        independently (see Notes).
     model_type : str or :class:`Model`, optional
         A model to fit to the data. Any :class:`Model` is accepted.
-    flags : array-like, optional
-        The flags associated with the data (same shape as `spectrum`).
+    flags : array-like or :class:`~.flags.PackedFlags`, optional
+        The flags associated with the data (same shape as `spectrum`). If packed, the
+        returned flags are also packed.
     f_ratio : float, optional
         The ratio of the max to min frequency to be fit. Only required if ``f_log``
         is True.
@@ -706,6 +1706,25 @@ def xrfi_model(
     flags : array-like
         Boolean array of the same shape as ``spectrum`` indicated which channels/times
         have flagged RFI.
+    info : dict
+        Information about the flagging procedure. For 2D input, ``n_iters`` is an
+        array with the number of iterations for each integration, ``n_flags_changed``
+        and ``total_flags`` are arrays of shape (ntime, n_iterations), and each entry
+        of ``models`` and ``model_std`` is an array of parameters for each integration
+        (NaN for integrations that had already converged).
+
+    Notes
+    -----
+    The fits are not re-computed from scratch on each iteration. The basis functions
+    are orthonormalized once, and the normal equations of each integration are kept
+    between iterations: only the channels whose flags changed are removed from (or
+    added back to) them, and increasing the model order appends new basis functions.
+    Each iteration therefore costs O(n k) to evaluate the models, rather than O(n k^2)
+    to re-fit them.
+
+    For 2D input, the fits for all integrations are solved together, each integration
+    iterating until it has converged by itself. The result is identical to calling this
+    function on each integration in turn, but much faster.
     """
     threshold = threshold or (
         min_threshold
@@ -722,9 +1741,6 @@ def xrfi_model(
     if f_log and not f_ratio:
         raise ValueError("If fitting in log(freq), you must provide f_ratio.")
 
-    if t_log is None:
-        t_log = not np.any(spectrum <= 0)
-
     assert threshold > 1.5
 
     nf = spectrum.shape[-1]
@@ -734,23 +1750,8 @@ def xrfi_model(
     if not increase_order:
         assert n_resid <= n_signal
 
-    # Set the watershed as a small array that will overlay a flag.
-    if isinstance(watershed, int):
-        # By default, just kill all surrounding channels
-        watershed = np.zeros(watershed * 2 + 1)
-        watershed[len(watershed) // 2] = 1
-    elif watershed is not None and len(watershed) == 2:
-        # Otherwise, can provide weights per-channel.
-        watershed = np.ones(watershed[0] * 2 + 1) * watershed[1]
-
-    n_flags_changed = 1
-    counter = 0
-
-    # Set up a few lists that we can update on each iteration to return info to the user.
-    n_flags_changed_list = []
-    total_flags_list = []
-    model_list = []
-    model_std_list = []
+    if watershed is not None:
+        watershed = _get_watershed_kernel(watershed)
 
     # Create the model that will fit the spectrum/residuals
     if isinstance(model_type, str):
@@ -758,98 +1759,288 @@ def xrfi_model(
             default_x=f, n_terms=n_signal, **model_kwargs
         )
 
-    spec = np.log(spectrum) if t_log else spectrum
+    # A single spectrum is flagged as a waterfall with one integration.
+    if spectrum.ndim == 1 and flags is not None:
+        flags = flags[None]
+
+    out, info = _xrfi_model_batch(
+        np.atleast_2d(spectrum),
+        model_type=model_type,
+        flags=flags,
+        t_log=t_log,
+        n_signal=n_signal,
+        n_resid=n_resid,
+        threshold=threshold,
+        max_iter=max_iter,
+        accumulate=accumulate,
+        increase_order=increase_order,
+        decrement_threshold=decrement_threshold,
+        min_threshold=min_threshold,
+        return_models=return_models,
+        inplace=inplace,
+        watershed=watershed,
+    )
+    if spectrum.ndim == 2:
+        return out, info
 
-    # Initialize some flags, or set them equal to the input
-    orig_flags = flags if flags is not None else np.zeros(nf, dtype=bool)
-    orig_flags |= np.isnan(spectrum) | np.isinf(spectrum)
+    return (
+        out[0],
+        {
+            "n_flags_changed": list(info["n_flags_changed"][0]),
+            "total_flags": list(info["total_flags"][0]),
+            "models": [par[0] for par in info["models"]],
+            "model_std": [par[0] for par in info["model_std"]],
+            "n_iters": int(info["n_iters"][0]),
+            "model": model_type,
+        },
+    )
 
-    flags = orig_flags.copy()
 
-    orig_weights = (~flags).astype(float)
+def _solve_batch(lhs: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    """Solve a stack of linear systems, falling back to least-squares if singular."""
+    try:
+        return np.linalg.solve(lhs, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return (np.linalg.pinv(lhs) @ rhs[..., None])[..., 0]
 
-    # Iterate until either no flags are changed between iterations, or we get to the
-    # requested maximum iterations, or until we have too few unflagged data to fit appropriately.
-    while n_flags_changed > 0 and counter < max_iter and np.sum(~flags) > n_signal * 2:
 
-        model_type.update_nterms(n_signal)
-        weights = np.where(flags, 0, orig_weights)
+def _rowwise_dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Matrix product of each row of ``a`` with ``b``.
 
-        # Get a model fit to the unflagged data.
-        # Could be polynomial or fourier (or something else...)
-        mdl = ModelFit(model_type, ydata=spec, weights=weights)
+    Each row is computed by itself, so that its result does not depend on the other
+    rows in the batch (a single BLAS matrix product does not guarantee this).
+    """
+    return (a[:, None, :] @ b)[:, 0]
+
+
+class _IncrementalFit:
+    def __init__(self, data: np.ndarray, flags: np.ndarray):
+        """Weighted least-squares fits of rows of data, updated as their flags change.
+
+        The basis is kept orthonormal (so that the normal equations of every row are
+        well-conditioned), and the normal equations of each row are kept between fits.
+        When flags change, only the changed samples are removed from (or added back
+        to) the normal equations, at a cost of O(k^2) per sample, and increasing the
+        number of terms appends columns to the basis, rather than starting again.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The data to fit, shape ``(n_rows, n_samples)``. Flagged data must be
+            finite (but is otherwise ignored).
+        flags : np.ndarray
+            The initial flags of the data (same shape as ``data``).
+        """
+        self.data = data
+        self.flags = flags.copy()
+        self.rebuild_fraction = 0.25
+        self.q = np.zeros((data.shape[1], 0))
+        self.r = np.zeros((0, 0))
+        self.lhs = np.zeros((len(data), 0, 0))
+        self.rhs = np.zeros((len(data), 0))
+
+    @property
+    def n_terms(self) -> int:
+        """The number of basis terms."""
+        return self.q.shape[1]
+
+    def append_terms(self, basis: np.ndarray, rows: np.ndarray):
+        """Append basis terms (shape ``(n_new, n_samples)``) to the fits.
+
+        The normal equations are only extended for the given rows (those of other rows
+        are no longer valid).
+        """
+        k, n = self.n_terms, self.n_terms + len(basis)
+        q = np.hstack((self.q, np.zeros((self.q.shape[0], len(basis)))))
+        r = np.zeros((n, n))
+        r[:k, :k] = self.r
+
+        # Gram-Schmidt, with re-orthogonalization to keep the columns orthonormal.
+        for i, term in enumerate(basis, start=k):
+            coeffs = q[:, :i].T @ term
+            vec = term - q[:, :i] @ coeffs
+            correction = q[:, :i].T @ vec
+            vec -= q[:, :i] @ correction
+            r[:i, i] = coeffs + correction
+            r[i, i] = np.linalg.norm(vec)
+            q[:, i] = vec / r[i, i]
+
+        lhs = np.zeros((len(self.data), n, n))
+        lhs[:, :k, :k] = self.lhs
+        rhs = np.zeros((len(self.data), n))
+        rhs[:, :k] = self.rhs
+
+        weights = (~self.flags[rows]).astype(float)
+        for i in range(k, n):
+            lhs[rows, i] = _rowwise_dot(weights * q[:, i], q)
+            lhs[rows, :, i] = lhs[rows, i]
+        rhs[rows, k:] = _rowwise_dot(weights * self.data[rows], q[:, k:])
+
+        self.q, self.r, self.lhs, self.rhs = q, r, lhs, rhs
+
+    def update_flags(self, flags: np.ndarray, rows: np.ndarray):
+        """Update the normal equations of the given rows with new flags for them.
+
+        Removing many samples from the normal equations loses precision (the result
+        is a small difference of large sums), so rows in which more samples changed
+        than a fraction (:attr:`rebuild_fraction`) of their unflagged samples have
+        their normal equations rebuilt from scratch instead.
+        """
+        changed = flags ^ self.flags[rows]
+        n_changed = np.sum(changed, axis=1)
+        rebuild = n_changed > self.rebuild_fraction * np.sum(~flags, axis=1)
+        for i in np.nonzero(rebuild)[0]:
+            weights = (~flags[i]).astype(float)
+            self.lhs[rows[i]] = (weights[:, None] * self.q).T @ self.q
+            self.rhs[rows[i]] = (weights * self.data[rows[i]]) @ self.q
+
+        for i in np.nonzero((n_changed > 0) & ~rebuild)[0]:
+            col = np.nonzero(changed[i])[0]
+            q = self.q[col]
+            signed = np.where(flags[i, col], -1.0, 1.0)[:, None] * q
+            self.lhs[rows[i]] += signed.T @ q
+            self.rhs[rows[i]] += self.data[rows[i], col] @ signed
+        self.flags[rows] = flags
+
+    def solve(self, rows: np.ndarray, n_terms: int, data: [None, np.ndarray] = None):
+        """Fit the first ``n_terms`` of the (orthonormal) basis to the given rows.
+
+        By default, the data given on construction is fit, otherwise ``data`` (with one
+        row for each of ``rows``) is fit with the same flags.
+        """
+        if data is None:
+            rhs = self.rhs[rows, :n_terms]
+        else:
+            weights = (~self.flags[rows]).astype(float)
+            rhs = _rowwise_dot(weights * data, self.q[:, :n_terms])
+        return _solve_batch(self.lhs[rows, :n_terms, :n_terms], rhs)
 
-        par = mdl.model_parameters
-        model = mdl.evaluate(f)
+    def evaluate(self, par: np.ndarray) -> np.ndarray:
+        """Evaluate fits with the given parameters (in the orthonormal basis)."""
+        return _rowwise_dot(par, self.q[:, : par.shape[1]].T)
 
-        if return_models:
-            model_list.append(par)
+    def model_parameters(self, par: np.ndarray) -> np.ndarray:
+        """Convert parameters of the orthonormal basis to those of the model basis."""
+        n = par.shape[1]
+        return _solve_batch(np.broadcast_to(self.r[:n, :n], par.shape + (n,)), par)
 
-        # Need to get back to linear space if we logged.
-        if t_log:
-            model = np.exp(model)
 
-        res = spectrum - model
+def _xrfi_model_batch(
+    spectrum: np.ndarray,
+    *,
+    model_type: Model,
+    flags: [None, np.ndarray],
+    t_log: [None, bool],
+    n_signal: int,
+    n_resid: int,
+    threshold: float,
+    max_iter: int,
+    accumulate: bool,
+    increase_order: bool,
+    decrement_threshold: float,
+    min_threshold: float,
+    return_models: bool,
+    inplace: bool,
+    watershed: [None, np.ndarray],
+):
+    """Run :func:`xrfi_model` on each integration of a 2D waterfall at once.
 
-        # Now fit a model to the absolute residuals.
-        # This number is "like" a local standard deviation, since the polynomial does
-        # something like a local average.
-        model_type.update_nterms(n_resid if n_resid > 0 else n_signal + n_resid)
-        mdl = ModelFit(model_type, ydata=np.abs(res), weights=weights)
-        par = mdl.model_parameters
-        model_std = mdl.evaluate(f)
+    The fits are performed with an :class:`_IncrementalFit`, in a basis that is
+    orthonormalized by Gram-Schmidt as terms are appended to it (so that the weighted
+    normal equations of every integration are well-conditioned), and whose normal
+    equations are updated as flags change. The fit to the absolute residuals uses the
+    leading block of the same normal equations.
+    """
+    nt, nf = spectrum.shape
 
-        if return_models:
-            model_std_list.append(par)
+    if t_log is None:
+        t_log = ~np.any(spectrum <= 0, axis=1)
+    else:
+        t_log = np.full(nt, bool(t_log))
+
+    orig_flags = flags if flags is not None else np.zeros(spectrum.shape, dtype=bool)
+    orig_flags |= np.isnan(spectrum) | np.isinf(spectrum)
+    orig_flags |= t_log[:, None] & (spectrum <= 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spec = np.where(t_log[:, None], np.log(spectrum), spectrum)
+    spec[orig_flags] = 0
+
+    flags = orig_flags.copy()
+
+    n_iters = np.zeros(nt, dtype=int)
+    n_flags_changed_list = []
+    total_flags_list = []
+    model_list = []
+    model_std_list = []
+
+    counter = 0
+    active = np.sum(~flags, axis=1) > n_signal * 2
+    fit = _IncrementalFit(spec, flags)
+    while np.any(active) and counter < max_iter:
+        rows = np.nonzero(active)[0]
+
+        n_res = n_resid if n_resid > 0 else n_signal + n_resid
+        n_terms = max(n_signal, n_res)
+        model_type.update_nterms(n_terms)
+        if n_terms > fit.n_terms:
+            fit.append_terms(model_type.default_basis[fit.n_terms :], rows)
+
+        par = fit.solve(rows, n_signal)
+        model = fit.evaluate(par)
+        model[t_log[rows]] = np.exp(model[t_log[rows]])
+        abs_res = np.abs(spectrum[rows] - model)
 
+        par_std = fit.solve(rows, n_res, data=np.where(flags[rows], 0, abs_res))
+        model_std = fit.evaluate(par_std)
+
+        if return_models:
+            for lst, p, n in (
+                (model_list, par, n_signal),
+                (model_std_list, par_std, n_res),
+            ):
+                params = np.full((nt, n), np.nan)
+                params[rows] = fit.model_parameters(p)
+                lst.append(params)
+
+        bad = abs_res > threshold * model_std
         if accumulate:
-            # If we are accumulating flags, we just get the *new* flags and add them
-            # to the original flags
-            nflags = np.sum(flags[~flags])
-            flags[~flags] |= np.abs(res)[~flags] > threshold * model_std[~flags]
-            n_flags_changed = np.sum(flags[~flags]) - nflags
+            new_flags = flags[rows] | bad
         else:
-            # If we're not accumulating, we just take these flags (along with the fully
-            # original flags).
-            new_flags = orig_flags | (np.abs(res) > threshold * model_std)
-
-            # Apply a watershed -- assume surrounding channels will succumb to RFI.
+            new_flags = orig_flags[rows] | bad
             if watershed is not None:
-                watershed_flags = np.zeros_like(new_flags)
-                # Go through each flagged channel
-                for channel in np.where(new_flags)[0]:
-                    rng = range(
-                        max(0, channel - len(watershed) // 2),
-                        min(len(new_flags), channel + len(watershed) // 2 + 1),
-                    )
-                    wrng_min = max(0, -(channel - len(watershed) // 2))
-                    wrng = range(wrng_min, wrng_min + len(rng))
-
-                    watershed_flags[rng] |= (
-                        np.abs(res[rng]) > watershed[wrng] * threshold * model_std[rng]
-                    )
-                new_flags |= watershed_flags
-
-            n_flags_changed = np.sum(flags ^ new_flags)
-            flags = new_flags.copy()
+                new_flags |= watershed_flags(
+                    new_flags, abs_res, model_std, threshold, watershed
+                )
+
+        n_flags_changed = np.zeros(nt, dtype=int)
+        n_flags_changed[rows] = np.sum(flags[rows] ^ new_flags, axis=1)
+        flags[rows] = new_flags
+        fit.update_flags(new_flags, rows)
+        n_iters[rows] += 1
 
         counter += 1
         if increase_order:
             n_signal += 1
 
-        # decrease the flagging threshold if we want to for next iteration
         threshold = max(threshold - decrement_threshold, min_threshold)
 
-        # Append info to lists for the user's benefit
         n_flags_changed_list.append(n_flags_changed)
-        total_flags_list.append(np.sum(flags))
+        total_flags_list.append(np.sum(flags, axis=1))
 
-    if counter == max_iter:
+        active[rows] = (n_flags_changed[rows] > 0) & (
+            np.sum(~new_flags, axis=1) > n_signal * 2
+        )
+
+    if np.any(n_iters == max_iter):
         warnings.warn(
-            f"max iterations ({max_iter}) reached, not all RFI might have been caught."
+            f"max iterations ({max_iter}) reached for {np.sum(n_iters == max_iter)} "
+            "integrations, not all RFI might have been caught."
         )
 
-    if np.sum(~flags) <= n_signal * 2:
+    # The order of the signal model at the end of each integration's iterations.
+    n_signal = n_signal - counter * increase_order + n_iters * increase_order
+    if np.any(np.sum(~flags, axis=1) <= n_signal * 2):
         warnings.warn(
             "Termination of iterative loop due to too many flags. Reduce n_signal or check data."
         )
@@ -860,11 +2051,15 @@ def xrfi_model(
     return (
         flags,
         {
-            "n_flags_changed": n_flags_changed_list,
-            "total_flags": total_flags_list,
+            "n_flags_changed": np.reshape(
+                np.array(n_flags_changed_list, dtype=int), (counter, nt)
+            ).T,
+            "total_flags": np.reshape(
+                np.array(total_flags_list, dtype=int), (counter, nt)
+            ).T,
             "models": model_list,
             "model_std": model_std_list,
-            "n_iters": counter,
+            "n_iters": n_iters,
             "model": model_type,
         },
     )
@@ -884,8 +2079,9 @@ def xrfi_watershed(
     ----------
     spectrum
         Not used in this routine.
-    flags : ndarray of bool
-        The existing flags.
+    flags : ndarray of bool or :class:`~.flags.PackedFlags`
+        The existing flags. If packed, the rows and columns are collapsed directly
+        from the packed bits, and packed flags are returned.
     tol : float or tuple
         The tolerance -- i.e. the fraction of entries that must be flagged before
         flagging the whole axis. If a tuple, the first element is for the frequency
@@ -903,11 +2099,18 @@ def xrfi_watershed(
     if flags is None:
         raise ValueError("You must provide flags as an ndarray")
 
-    fl = flags if inplace else flags.copy()
-
     if not hasattr(tol, "__len__"):
         tol = (tol, tol)
 
+    if isinstance(flags, PackedFlags):
+        # Collapse the bits directly, without unpacking the flags.
+        fl = flags if inplace else flags.copy()
+        fl.set_rows(flags.count(axis=1) > tol[0] * flags.shape[1])
+        fl.set_channels(fl.count(axis=0) > tol[1] * flags.shape[0])
+        return fl, {}
+
+    fl = flags if inplace else flags.copy()
+
     freq_coll = np.sum(flags, axis=1)
     freq_mask = freq_coll > tol[0] * flags.shape[1]
     fl[freq_mask] = True
@@ -916,3 +2119,958 @@ def xrfi_watershed(
     time_mask = time_coll > tol[1] * flags.shape[0]
     fl[:, time_mask] = True
     return fl, {}
+
+
+# Flaggers supported by xrfi_parallel, keyed by the name without the "xrfi_" prefix.
+_PARALLEL_METHODS = {
+    "medfilt": xrfi_medfilt,
+    "model": xrfi_model,
+    "model_sweep": xrfi_model_sweep,
+}
+
+
+def _block_ranges(n: int, n_blocks: int, halo: int) -> List[Tuple[int, int, int, int]]:
+    """Split ``n`` rows into blocks, returning (start, stop, lower, upper) for each.
+
+    Rows ``start:stop`` are the rows of the block that are kept, and ``lower:upper``
+    are the rows passed to the flagger (i.e. including the halo).
+    """
+    edges = np.linspace(0, n, n_blocks + 1).astype(int)
+    return [
+        (start, stop, max(start - halo, 0), min(stop + halo, n))
+        for start, stop in zip(edges[:-1], edges[1:])
+        if stop > start
+    ]
+
+
+def _share(arrays: dict, use_threads: bool):
+    """Put arrays in shared memory, returning specs that workers can attach to."""
+    if use_threads:
+        return arrays, []
+
+    # Shared memory is only available from python 3.8.
+    from multiprocessing import shared_memory
+
+    specs = {}
+    handles = []
+    for name, array in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        specs[name] = (shm.name, array.shape, array.dtype.str)
+        handles.append(shm)
+    return specs, handles
+
+
+def _attach(specs: dict):
+    """Get arrays from the specs created by :func:`_share`."""
+    from multiprocessing import shared_memory
+
+    arrays = {}
+    handles = []
+    for name, spec in specs.items():
+        if isinstance(spec, np.ndarray):
+            arrays[name] = spec
+        else:
+            shm = shared_memory.SharedMemory(name=spec[0])
+            arrays[name] = np.ndarray(spec[1], dtype=spec[2], buffer=shm.buf)
+            handles.append(shm)
+    return arrays, handles
+
+
+def _xrfi_block(
+    method: str,
+    specs: dict,
+    block: Tuple[int, int, int, int],
+    outputs: Tuple[str],
+    kwargs: dict,
+):
+    """Run a flagger on one block of a shared waterfall (in a worker)."""
+    start, stop, lower, upper = block
+    arrays, handles = _attach(specs)
+    try:
+        data = {
+            name: np.array(array[lower:upper])
+            for name, array in arrays.items()
+            if not name.startswith("out:")
+        }
+        result = _PARALLEL_METHODS[method](
+            data.pop("spectrum"), **data, **copy.deepcopy(kwargs)
+        )
+        flags, info = result if isinstance(result, tuple) else (result, {})
+
+        core = slice(start - lower, stop - lower)
+        arrays["out:flags"][start:stop] = flags[core]
+        for name in outputs:
+            arrays[f"out:{name}"][start:stop] = info.pop(name)[core]
+    finally:
+        del arrays
+        for shm in handles:
+            shm.close()
+
+    return info
+
+
+def _stitch_model_info(infos: List[dict], flags: np.ndarray) -> dict:
+    """Combine the info from the blocks of a 2D :func:`xrfi_model` into one."""
+    n_iters = np.concatenate([info["n_iters"] for info in infos])
+    counter = n_iters.max() if len(n_iters) else 0
+
+    # Integrations keep their final flags for the iterations run by other blocks.
+    n_flags_changed = np.zeros((len(n_iters), counter), dtype=int)
+    total_flags = np.repeat(np.sum(flags, axis=1)[:, None], counter, axis=1)
+    models = {"models": [], "model_std": []}
+
+    row = 0
+    for info in infos:
+        rows = slice(row, row + len(info["n_iters"]))
+        n = info["total_flags"].shape[1]
+        n_flags_changed[rows, :n] = info["n_flags_changed"]
+        total_flags[rows, :n] = info["total_flags"]
+
+        for key, lst in models.items():
+            for i, params in enumerate(info[key]):
+                if i == len(lst):
+                    lst.append(np.full((len(n_iters), params.shape[1]), np.nan))
+                lst[i][rows] = params
+        row = rows.stop
+
+    return {
+        "n_flags_changed": n_flags_changed,
+        "total_flags": total_flags,
+        "models": models["models"],
+        "model_std": models["model_std"],
+        "n_iters": n_iters,
+        "model": infos[0]["model"],
+    }
+
+
+def _get_method_name(method: [str, Callable], allowed: set) -> str:
+    """Get the name (without ``xrfi_`` prefix) of a flagger, checking it's allowed."""
+    if callable(method):
+        method = method.__name__
+    method = method[5:] if method.startswith("xrfi_") else method
+    if method not in allowed:
+        raise ValueError(f"method must be one of {sorted(allowed)}, got '{method}'")
+    return method
+
+
+def _default_kwarg(func: Callable, name: str):
+    return inspect.signature(func).parameters[name].default
+
+
+class _Pool:
+    """A pool of workers with access to a set of (shared) arrays."""
+
+    def __init__(self, arrays: dict, max_workers: int, use_threads: bool):
+        self.specs, self._handles = _share(arrays, use_threads)
+        self.arrays, self._attached = _attach(self.specs)
+        self._executor = (
+            ThreadPoolExecutor(max_workers)
+            if use_threads
+            else ProcessPoolExecutor(max_workers)
+        )
+
+    def map(self, method: str, blocks: list, outputs: Tuple[str], kwargs: dict):
+        """Run the method on each block, returning the info from each."""
+        if len(blocks) == 1:
+            return [_xrfi_block(method, self.specs, blocks[0], outputs, kwargs)]
+
+        futures = [
+            self._executor.submit(
+                _xrfi_block, method, self.specs, block, outputs, kwargs
+            )
+            for block in blocks
+        ]
+        return [future.result() for future in futures]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown()
+        self.arrays = None
+        for shm in self._attached:
+            shm.close()
+        for shm in self._handles:
+            shm.close()
+            shm.unlink()
+
+
+@_accepts_packed_flags()
+def xrfi_parallel(
+    method: [str, Callable],
+    spectrum: np.ndarray,
+    *,
+    n_blocks: [None, int] = None,
+    max_workers: [None, int] = None,
+    use_threads: bool = False,
+    **kwargs,
+):
+    """Run an xRFI flagger over a 2D waterfall in parallel, in blocks of time.
+
+    The waterfall is split into blocks of integrations, each of which is extended by a
+    "halo" of neighbouring integrations big enough that the flags in the block are
+    exactly those that the flagger finds for the full waterfall. The flags of each
+    block are then stitched back together, so that the output is identical to calling
+    the flagger on the whole waterfall (up to floating-point round-off in the returned
+    statistics, such as the significance, since the running means of
+    :func:`flagged_mean_filter` depend on where each block starts).
+
+    Parameters
+    ----------
+    method : str or callable
+        The flagger to use: one of :func:`xrfi_medfilt`, :func:`xrfi_model` or
+        :func:`xrfi_model_sweep` (or its name, with or without the ``xrfi_`` prefix).
+    spectrum : array-like
+        The 2D waterfall, of shape (ntime, nfreq).
+    n_blocks : int, optional
+        The number of blocks of integrations to split the waterfall into. By default,
+        the same as the number of workers.
+    max_workers : int, optional
+        The maximum number of worker processes (or threads). By default, the number of
+        CPUs on the machine.
+    use_threads : bool, optional
+        Whether to use a pool of threads instead of processes. Processes receive the
+        input and write their flags through shared memory, so the waterfall is never
+        pickled. Threads work directly on the arrays, and are useful for small
+        waterfalls, since most of the work in the flaggers is done by numpy, which
+        releases the GIL.
+
+    Other Parameters
+    ----------------
+    All other parameters are passed to the flagger. Arrays of the same shape as
+    ``spectrum`` (e.g. ``flags`` or ``weights``) are split into blocks along with it.
+    The ``flags`` may be :class:`~.flags.PackedFlags`, in which case the returned
+    flags are also packed.
+
+    Returns
+    -------
+    flags : array-like
+        Boolean array of the same shape as ``spectrum`` indicated which channels/times
+        have flagged RFI.
+    info : dict
+        Information about the flagging procedure, as for a call of the flagger on the
+        full waterfall (not returned for :func:`xrfi_model_sweep`).
+
+    Notes
+    -----
+    :func:`xrfi_model` and :func:`xrfi_model_sweep` flag each integration
+    independently, so no halo is needed. :func:`xrfi_medfilt` needs a halo of four
+    times the half-width of the kernel in time (the median and MAD filters, followed
+    by the mean filter and its variance), and its iterations are driven from here
+    so that the convergence criterion over the whole waterfall is the same as in a
+    serial run. If the time kernel is wider than the waterfall (or ``kt=None``), the
+    median filter is run in a single block.
+    """
+    method = _get_method_name(method, _PARALLEL_METHODS)
+
+    if spectrum.ndim != 2:
+        raise ValueError("spectrum must be 2D (ntime, nfreq) to flag in parallel.")
+
+    max_workers = max_workers or os.cpu_count()
+    n_blocks = min(n_blocks or max_workers, len(spectrum))
+
+    if method == "medfilt":
+        kt = kwargs.get("kt", _default_kwarg(xrfi_medfilt, "kt"))
+        if kt is None or 2 * kt + 1 > len(spectrum):
+            n_blocks = 1
+            kt = 0
+        return _parallel_medfilt(
+            spectrum, n_blocks, max_workers, use_threads, halo=4 * kt, **kwargs
+        )
+
+    blocks = _block_ranges(len(spectrum), n_blocks, 0)
+    arrays = {
+        name: kwargs.pop(name)
+        for name, val in list(kwargs.items())
+        if isinstance(val, np.ndarray) and val.shape == spectrum.shape
+    }
+    in_flags = arrays.get("flags")
+    arrays.update(spectrum=spectrum, **{"out:flags": np.zeros(spectrum.shape, bool)})
+
+    with _Pool(arrays, max_workers, use_threads) as pool:
+        infos = pool.map(method, blocks, (), kwargs)
+        flags = pool.arrays["out:flags"].copy()
+
+    if method == "model_sweep":
+        return flags
+
+    if in_flags is not None and kwargs.get("inplace", True):
+        in_flags |= flags
+
+    return flags, _stitch_model_info(infos, flags)
+
+
+def _parallel_medfilt(
+    spectrum: np.ndarray,
+    n_blocks: int,
+    max_workers: int,
+    use_threads: bool,
+    halo: int,
+    flags: [None, np.ndarray] = None,
+    inplace: bool = True,
+    max_iter: int = 1,
+    accumulate: bool = False,
+    **kwargs,
+):
+    """Run the iterations of :func:`xrfi_medfilt`, each one in parallel blocks."""
+    assert max_iter > 0
+
+    if flags is None:
+        new_flags = np.zeros(spectrum.shape, dtype=bool)
+    else:
+        new_flags = flags if inplace else flags.copy()
+
+    arrays = {
+        "spectrum": spectrum,
+        "flags": new_flags.copy(),
+        "out:flags": np.zeros(spectrum.shape, dtype=bool),
+        "out:significance": np.zeros(spectrum.shape),
+        "out:median_significance": np.zeros(spectrum.shape),
+    }
+    blocks = _block_ranges(len(spectrum), n_blocks, halo)
+    kwargs.update(max_iter=1, accumulate=accumulate, incremental=False)
+
+    ii = 0
+    nflags = -1
+    nflags_list = []
+    with _Pool(arrays, max_workers, use_threads) as pool:
+        while ii < max_iter and np.sum(new_flags) > nflags:
+            nflags = np.sum(new_flags)
+
+            pool.arrays["flags"][...] = new_flags
+            pool.map("medfilt", blocks, ("significance", "median_significance"), kwargs)
+
+            if accumulate:
+                new_flags |= pool.arrays["out:flags"]
+            else:
+                new_flags = pool.arrays["out:flags"].copy()
+
+            ii += 1
+            nflags_list.append(np.sum(new_flags))
+
+        significance = pool.arrays["out:significance"].copy()
+        med_significance = pool.arrays["out:median_significance"].copy()
+
+    if 1 < max_iter == ii and np.sum(new_flags) > nflags:
+        warnings.warn("Median filter reached max_iter and is still finding new RFI.")
+
+    return (
+        new_flags,
+        {
+            "significance": significance,
+            "median_significance": med_significance,
+            "iters": ii,
+            "nflags": nflags_list,
+            "residuals": [],
+        },
+    )
+
+
+_MULTIRES_METHODS = {"medfilt", "model", "sumthreshold"}
+
+# Filters over fewer samples than this can't tell a single outlier from the noise.
+_MIN_COARSE_KF = 4
+
+
+def _decimate(
+    spectrum: np.ndarray, flags: np.ndarray, factor: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Average bins of ``factor`` channels, ignoring flagged channels.
+
+    A final partial bin is averaged over the channels it has. Returns the coarse
+    spectrum and its flags, which are set for bins in which every channel is flagged.
+    Such bins are filled by linear interpolation between the nearest unflagged bins
+    (or zero, if every bin of an integration is flagged), so that the coarse spectrum
+    is finite and smooth across them for filters that use the flagged data as context.
+    """
+    nf = spectrum.shape[-1]
+    n_coarse = -(-nf // factor)
+    widths = [(0, 0)] * (spectrum.ndim - 1) + [(0, n_coarse * factor - nf)]
+    shape = spectrum.shape[:-1] + (n_coarse, factor)
+
+    total = np.pad(np.where(flags, 0, spectrum), widths).reshape(shape).sum(axis=-1)
+    count = np.pad(~flags, widths).reshape(shape).sum(axis=-1)
+    coarse = robust_divide(total, count.astype(float))
+    coarse_flags = count == 0
+    coarse[coarse_flags] = 0
+
+    bins = np.arange(n_coarse)
+    for row, row_flags in zip(
+        coarse.reshape((-1, n_coarse)), coarse_flags.reshape((-1, n_coarse))
+    ):
+        if row_flags.any() and not row_flags.all():
+            row[row_flags] = np.interp(
+                bins[row_flags], bins[~row_flags], row[~row_flags]
+            )
+    return coarse, coarse_flags
+
+
+def _selected_segments(
+    coarse_flags: np.ndarray, factor: int, pad: int, nf: int
+) -> List[Tuple[int, int]]:
+    """Get the contiguous ranges of fine channels covered by the flagged coarse bins.
+
+    A coarse bin is selected if it is flagged in any integration, or is within ``pad``
+    channels of one that is.
+    """
+    selected = coarse_flags.reshape((-1, coarse_flags.shape[-1])).any(axis=0)
+    if pad:
+        selected = ndimage.binary_dilation(selected, iterations=-(-pad // factor))
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], selected.astype(int), [0]])))
+    return [
+        (start * factor, min(stop * factor, nf))
+        for start, stop in zip(edges[::2], edges[1::2])
+    ]
+
+
+@_accepts_packed_flags()
+def xrfi_multires(
+    method: [str, Callable],
+    spectrum: np.ndarray,
+    *,
+    factor: int = 8,
+    pad: int = 32,
+    flags: [None, np.ndarray] = None,
+    inplace: bool = True,
+    coarse_kwargs: [None, dict] = None,
+    **kwargs,
+):
+    """Flag RFI coarse-to-fine, refining only the parts of the band with RFI.
+
+    The spectrum is first decimated in frequency by averaging bins of ``factor``
+    channels, and the flagger is run on the coarse spectrum. The full-resolution
+    flagger is then run only on the contiguous ranges of channels covered by the
+    flagged coarse bins (and ``pad`` channels either side of them, which provide the
+    context for the fine filter or model). All flags found at full resolution are
+    kept; the coarse flags only decide where to look.
+
+    Parameters
+    ----------
+    method : str or callable
+        The flagger to use: one of :func:`xrfi_medfilt`, :func:`xrfi_model` or
+        :func:`xrfi_sumthreshold` (or its name, with or without the ``xrfi_`` prefix).
+    spectrum : array-like
+        A 1D spectrum, or 2D waterfall of shape (ntime, nfreq). Only the frequency axis
+        is decimated.
+    factor : int, optional
+        The number of channels averaged into each coarse bin.
+    pad : int, optional
+        The number of channels either side of each flagged coarse bin that are also
+        re-flagged at full resolution (rounded up to a whole number of coarse bins).
+        This should be large enough for the flagger to estimate the spectrum and its
+        noise around the RFI: a few times ``kf`` for :func:`xrfi_medfilt`, or a few
+        tens of channels for :func:`xrfi_model`.
+    flags : array-like or :class:`~.flags.PackedFlags`, optional
+        Pre-existing flags. Flagged channels are ignored when averaging. If packed, the
+        returned flags are also packed.
+    inplace : bool, optional
+        Whether to fill up given flags array with the updated flags.
+    coarse_kwargs : dict, optional
+        Parameters of the flagger that are different for the coarse spectrum. By
+        default, the coarse flagger gets the same parameters as the fine one, except
+        that the frequency half-width ``kf`` of :func:`xrfi_medfilt` and
+        :func:`xrfi_sumthreshold` is converted to coarse bins (but is at least four
+        bins, since smaller filters can't find single outliers).
+
+    Other Parameters
+    ----------------
+    All other parameters are passed to the flagger.
+
+    Returns
+    -------
+    flags : array-like
+        Boolean array of the same shape as ``spectrum`` indicated which channels/times
+        have flagged RFI.
+    info : dict
+        Information about the flagging procedure: the ``coarse_flags`` and
+        ``coarse_info`` returned by the coarse flagger, the ``segments`` of channels
+        that were flagged at full resolution, and the ``refined_fraction`` of channels
+        in them.
+
+    Notes
+    -----
+    Averaging ``factor`` channels improves the sensitivity to RFI that is broader than
+    a bin by ``sqrt(factor)``, but dilutes a single-channel line by the same factor.
+    Very weak narrow lines that are only just above the threshold at full resolution
+    can therefore be missed. Averaging also makes a steep spectrum steeper with
+    respect to the noise, which the median filter handles badly (see
+    :func:`xrfi_medfilt`), so for such spectra consider ``poly_order`` in
+    ``coarse_kwargs``, or use :func:`xrfi_model`. See ``devel/benchmark_multires.py``
+    for a comparison of the recall and speed against flagging the full band at full
+    resolution.
+    """
+    method = _get_method_name(method, _MULTIRES_METHODS)
+    flagger = globals()[f"xrfi_{method}"]
+    if factor < 1 or pad < 0:
+        raise ValueError("factor must be positive and pad non-negative.")
+
+    nf = spectrum.shape[-1]
+    if flags is None:
+        flags = np.zeros(spectrum.shape, dtype=bool)
+    new_flags = flags if inplace else flags.copy()
+    in_flags = new_flags.copy()
+
+    kwargs_coarse = dict(kwargs)
+    if "kf" in inspect.signature(flagger).parameters:
+        kf = kwargs.get("kf", _default_kwarg(flagger, "kf"))
+        if kf is not None:
+            kwargs_coarse["kf"] = max(kf // factor, _MIN_COARSE_KF)
+    kwargs_coarse.update(coarse_kwargs or {})
+
+    coarse, coarse_flags = _decimate(spectrum, in_flags, factor)
+    coarse_flags, coarse_info = flagger(coarse, flags=coarse_flags, **kwargs_coarse)
+
+    segments = _selected_segments(coarse_flags, factor, pad, nf)
+    for start, stop in segments:
+        seg_flags, _ = flagger(
+            spectrum[..., start:stop], flags=in_flags[..., start:stop].copy(), **kwargs
+        )
+        new_flags[..., start:stop] |= seg_flags
+
+    return (
+        new_flags,
+        {
+            "coarse_flags": coarse_flags,
+            "coarse_info": coarse_info,
+            "segments": segments,
+            "refined_fraction": sum(stop - start for start, stop in segments) / nf,
+        },
+    )
+
+
+class StreamingFlagger:
+    def __init__(
+        self,
+        n_freq: int,
+        threshold: float = 6,
+        kf: int = 8,
+        n_history: int = 64,
+        estimator: str = "median",
+        halflife: [None, float] = None,
+        min_history: int = 8,
+    ):
+        """Flag RFI in integrations as they arrive, with bounded latency and memory.
+
+        Each integration is detrended along frequency with :func:`detrend_medfilt`,
+        and the resulting significance is flagged where it is above ``threshold``
+        (just as :func:`xrfi_medfilt` does for a single spectrum). To also catch RFI
+        that is only visible as a change over time, the flagger keeps rolling
+        statistics of the significance of each channel over the previous
+        integrations, and flags channels whose significance deviates from their own
+        recent history by more than ``threshold`` times their recent scatter. Flags
+        for an integration are returned as soon as it is pushed, and only unflagged
+        samples update the statistics.
+
+        Parameters
+        ----------
+        n_freq : int
+            The number of frequency channels in each integration.
+        threshold : float, optional
+            Number of effective sigma at which to clip RFI.
+        kf : int, optional
+            The half-width of the median filter along frequency.
+        n_history : int, optional
+            The number of previous integrations kept for the ``"median"`` estimator.
+        estimator : str, optional
+            How to estimate the centre and scatter of each channel over time. Either
+            ``"median"``, to use the median and MAD of the last ``n_history``
+            integrations (kept in a ring buffer), or ``"ewma"`` to use an exponentially
+            weighted mean and variance (which need no buffer).
+        halflife : float, optional
+            The half-life, in integrations, of the ``"ewma"`` weights. By default, half
+            of ``n_history``.
+        min_history : int, optional
+            The number of unflagged integrations a channel needs before its rolling
+            statistics are used. Until then, only the detrended significance is
+            thresholded.
+
+        Raises
+        ------
+        ValueError
+            If the estimator is not known, or the history is too short.
+
+        Examples
+        --------
+        In an acquisition loop, push each integration as it is read:
+
+        >>> flagger = StreamingFlagger(n_freq=len(freq))
+        >>> for spectrum in integrations:
+        ...     flags, info = flagger.push(spectrum)
+
+        To flag a whole (ntime, nfreq) waterfall in blocks of integrations, use
+        :meth:`run`.
+        """
+        if estimator not in ("median", "ewma"):
+            raise ValueError(f"estimator must be 'median' or 'ewma', got '{estimator}'")
+        if min_history < 2 or (estimator == "median" and n_history < min_history):
+            raise ValueError("min_history must be at least 2, and at most n_history.")
+
+        self.n_freq = n_freq
+        self.threshold = threshold
+        self.kf = kf
+        self.n_history = n_history
+        self.estimator = estimator
+        self.halflife = halflife or n_history / 2
+        self.min_history = min_history
+        self.reset()
+
+    def reset(self):
+        """Forget all the integrations seen so far."""
+        self.n_pushed = 0
+        self._count = np.zeros(self.n_freq, dtype=int)
+        if self.estimator == "median":
+            self._history = np.full((self.n_history, self.n_freq), np.nan)
+        else:
+            self._mean = np.zeros(self.n_freq)
+            self._var = np.zeros(self.n_freq)
+
+    @property
+    def _alpha(self) -> float:
+        """The weight of each new sample in the exponentially weighted statistics."""
+        return 1 - 0.5 ** (1 / self.halflife)
+
+    def statistics(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the current centre and scatter of the significance of each channel.
+
+        The scatter is never less than one. Channels without at least
+        ``min_history`` unflagged integrations have a centre and scatter of NaN.
+        """
+        if self.estimator == "median":
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                centre = np.nanmedian(self._history, axis=0)
+                scale = 1.4826 * np.nanmedian(np.abs(self._history - centre), axis=0)
+        else:
+            centre = self._mean.copy()
+            scale = np.sqrt(self._var)
+
+        # The significance is already in units of the noise along frequency, so a
+        # smaller scatter only happens when the detrending is degenerate (e.g. when
+        # its windows are monotonic and the significance is mostly zero).
+        scale = np.maximum(scale, 1)
+
+        enough = self._count >= self.min_history
+        return np.where(enough, centre, np.nan), np.where(enough, scale, np.nan)
+
+    def _update(self, significance: np.ndarray, flags: np.ndarray):
+        """Add the unflagged samples of an integration to the rolling statistics."""
+        good = ~flags
+        if self.estimator == "median":
+            row = self.n_pushed % self.n_history
+            self._count -= np.isfinite(self._history[row])
+            self._history[row] = np.where(good, significance, np.nan)
+        else:
+            delta = significance[good] - self._mean[good]
+            first = self._count[good] == 0
+            self._mean[good] += np.where(first, delta, self._alpha * delta)
+            self._var[good] = np.where(
+                first,
+                0,
+                (1 - self._alpha) * (self._var[good] + self._alpha * delta ** 2),
+            )
+
+        self._count += good
+        self.n_pushed += 1
+
+    def push(
+        self, spectrum: np.ndarray, flags: [None, np.ndarray] = None
+    ) -> Tuple[np.ndarray, dict]:
+        """Flag one integration, or a block of integrations, in time order.
+
+        Parameters
+        ----------
+        spectrum : array-like
+            A single integration of shape (nfreq,), or a block of shape
+            (ntime, nfreq).
+        flags : array-like, optional
+            Pre-existing flags for the integration(s). These are ignored in the
+            detrending and the rolling statistics, and are included in the output.
+
+        Returns
+        -------
+        flags : array-like
+            Boolean flags of the same shape as ``spectrum``.
+        info : dict
+            The ``significance`` of each sample from the frequency detrending, and the
+            ``temporal_significance`` of its deviation from the channel's history (NaN
+            for channels without enough history).
+        """
+        spectrum = np.asarray(spectrum)
+        if spectrum.shape[-1] != self.n_freq or spectrum.ndim > 2:
+            raise ValueError(
+                f"spectrum must have shape (nfreq,) or (ntime, nfreq), with nfreq="
+                f"{self.n_freq}. Got {spectrum.shape}."
+            )
+
+        block = np.atleast_2d(spectrum)
+        in_flags = (
+            ~np.isfinite(block)
+            if flags is None
+            else np.atleast_2d(flags) | ~np.isfinite(block)
+        )
+
+        significance = detrend_medfilt(block, flags=in_flags, half_size=(0, self.kf))
+        temporal = np.full(block.shape, np.nan)
+        out = in_flags | ~(np.abs(significance) <= self.threshold)
+
+        for i, sig in enumerate(significance):
+            centre, scale = self.statistics()
+            known = ~np.isnan(centre)
+            temporal[i, known] = robust_divide(sig[known] - centre[known], scale[known])
+            out[i, known] |= ~(np.abs(temporal[i, known]) <= self.threshold)
+            self._update(sig, out[i])
+
+        if spectrum.ndim == 1:
+            out, significance, temporal = out[0], significance[0], temporal[0]
+
+        return out, {"significance": significance, "temporal_significance": temporal}
+
+    def run(
+        self,
+        spectra: np.ndarray,
+        flags: [None, np.ndarray] = None,
+        block_size: int = 1,
+    ) -> np.ndarray:
+        """Flag a waterfall by pushing it through the flagger in blocks of integrations.
+
+        Parameters
+        ----------
+        spectra : array-like
+            The waterfall, of shape (ntime, nfreq).
+        flags : array-like, optional
+            Pre-existing flags of the same shape as ``spectra``.
+        block_size : int, optional
+            The number of integrations to push at a time.
+
+        Returns
+        -------
+        flags : array-like
+            Boolean flags of the same shape as ``spectra``.
+        """
+        out = np.zeros(spectra.shape, dtype=bool)
+        for start in range(0, len(spectra), block_size):
+            stop = start + block_size
+            out[start:stop], _ = self.push(
+                spectra[start:stop], None if flags is None else flags[start:stop]
+            )
+        return out
+
+
+def _explicit_stage(spectrum, flags, freq=None, **kwargs):
+    """Flag explicit frequency ranges of a spectrum, as a pipeline stage."""
+    if freq is None:
+        raise ValueError("The 'explicit' stage needs the frequencies of the spectrum.")
+    return np.broadcast_to(xrfi_explicit(freq, **kwargs), spectrum.shape), {}
+
+
+def _model_sweep_stage(spectrum, flags, **kwargs):
+    """Flag a spectrum with :func:`xrfi_model_sweep`, as a pipeline stage."""
+    return xrfi_model_sweep(spectrum, weights=(~flags).astype(float), **kwargs), {}
+
+
+# The flaggers that can be used as stages of an XRFIPipeline.
+_PIPELINE_STAGES = {
+    "explicit": _explicit_stage,
+    "medfilt": xrfi_medfilt,
+    "model": xrfi_model,
+    "model_sweep": _model_sweep_stage,
+    "multires": xrfi_multires,
+    "parallel": xrfi_parallel,
+    "sumthreshold": xrfi_sumthreshold,
+    "watershed": xrfi_watershed,
+}
+
+
+class XRFIPipeline:
+    def __init__(self, stages: List[dict], trace_memory: bool = False):
+        """A sequence of xRFI flaggers, run one after the other.
+
+        Each stage is given the flags of all the previous stages (so that it ignores
+        them), and its flags are added to them. The flags are kept in buffers owned by
+        the pipeline, which are only allocated when the shape of the data changes, so
+        repeated runs on spectra of the same shape allocate no new flag arrays.
+        The wall time and number of flags of each stage are recorded, and optionally
+        its peak memory.
+
+        Parameters
+        ----------
+        stages : list of dict
+            The specification of each stage. The ``flagger`` key gives the flagger to
+            use: one of "explicit" (:func:`xrfi_explicit`), "medfilt", "model",
+            "model_sweep", "multires", "parallel", "sumthreshold" or "watershed" (the
+            ``xrfi_`` functions of the same names). An optional ``name`` labels the
+            stage in the statistics. All other keys are passed to the flagger.
+        trace_memory : bool, optional
+            Whether to record the peak memory of each stage, as traced by
+            :mod:`tracemalloc`. Tracing slows down python-heavy stages by up to a
+            factor of two, so each stage is then run twice: once traced, for its
+            memory, and once untraced, for its flags and wall time.
+
+        Raises
+        ------
+        ValueError
+            If a stage has an unknown flagger.
+
+        Examples
+        --------
+        >>> pipeline = XRFIPipeline(
+        ...     [
+        ...         {"flagger": "explicit", "rfi_file": "mro_rfi.yaml"},
+        ...         {"flagger": "medfilt", "threshold": 6, "kf": 16, "kt": 16},
+        ...         {"flagger": "watershed", "tol": 0.5},
+        ...     ]
+        ... )
+        >>> flags, info = pipeline.run(waterfall, freq=freq)
+        >>> info["stages"][1]["time"]
+        """
+        self.stages = []
+        for stage in stages:
+            stage = dict(stage)
+            flagger = stage.pop("flagger", None)
+            if flagger not in _PIPELINE_STAGES:
+                raise ValueError(
+                    f"Each stage needs a 'flagger' in {sorted(_PIPELINE_STAGES)}. "
+                    f"Got '{flagger}'."
+                )
+            name = stage.pop("name", flagger)
+            self.stages.append({"flagger": flagger, "name": name, **stage})
+
+        self.trace_memory = trace_memory
+        self._flags = None
+        self._stage_flags = None
+        self.stats = []
+
+    @classmethod
+    def from_yaml(cls, fname: [str, os.PathLike], **kwargs) -> "XRFIPipeline":
+        """Read a pipeline from a YAML file with a list of stage specs under 'stages'.
+
+        Other parameters are passed to the constructor.
+        """
+        with open(fname, "r") as fl:
+            return cls(yaml.load(fl, Loader=yaml.FullLoader)["stages"], **kwargs)
+
+    def __repr__(self):
+        """A representation of the pipeline that determines its output.
+
+        The parameters of each stage are sorted, so that the representation (which is
+        used in the filenames of cached reduced spectra) doesn't depend on their order.
+        Whether memory is traced doesn't change the output, so is not included.
+        """
+        stages = [dict(sorted(stage.items())) for stage in self.stages]
+        return f"XRFIPipeline({stages})"
+
+    def _allocate(self, shape: Tuple[int]):
+        """Allocate the flag buffers, if they don't already have the right shape."""
+        if self._flags is None or self._flags.shape != shape:
+            self._flags = np.zeros(shape, dtype=bool)
+            self._stage_flags = np.zeros(shape, dtype=bool)
+
+    def _trace_stage(self, stage: dict, spectrum: np.ndarray, kwargs: dict) -> int:
+        """Get the peak memory (in bytes) of a stage run on the current stage flags."""
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            baseline = tracemalloc.get_traced_memory()[0]
+            # Before python 3.9, the peak can't be reset, so it is an upper bound.
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        else:
+            baseline = 0
+            tracemalloc.start()
+
+        try:
+            _PIPELINE_STAGES[stage["flagger"]](
+                spectrum=spectrum, flags=self._stage_flags, **kwargs
+            )
+            return tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+
+    def run(
+        self,
+        spectrum: np.ndarray,
+        flags: [None, np.ndarray] = None,
+        freq: [None, np.ndarray] = None,
+        out: [None, np.ndarray] = None,
+        provenance: [None, FlagProvenance] = None,
+    ) -> Tuple[np.ndarray, dict]:
+        """Run each stage of the pipeline on a spectrum or waterfall.
+
+        Parameters
+        ----------
+        spectrum : array-like
+            A 1D spectrum, or 2D waterfall of shape (ntime, nfreq).
+        flags : array-like, optional
+            Pre-existing flags, which every stage ignores.
+        freq : array-like, optional
+            The frequencies of the spectrum (only required by the "explicit" stage).
+        out : array-like, optional
+            A boolean array in which to accumulate the flags. By default, the flags are
+            accumulated in a buffer owned by the pipeline, which is returned, and is
+            overwritten by the next run (copy it to keep it).
+        provenance : :class:`~.flags.FlagProvenance`, optional
+            If given, the flags of each stage are recorded in it, labelled with the
+            name of the stage.
+
+        Returns
+        -------
+        flags : array-like
+            Boolean array of the same shape as ``spectrum`` indicated which channels/times
+            have flagged RFI.
+        info : dict
+            The ``stages`` statistics (also saved as :attr:`stats`), with the ``name``,
+            wall ``time`` (in seconds), total number of flags (``n_flags``), number of
+            flags added (``n_new_flags``) and ``peak_memory`` (in bytes, as traced by
+            :mod:`tracemalloc`, or None unless ``trace_memory`` is set) of each stage,
+            and the ``info`` returned by each flagger (as ``infos``). If memory is
+            already being traced before python 3.9, the peak memory of a stage may
+            include that of earlier allocations.
+        """
+        self._allocate(spectrum.shape)
+        if out is None:
+            out = self._flags
+
+        if flags is None:
+            out[...] = False
+        else:
+            np.copyto(out, flags)
+
+        self.stats = []
+        infos = []
+        for stage in self.stages:
+            kwargs = {k: v for k, v in stage.items() if k not in ("flagger", "name")}
+            if stage["flagger"] == "explicit":
+                kwargs["freq"] = freq
+
+            n_flags = np.sum(out)
+            peak = None
+            if self.trace_memory:
+                np.copyto(self._stage_flags, out)
+                peak = self._trace_stage(stage, spectrum, kwargs)
+
+            # Stages may update the flags they are given in place.
+            np.copyto(self._stage_flags, out)
+            start = time.perf_counter()
+            stage_flags, info = _PIPELINE_STAGES[stage["flagger"]](
+                spectrum=spectrum, flags=self._stage_flags, **kwargs
+            )
+            out |= stage_flags
+            elapsed = time.perf_counter() - start
+
+            if provenance is not None:
+                provenance.record(stage_flags, stage["name"])
+
+            infos.append(info)
+            self.stats.append(
+                {
+                    "name": stage["name"],
+                    "time": elapsed,
+                    "n_flags": int(np.sum(out)),
+                    "n_new_flags": int(np.sum(out) - n_flags),
+                    "peak_memory": peak,
+                }
+            )
+
+        return out, {"stages": self.stats, "infos": infos}
@@ -7,6 +7,7 @@ from edges_io import io
 from pathlib import Path
 
 from edges_cal import cal_coefficients as cc
+from edges_cal import xrfi
 
 
 def test_vna_from_file(data_path):
@@ -165,6 +166,51 @@ def test_2d_rfi_removal(cal_data, tmpdir, caplog):
     assert isinstance(calobs.ambient.spectrum.ancillary[0], dict)
 
 
+def test_stream_rfi_removal(cal_data: Path, tmpdir: Path):
+    spec = cc.LoadSpectrum.from_load_name(
+        "ambient",
+        cal_data,
+        cache_dir=tmpdir / "cal-coeff-cache-stream",
+        rfi_removal="stream",
+        rfi_kernel_width_time=0,
+    )
+
+    assert spec.averaged_Q.ndim == 1
+    assert np.any(np.isfinite(spec.averaged_Q))
+    for prov in spec.flag_provenance.values():
+        assert prov.stages == ["stream"]
+
+
+def test_pipeline_rfi_removal(cal_data: Path, tmpdir: Path):
+    stages = [
+        {"flagger": "medfilt", "kt": 2, "kf": 5, "name": "median filter"},
+        {"flagger": "watershed", "tol": 0.2},
+    ]
+    cache = tmpdir / "cal-coeff-cache-pipeline"
+    spec = cc.LoadSpectrum.from_load_name(
+        "ambient", cal_data, cache_dir=cache, rfi_removal=xrfi.XRFIPipeline(stages)
+    )
+
+    assert spec.averaged_Q.ndim == 1
+    assert np.any(np.isfinite(spec.averaged_Q))
+    for prov in spec.flag_provenance.values():
+        assert prov.stages == ["median filter", "watershed"]
+
+    # The cached spectra are found by the parameters of the pipeline (in any order).
+    same = cc.LoadSpectrum.from_load_name(
+        "ambient",
+        cal_data,
+        cache_dir=cache,
+        rfi_removal=xrfi.XRFIPipeline([dict(reversed(s.items())) for s in stages]),
+    )
+    assert same._get_integrated_filename() == spec._get_integrated_filename()
+
+    other = cc.LoadSpectrum.from_load_name(
+        "ambient", cal_data, cache_dir=cache, rfi_removal=xrfi.XRFIPipeline(stages[:1]),
+    )
+    assert other._get_integrated_filename() != spec._get_integrated_filename()
+
+
 def test_bad_fminmax(cal_data: Path):
     with pytest.raises(ValueError):
         cc.CalibrationObservation(cal_data, f_low=100, f_high=50)
@@ -270,6 +316,31 @@ def test_calibration_init(cal_data: Path, tmpdir: Path):
     assert cal.internal_switch is None
 
 
+def test_flag_provenance_io(cal_data: Path, tmpdir: Path):
+    cache = tmpdir / "cal-coeff-cache-provenance"
+    calobs = cc.CalibrationObservation(
+        cal_data, load_kwargs={"cache_dir": cache}, cterms=5, compile_from_def=False
+    )
+    provenance = dict(calobs.ambient.spectrum.flag_provenance)
+    assert set(provenance) == {"p0", "p1", "p2", "Q"}
+
+    # Read back from the reduced-spectrum cache.
+    spec = calobs.ambient.spectrum
+    del spec._ave_and_var_spec
+    assert spec._get_integrated_filename().exists()
+    for kind, prov in spec.flag_provenance.items():
+        assert prov.stages == provenance[kind].stages
+        assert np.array_equal(prov.to_bool(), provenance[kind].to_bool())
+
+    # And from the calibration file.
+    calobs.write(tmpdir / "calfile-provenance.h5")
+    cal = cc.Calibration(tmpdir / "calfile-provenance.h5")
+    assert set(cal.flag_provenance) == set(calobs._loads)
+    for kind, prov in cal.flag_provenance["ambient"].items():
+        assert prov.stages == provenance[kind].stages
+        assert np.array_equal(prov.to_bool(), provenance[kind].to_bool())
+
+
 def test_term_sweep(cal_data: Path, tmpdir: Path):
     cache = tmpdir / "cal-coeff-cache"
     calobs = cc.CalibrationObservation(
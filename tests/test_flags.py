@@ -0,0 +1,121 @@
+import pytest
+
+import numpy as np
+
+from edges_cal.flags import FlagProvenance, PackedFlags
+
+
+@pytest.fixture(params=[(13,), (7, 13), (5, 16), (3, 4, 21)])
+def bool_flags(request):
+    np.random.seed(1234)
+    return np.random.random(request.param) < 0.3
+
+
+def test_roundtrip(bool_flags):
+    packed = PackedFlags.from_bool(bool_flags)
+    assert np.array_equal(packed.to_bool(), bool_flags)
+    assert np.array_equal(np.asarray(packed), bool_flags)
+    assert packed.shape == bool_flags.shape
+    assert packed.nbytes < bool_flags.nbytes or bool_flags.shape[-1] < 8
+    assert packed == PackedFlags.from_bool(bool_flags)
+
+    assert PackedFlags.zeros(bool_flags.shape).count() == 0
+
+
+def test_logic(bool_flags):
+    other = np.random.random(bool_flags.shape) < 0.5
+    packed = PackedFlags.from_bool(bool_flags)
+    packed_other = PackedFlags.from_bool(other)
+
+    assert np.array_equal((packed | packed_other).to_bool(), bool_flags | other)
+    assert np.array_equal((packed & other).to_bool(), bool_flags & other)
+    assert np.array_equal((packed ^ packed_other).to_bool(), bool_flags ^ other)
+    assert np.array_equal((~packed).to_bool(), ~bool_flags)
+
+    copy = packed.copy()
+    copy |= other
+    assert np.array_equal(copy.to_bool(), bool_flags | other)
+    assert np.array_equal(packed.to_bool(), bool_flags)
+
+
+def test_count(bool_flags):
+    packed = PackedFlags.from_bool(bool_flags)
+    assert packed.count() == np.sum(bool_flags)
+    assert (~packed).count() == np.sum(~bool_flags)
+
+    for axis in range(bool_flags.ndim):
+        assert np.array_equal(packed.count(axis), np.sum(bool_flags, axis=axis))
+        assert np.array_equal(packed.any(axis), np.any(bool_flags, axis=axis))
+
+
+def test_set_rows_and_channels(bool_flags):
+    packed = PackedFlags.from_bool(bool_flags)
+    expected = bool_flags.copy()
+
+    channels = np.arange(bool_flags.shape[-1]) % 5 == 0
+    packed.set_channels(channels)
+    expected[..., channels] = True
+    assert np.array_equal(packed.to_bool(), expected)
+
+    if bool_flags.ndim > 1:
+        rows = np.arange(bool_flags.shape[0]) % 2 == 0
+        packed.set_rows(rows)
+        expected[rows] = True
+        assert np.array_equal(packed.to_bool(), expected)
+        assert packed.count() == np.sum(expected)
+
+        assert np.array_equal(packed[1:].to_bool(), expected[1:])
+
+
+def test_bad_input():
+    with pytest.raises(ValueError):
+        PackedFlags(np.zeros(3, dtype=np.uint8), (30,))
+
+    with pytest.raises(IndexError):
+        PackedFlags.zeros((10, 20))[:, 3]
+
+
+def test_provenance(bool_flags):
+    other = np.random.random(bool_flags.shape) < 0.5
+
+    provenance = FlagProvenance(bool_flags.shape)
+    provenance.record(bool_flags, "first")
+    provenance.record(other, "second", iteration=3)
+
+    assert len(provenance) == 2
+    assert np.array_equal(provenance.to_bool(), bool_flags | other)
+    assert np.array_equal(provenance.to_bool(stages="first"), bool_flags)
+    assert np.array_equal(provenance.to_bool(iterations=3), other)
+    assert not np.any(provenance.to_bool(stages="third"))
+
+    flat = bool_flags.reshape(-1, bool_flags.shape[-1])
+    assert np.array_equal(
+        provenance.to_bool(stages="first", rows=slice(1, None)), flat[1:]
+    )
+
+    index = tuple(np.argwhere(bool_flags)[0])
+    expected = [("first", 0)] + ([("second", 3)] if other[index] else [])
+    assert provenance.query(index) == expected
+
+    both = provenance | provenance
+    assert len(both) == 4
+    assert np.array_equal(both.to_bool(), bool_flags | other)
+
+
+def test_provenance_hdf5(tmp_path, bool_flags):
+    h5py = pytest.importorskip("h5py")
+
+    provenance = FlagProvenance(bool_flags.shape)
+    provenance.record(bool_flags, "medfilt", 1)
+
+    with h5py.File(tmp_path / "provenance.h5", "w") as fl:
+        provenance.write(fl.create_group("provenance"))
+        FlagProvenance(bool_flags.shape).write(fl.create_group("empty"))
+
+    with h5py.File(tmp_path / "provenance.h5", "r") as fl:
+        read = FlagProvenance.read(fl["provenance"])
+        empty = FlagProvenance.read(fl["empty"])
+
+    assert read.stages == ["medfilt"] and read.iterations == [1]
+    assert np.array_equal(read.to_bool(), bool_flags)
+    assert len(empty) == 0
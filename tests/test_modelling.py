@@ -141,3 +141,225 @@ def test_2d_weights():
     fit = m.fit(ydata=m(), weights=1 / weights)
     assert fit.weights.ndim == 2
     assert np.allclose(fit.model_parameters, [1, 2, 3, 4])
+
+
+def per_term_at(model, x):
+    return np.array([model._get_basis_term(i, x) for i in range(model.n_terms)])
+
+
+@pytest.mark.parametrize(
+    "model",
+    [
+        mdl.PhysicalLin(n_terms=5),
+        mdl.Polynomial(n_terms=12),
+        mdl.Polynomial(n_terms=12, log_x=True, offset=2),
+        mdl.EdgesPoly(n_terms=6),
+        mdl.LinLog(n_terms=6),
+        mdl.Fourier(n_terms=41),
+    ],
+)
+def test_vectorized_basis(model):
+    x = np.linspace(50, 100, 37)
+    assert model._vectorized_basis
+
+    per_term = per_term_at(model, x)
+    assert np.allclose(model.get_basis(x), per_term, rtol=1e-10, atol=1e-12)
+    assert np.allclose(model.get_basis(x, indices=[3, 1]), per_term[[3, 1]])
+
+    # Scalar (and 2D) co-ordinates give one value per term.
+    scalar = model.get_basis(np.float64(75.0))
+    assert scalar.shape == (model.n_terms,)
+    assert np.allclose(scalar, per_term_at(model, 75.0))
+    grid = x.reshape((37, 1))
+    assert model.get_basis(grid).shape == (model.n_terms, 37, 1)
+    assert np.allclose(model.get_basis(grid)[..., 0], per_term, rtol=1e-10, atol=1e-12)
+
+
+def test_scalar_evaluation():
+    assert mdl.EdgesPoly(n_terms=3)(x=75.0, parameters=[1, 2, 3]) == 6.0
+
+
+def test_per_term_basis_subclass():
+    class Squares(mdl.Polynomial, is_meta=True):
+        def _get_basis_term(self, indx, x):
+            return x ** (2 * indx)
+
+    m = Squares(n_terms=3)
+    assert not m._vectorized_basis
+    assert np.allclose(m.get_basis(np.array([2.0])), [[1], [4], [16]])
+
+
+def test_basis_cache():
+    mdl.basis_cache.clear()
+    x = np.linspace(50, 100, 20)
+
+    basis = mdl.Polynomial(n_terms=4).get_basis(x)
+    assert mdl.basis_cache.stats["misses"] == 1
+
+    # A different instance with the same hyper-parameters shares the basis.
+    assert mdl.Polynomial(n_terms=4).get_basis(x.copy()) is basis
+    assert mdl.basis_cache.stats["hits"] == 1
+    assert not basis.flags.writeable
+
+    # But not with different hyper-parameters or co-ordinates.
+    assert mdl.Polynomial(n_terms=4, offset=1).get_basis(x) is not basis
+    assert mdl.Polynomial(n_terms=4).get_basis(x + 1) is not basis
+    assert mdl.EdgesPoly(n_terms=4).get_basis(x) is not basis
+    assert len(mdl.basis_cache) == 4
+
+    mdl.basis_cache.clear()
+    assert len(mdl.basis_cache) == 0
+    assert mdl.basis_cache.stats["hits"] == 0
+
+
+def test_basis_cache_eviction():
+    cache = mdl.BasisCache(max_bytes=2 * 10 * 8)
+    for i in range(3):
+        cache.put(i, np.zeros(10))
+
+    assert len(cache) == 2
+    assert cache.nbytes == 160
+    assert cache.get(0) is None
+    assert cache.get(2) is not None
+
+
+@pytest.mark.parametrize("backend", ["qr", "cholesky", "statsmodels"])
+@pytest.mark.parametrize("weights", ["none", "1d", "2d"])
+def test_backends(backend, weights):
+    if backend == "statsmodels":
+        pytest.importorskip("statsmodels")
+
+    np.random.seed(1234)
+    xdata = np.linspace(50, 100, 60)
+    m = mdl.LinLog(n_terms=4, default_x=xdata, parameters=(1, 2, 3, 4))
+    ydata = m() + np.random.normal(scale=0.01, size=60)
+
+    if weights == "none":
+        weights = None
+    elif weights == "1d":
+        weights = np.random.uniform(0.5, 2, size=60)
+        weights[10:15] = 0
+    else:
+        # The covariance of the data is taken to be 1 / weights.
+        indx = np.arange(60)
+        weights = np.exp(np.abs(indx[:, None] - indx[None, :]) / 5)
+
+    fit = mdl.ModelFit(m, ydata=ydata, weights=weights, backend=backend)
+    ref = mdl.ModelFit(m, ydata=ydata, weights=weights, backend="qr")
+
+    assert np.allclose(fit.model_parameters, ref.model_parameters)
+    assert np.allclose(fit.get_covariance(), ref.get_covariance())
+    assert np.allclose(fit.fit.resid, ref.fit.resid)
+
+
+def test_bad_backend():
+    with pytest.raises(ValueError):
+        mdl.ModelFit(
+            "polynomial", xdata=np.linspace(0, 1, 10), ydata=np.ones(10), backend="svd"
+        )
+
+
+@pytest.mark.parametrize("backend", ["qr", "cholesky"])
+def test_multiple_ydata(backend):
+    np.random.seed(1234)
+    xdata = np.linspace(50, 100, 40)
+    weights = np.random.uniform(0.5, 2, size=40)
+    ydata = np.random.normal(size=(3, 40))
+    m = mdl.Polynomial(n_terms=5, default_x=xdata)
+
+    fit = mdl.ModelFit(m, ydata=ydata, weights=weights, backend=backend)
+    assert fit.model_parameters.shape == (3, 5)
+    assert fit.evaluate().shape == (3, 40)
+    assert fit.evaluate(np.linspace(60, 70, 7)).shape == (3, 7)
+    assert fit.weighted_chi2.shape == (3,)
+
+    for y, params, chi2 in zip(ydata, fit.model_parameters, fit.weighted_chi2):
+        single = mdl.ModelFit(m, ydata=y, weights=weights, backend=backend)
+        assert np.allclose(params, single.model_parameters)
+        assert np.isclose(chi2, single.weighted_chi2)
+
+
+def test_bad_ydata_shape():
+    with pytest.raises(ValueError):
+        mdl.ModelFit("polynomial", xdata=np.linspace(0, 1, 10), ydata=np.ones(9))
+
+
+@pytest.mark.parametrize("polar", [False, True])
+def test_complex_fit(polar):
+    xdata = np.linspace(-1, 1, 50)
+    model = mdl.Fourier(n_terms=5, default_x=xdata)
+    first = model(parameters=[1, 0.1, 0.2, 0.05, 0.01])
+    second = model(parameters=[0.5, 0.3, -0.1, 0.2, 0.1])
+    ydata = first * np.exp(1j * second) if polar else first + 1j * second
+
+    fit = mdl.ComplexModelFit(model, ydata=ydata, polar=polar)
+    assert np.iscomplexobj(fit.evaluate())
+    assert np.allclose(fit(), ydata)
+    assert np.allclose(fit.evaluate(xdata[::2]), ydata[::2])
+    assert np.allclose(fit.residual, 0)
+    assert np.isclose(fit.weighted_chi2, 0)
+
+    with pytest.raises(ValueError):
+        mdl.ComplexModelFit(model, ydata=np.array([ydata, ydata]))
+
+
+def test_factorization_cache():
+    mdl.factorization_cache.clear()
+    np.random.seed(1234)
+    xdata = np.linspace(50, 100, 40)
+    weights = np.random.uniform(0.5, 2, size=40)
+    m = mdl.Polynomial(n_terms=4, default_x=xdata)
+
+    first = mdl.ModelFit(m, ydata=np.random.normal(size=40), weights=weights)
+    first.model_parameters
+    assert mdl.factorization_cache.stats["misses"] == 1
+
+    ydata = np.random.normal(size=40)
+    second = mdl.ModelFit(m, ydata=ydata, weights=weights)
+    second.model_parameters
+    assert mdl.factorization_cache.stats["hits"] == 1
+    assert len(mdl.factorization_cache) == 1
+
+    # The cached factorization gives the same fit as a fresh one.
+    mdl.factorization_cache.clear()
+    fresh = mdl.ModelFit(m, ydata=ydata, weights=weights)
+    assert np.allclose(second.model_parameters, fresh.model_parameters)
+
+    # Different weights are factorized anew.
+    mdl.ModelFit(m, ydata=ydata, weights=weights + 1).model_parameters
+    assert mdl.factorization_cache.stats["misses"] == 2
+
+
+@pytest.mark.parametrize("backend", ["qr", "cholesky"])
+def test_extend_terms(backend):
+    np.random.seed(1234)
+    xdata = np.linspace(50, 100, 80)
+    weights = np.random.uniform(0.5, 2, size=80)
+    weights[20:25] = 0
+    ydata = np.random.normal(size=80)
+
+    fit = mdl.ModelFit(
+        "polynomial",
+        xdata=xdata,
+        ydata=ydata,
+        weights=weights,
+        n_terms=3,
+        backend=backend,
+    )
+    params, chi2 = fit.extend_terms(5)
+    assert len(params) == 6
+    assert chi2.shape == (6,)
+    assert fit.model.n_terms == 3
+
+    for n, (p, c) in enumerate(zip(params, chi2), start=3):
+        fresh = mdl.ModelFit(
+            "polynomial", xdata=xdata, ydata=ydata, weights=weights, n_terms=n
+        )
+        assert np.allclose(p, fresh.model_parameters)
+        assert np.isclose(c, fresh.weighted_chi2)
+
+
+def test_update_nterms_many():
+    m = mdl.Polynomial(n_terms=2, default_x=np.linspace(0, 1, 10))
+    m.update_nterms(7)
+    assert np.allclose(m.default_basis, m.get_basis(m.default_x))
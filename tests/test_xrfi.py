@@ -3,10 +3,15 @@ import pytest
 
 import itertools
 import numpy as np
+import os
+import tracemalloc
+import yaml
+from functools import partial
 from pytest_cases import fixture_ref as fxref
 from pytest_cases import parametrize_plus
 
 from edges_cal import xrfi
+from edges_cal.flags import PackedFlags
 
 NFREQ = 1000
 
@@ -106,6 +111,45 @@ def test_flagged_filter(sky_pl_1d, rfi_regular_1d):
     assert np.allclose(detrended, sky_pl_1d, rtol=1e-1)
 
 
+@pytest.mark.parametrize("mode", ["reflect", "mirror", "nearest", "wrap", "constant"])
+@pytest.mark.parametrize("size", [1, 4, 9, (3, 5), (1, 7)])
+@pytest.mark.parametrize("kind", ["median", "mean"])
+def test_flagged_filter_engines(mode, size, kind):
+    np.random.seed(1234)
+    shape = (20, 50)
+    data = np.random.normal(size=shape)
+    data[np.random.random(shape) < 0.05] = np.inf
+    flags = np.random.random(shape) < 0.3
+    flags[:, :10] = True
+
+    if np.isscalar(size):
+        data, flags = data[0], flags[0]
+
+    generic = xrfi.flagged_filter(
+        data, size, kind=kind, flags=flags, mode=mode, engine="generic"
+    )
+    fast = xrfi.flagged_filter(data, size, kind=kind, flags=flags, mode=mode)
+
+    if kind == "median":
+        assert np.array_equal(generic, fast, equal_nan=True)
+    else:
+        assert np.allclose(generic, fast, rtol=1e-12, atol=0, equal_nan=True)
+
+
+def test_flagged_median_filter_bad_input():
+    with pytest.raises(ValueError):
+        xrfi.flagged_median_filter(np.zeros(10), size=(3, 3))
+
+    with pytest.raises(ValueError):
+        xrfi.flagged_median_filter(np.zeros(10), size=3, origin=2)
+
+    with pytest.raises(ValueError):
+        xrfi.flagged_median_filter(np.zeros(10), size=3, mode="bad")
+
+    with pytest.raises(ValueError):
+        xrfi.flagged_filter(np.zeros(10), size=3, engine="bad")
+
+
 @parametrize_plus(
     "sky_model", [fxref(sky_flat_1d), fxref(sky_pl_1d), fxref(sky_linpoly_1d)]
 )
@@ -148,6 +192,98 @@ def test_1d_medfilt(sky_model, rfi_model, scale):
     assert len(wrong) == 0
 
 
+@pytest.mark.parametrize("accumulate", [False, True])
+@pytest.mark.parametrize("kt", [0, 2])
+def test_medfilt_incremental(sky_pl_1d, accumulate, kt):
+    np.random.seed(1010)
+    sky = np.outer(np.ones(30), sky_pl_1d)
+    sky += np.random.normal(scale=sky / 100)
+    rfi = np.random.random(sky.shape) < 0.02
+    sky[rfi] += np.random.exponential(size=np.sum(rfi)) * sky_pl_1d.max() / 10
+
+    kwargs = {
+        "threshold": 4,
+        "kf": 5,
+        "kt": kt,
+        "max_iter": 10,
+        "accumulate": accumulate,
+    }
+    flags, info = xrfi.xrfi_medfilt(sky, incremental=False, **kwargs)
+    flags_inc, info_inc = xrfi.xrfi_medfilt(sky, incremental=True, **kwargs)
+
+    assert info["iters"] > 1
+    assert np.array_equal(flags, flags_inc)
+    assert np.array_equal(info["significance"], info_inc["significance"])
+
+
+@pytest.mark.parametrize(
+    "func,kwargs",
+    [
+        (xrfi.detrend_medfilt, {"half_size": (2, 4)}),
+        (xrfi.detrend_medfilt, {"half_size": (2, 4), "cache": {}}),
+        (xrfi.detrend_meanfilt, {"half_size": (2, 4)}),
+    ],
+)
+def test_detrend_out_workspace(sky_pl_1d, func, kwargs):
+    np.random.seed(2020)
+    sky = np.outer(np.ones(20), sky_pl_1d)
+    sky += np.random.normal(scale=sky / 100)
+    flags = np.random.random(sky.shape) < 0.05
+    orig = sky.copy()
+
+    expected = func(sky, flags=flags, **kwargs)
+
+    kwargs = dict(kwargs, cache={}) if "cache" in kwargs else kwargs
+    out = np.empty_like(sky)
+    workspace = {}
+    for i in range(2):
+        significance = func(sky, flags=flags, out=out, workspace=workspace, **kwargs)
+        assert significance is out
+        assert np.array_equal(significance, expected, equal_nan=True)
+
+        # The scratch buffers are re-used on later calls.
+        if i == 0:
+            buffers = {key: id(val) for key, val in workspace.items()}
+        else:
+            assert buffers == {key: id(val) for key, val in workspace.items()}
+
+    assert np.array_equal(sky, orig)
+
+
+def test_detrend_medfilt_cache_mismatch(sky_pl_1d):
+    np.random.seed(2020)
+    sky = np.outer(np.ones(20), sky_pl_1d)
+    sky += np.random.normal(scale=sky / 100)
+    flags = np.random.random(sky.shape) < 0.05
+
+    cache = {}
+    xrfi.detrend_medfilt(sky, flags=flags, half_size=(2, 4), cache=cache)
+
+    # Data of a different shape or type is detrended from scratch.
+    for data, data_flags in [
+        (sky[:10], flags[:10]),
+        (sky[:10].astype(np.float32), flags[:10]),
+    ]:
+        expected = xrfi.detrend_medfilt(data, flags=data_flags, half_size=(2, 4))
+        significance = xrfi.detrend_medfilt(
+            data, flags=data_flags, half_size=(2, 4), cache=cache
+        )
+        assert np.array_equal(significance, expected, equal_nan=True)
+        assert cache["median"].shape == data.shape
+        assert cache["median"].dtype == data.dtype
+
+
+def test_robust_divide_inplace():
+    num = np.array([1.0, 0.0, -2.0, 3.0])
+    den = np.array([2.0, 0.0, 0.0, 1e-300])
+    expected = xrfi.robust_divide(num, den)
+    assert np.array_equal(expected, [0.5, 0, np.inf, np.inf])
+
+    out = xrfi.robust_divide(num, den, out=num)
+    assert out is num
+    assert np.array_equal(num, expected)
+
+
 @parametrize_plus(
     "sky_model", [fxref(sky_flat_1d), fxref(sky_pl_1d), fxref(sky_linpoly_1d)]
 )
@@ -247,6 +383,566 @@ def test_poly_watershed_relaxed(sky_model, rfi_model, scale):
     assert len(wrong) == 0
 
 
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"accumulate": True, "increase_order": False},
+        {"watershed": 1, "threshold": 10},
+    ],
+)
+def test_poly_2d(sky_pl_1d, rfi_regular_1d, kwargs):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d * (1 + i / 10) for i in range(4)])
+    sky += np.random.normal(scale=sky / 1000)
+    sky[1] += rfi_regular_1d * sky_pl_1d.max()
+    sky[2, 100:200] += sky_pl_1d.max()
+
+    flags, info = xrfi.xrfi_model(sky, **kwargs)
+
+    for row, spectrum in enumerate(sky):
+        flags1d, info1d = xrfi.xrfi_model(spectrum, **kwargs)
+        assert np.array_equal(flags[row], flags1d)
+        assert info["n_iters"][row] == info1d["n_iters"]
+        assert np.array_equal(
+            info["total_flags"][row, : info1d["n_iters"]], info1d["total_flags"]
+        )
+
+    assert info["total_flags"].shape == (4, info["n_iters"].max())
+
+
+def test_incremental_fit():
+    np.random.seed(2020)
+    x = np.linspace(-1, 1, 120)
+    basis = np.array([x ** i for i in range(6)])
+    data = np.random.normal(size=(3, 120))
+    flags = np.random.random((3, 120)) < 0.1
+    rows = np.arange(3)
+
+    fit = xrfi._IncrementalFit(data, flags)
+    fit.append_terms(basis[:4], rows)
+
+    flags = flags | (np.random.random((3, 120)) < 0.1)
+    flags[:, :5] = False
+    fit.update_flags(flags, rows)
+    fit.append_terms(basis[4:], rows)
+
+    par = fit.model_parameters(fit.solve(rows, 6))
+    for row in rows:
+        good = ~flags[row]
+        expected = np.linalg.lstsq(basis[:, good].T, data[row, good], rcond=None)[0]
+        assert np.allclose(par[row], expected)
+
+
+def test_incremental_fit_heavy_flagging():
+    np.random.seed(2021)
+    x = np.linspace(-1, 1, 400)
+    basis = np.polynomial.legendre.legvander(x, 7).T
+    data = np.random.normal(size=(2, 400)) + 100 * x ** 3
+    rows = np.arange(2)
+
+    fit = xrfi._IncrementalFit(data, np.zeros(data.shape, dtype=bool))
+    fit.append_terms(basis, rows)
+
+    # Flag 70% of the data at once: the normal equations are rebuilt.
+    flags = np.random.random(data.shape) < 0.7
+    fit.update_flags(flags, rows)
+
+    model = fit.evaluate(fit.solve(rows, 8))
+    for row in rows:
+        good = ~flags[row]
+        par = np.linalg.lstsq(basis[:, good].T, data[row, good], rcond=None)[0]
+        assert np.allclose(model[row], par @ basis, rtol=0, atol=1e-10)
+
+
+@pytest.mark.parametrize("width", [1, 3, 8])
+def test_sumthreshold_pass(width):
+    np.random.seed(1234)
+    significance = np.random.normal(scale=2, size=(3, 50))
+    flags = np.random.random((3, 50)) < 0.2
+
+    expected = np.zeros_like(flags)
+    for row in range(3):
+        for start in range(50 - width + 1):
+            run = slice(start, start + width)
+            good = ~flags[row, run]
+            if np.any(good) and np.abs(
+                np.sum(significance[row, run][good])
+            ) > 1.5 * np.sum(good):
+                expected[row, run] = True
+
+    out = xrfi._sumthreshold_pass(significance, flags, width, 1.5, axis=1)
+    assert np.array_equal(out, expected)
+
+    out = xrfi._sumthreshold_pass(significance.T, flags.T, width, 1.5, axis=0)
+    assert np.array_equal(out, expected.T)
+
+
+def test_sumthreshold_1d():
+    np.random.seed(1010)
+    significance = np.random.normal(size=1000)
+    significance[300:350] += 1.5
+    significance[700] += 10
+
+    flags, info = xrfi.xrfi_sumthreshold(significance, detrend=False)
+    assert np.all(flags[300:350])
+    assert flags[700]
+    assert np.sum(flags) < 80
+    assert len(info["nflags"]) == len(info["widths"]) == 7
+
+
+def test_sumthreshold_2d(sky_pl_1d):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d] * 40)
+    noise = sky / 100
+    sky += np.random.normal(scale=noise)
+
+    # A weak broadband burst, too weak to find in any single sample.
+    burst = np.zeros(sky.shape, dtype=bool)
+    burst[20:24, 300:500] = True
+    sky[burst] += 1.5 * noise[burst]
+
+    flags, _ = xrfi.xrfi_sumthreshold(sky)
+    medfilt_flags, _ = xrfi.xrfi_medfilt(sky, kt=8, kf=8)
+
+    assert np.mean(flags[burst]) > 0.9
+    assert np.mean(flags[~burst]) < 0.02
+    assert not np.any(medfilt_flags[burst])
+
+
+@pytest.mark.parametrize("use_threads", [True, False])
+@pytest.mark.parametrize(
+    "method,kwargs",
+    [
+        ("medfilt", {"kt": 2, "kf": 5}),
+        ("medfilt", {"kt": 2, "kf": 5, "max_iter": 3, "accumulate": True}),
+        ("medfilt", {"kt": 50, "kf": 5}),
+        ("model", {"return_models": True}),
+        ("model_sweep", {"window_width": 50, "use_median": True}),
+    ],
+)
+def test_parallel(sky_pl_1d, use_threads, method, kwargs):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d * (1 + i / 100) for i in range(20)])
+    sky += np.random.normal(scale=sky / 100)
+    rfi = np.random.random(sky.shape) < 0.01
+    sky[rfi] += 50
+
+    serial = getattr(xrfi, f"xrfi_{method}")(sky, **kwargs)
+    parallel = xrfi.xrfi_parallel(
+        method, sky, n_blocks=3, max_workers=2, use_threads=use_threads, **kwargs
+    )
+
+    if method == "model_sweep":
+        assert np.array_equal(serial, parallel)
+        return
+
+    assert np.array_equal(serial[0], parallel[0])
+    for key, val in serial[1].items():
+        if key == "model":
+            continue
+        elif isinstance(val, list):
+            assert all(
+                np.array_equal(x, y, equal_nan=True)
+                for x, y in zip(val, parallel[1][key])
+            )
+        elif isinstance(val, np.ndarray) and val.dtype.kind == "f":
+            # The running means of the mean filter depend on where the block starts.
+            assert np.allclose(
+                val, parallel[1][key], rtol=1e-10, atol=1e-10, equal_nan=True
+            )
+        else:
+            assert np.array_equal(val, parallel[1][key])
+
+
+def test_parallel_bad_input(sky_pl_1d):
+    with pytest.raises(ValueError):
+        xrfi.xrfi_parallel("explicit", np.array([sky_pl_1d, sky_pl_1d]))
+
+    with pytest.raises(ValueError):
+        xrfi.xrfi_parallel("medfilt", sky_pl_1d)
+
+
+@pytest.mark.parametrize(
+    "method,kwargs", [("model", {}), ("medfilt", {"kf": 16, "kt": None})],
+)
+def test_multires(method, kwargs):
+    rng = np.random.default_rng(1010)
+    freq = np.linspace(50, 150, 8192)
+
+    # The median filter is only reliable on spectra that are flat wrt the noise.
+    sky = 1750 * (freq / 75.0) ** -2.55 if method == "model" else np.ones(len(freq))
+    noise = sky / 300
+    sky = sky + rng.normal(scale=noise)
+
+    # Lines strong enough to be seen after averaging channels.
+    rfi = np.zeros(len(freq), dtype=bool)
+    rfi[rng.choice(len(freq), 20, replace=False)] = True
+    sky[rfi] += rng.uniform(30, 50, size=20) * noise[rfi]
+
+    flags, info = xrfi.xrfi_multires(method, sky, **kwargs)
+    single, _ = getattr(xrfi, f"xrfi_{method}")(sky, **kwargs)
+
+    assert np.all(flags[rfi])
+    assert np.sum(flags & ~rfi) <= np.sum(single & ~rfi) + 5
+    assert info["refined_fraction"] < 0.2
+    assert all(np.any(rfi[start:stop]) for start, stop in info["segments"])
+
+
+def test_multires_2d(sky_pl_1d):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d] * 20)
+    sky += np.random.normal(scale=sky / 100)
+    sky[5:8, 500] += 50 * sky[5:8, 500] / 100
+
+    flags, info = xrfi.xrfi_multires("medfilt", sky, factor=4, pad=8, kt=2, kf=5)
+    assert flags.shape == sky.shape
+    assert info["coarse_flags"].shape == (20, 250)
+    assert np.all(flags[5:8, 500])
+
+
+def test_multires_bad_input(sky_pl_1d):
+    with pytest.raises(ValueError):
+        xrfi.xrfi_multires("model_sweep", sky_pl_1d)
+
+    with pytest.raises(ValueError):
+        xrfi.xrfi_multires("model", sky_pl_1d, factor=0)
+
+
+def test_decimate_fills_flagged_bins():
+    spectrum = np.array([[1.0, 1, 2, 2, 3, 3, 4, 4], [1.0] * 8])
+    flags = np.zeros(spectrum.shape, dtype=bool)
+    flags[0, 2:6] = True
+    flags[1] = True
+
+    coarse, coarse_flags = xrfi._decimate(spectrum, flags, 2)
+    assert np.array_equal(coarse_flags[0], [False, True, True, False])
+    assert np.all(coarse_flags[1])
+    assert np.allclose(coarse[0], [1, 2, 3, 4])
+    assert np.all(coarse[1] == 0)
+
+
+def test_streaming_first_integration(sky_pl_1d):
+    np.random.seed(1010)
+    sky = sky_pl_1d + np.random.normal(scale=sky_pl_1d / 100)
+    sky[::50] += 50
+
+    flagger = xrfi.StreamingFlagger(len(sky), kf=8)
+    flags, info = flagger.push(sky)
+    expected, _ = xrfi.xrfi_medfilt(sky, kf=8, use_meanfilt=False)
+
+    assert np.array_equal(flags, expected)
+    assert np.all(np.isnan(info["temporal_significance"]))
+    assert flagger.n_pushed == 1
+
+
+@pytest.mark.parametrize("estimator", ["median", "ewma"])
+def test_streaming_temporal(sky_flat_1d, estimator):
+    np.random.seed(1010)
+    sky = np.array([sky_flat_1d] * 100)
+    sky += np.random.normal(scale=0.01, size=sky.shape)
+
+    # A channel that always sits below its neighbours, so that a transient there is
+    # much less significant along frequency than over time.
+    sky[:, 500] -= 0.04
+    sky[80:83, 500] += 0.09
+
+    flagger = xrfi.StreamingFlagger(len(sky_flat_1d), kf=32, estimator=estimator)
+    flags = flagger.run(sky, block_size=7)
+    medfilt_flags, _ = xrfi.xrfi_medfilt(sky, kt=0, kf=32, use_meanfilt=False)
+
+    assert not np.all(medfilt_flags[80:83, 500])
+    assert np.all(flags[80:83, 500])
+    assert np.mean(flags) < np.mean(medfilt_flags) + 0.001
+
+
+def test_streaming_blocks(sky_pl_1d):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d] * 30)
+    sky += np.random.normal(scale=sky / 100)
+    sky[np.random.random(sky.shape) < 0.01] += 50
+    in_flags = np.random.random(sky.shape) < 0.01
+
+    flagger = xrfi.StreamingFlagger(len(sky_pl_1d), n_history=10, min_history=4)
+    one_at_a_time = flagger.run(sky, flags=in_flags)
+
+    flagger.reset()
+    assert np.array_equal(flagger.run(sky, flags=in_flags, block_size=8), one_at_a_time)
+    assert np.all(one_at_a_time[in_flags])
+
+    # Memory doesn't grow with the number of integrations.
+    assert flagger._history.shape == (10, len(sky_pl_1d))
+
+
+def test_streaming_bad_input():
+    with pytest.raises(ValueError):
+        xrfi.StreamingFlagger(10, estimator="mean")
+
+    with pytest.raises(ValueError):
+        xrfi.StreamingFlagger(10, n_history=4, min_history=8)
+
+    with pytest.raises(ValueError):
+        xrfi.StreamingFlagger(10).push(np.ones(11))
+
+
+def _explicit_brute_force(f, ranges):
+    flags = np.zeros(len(f), dtype=bool)
+    for low, high in ranges:
+        flags[(f > low) & (f < high)] = True
+    return flags
+
+
+def test_rfi_band_registry():
+    rng = np.random.default_rng(1010)
+    lows = rng.uniform(50, 150, 100)
+    ranges = np.array([lows, lows + rng.uniform(-1, 3, 100)]).T.tolist()
+    ranges += [[60, 61], [61, 62], [70, 72], [71, 71.5], [90, 91], [90.5, 93]]
+
+    # Un-sorted, and with frequencies exactly on the band edges.
+    f = np.concatenate([rng.uniform(40, 160, 5000), np.array(ranges).flatten()])
+
+    registry = xrfi.RFIBandRegistry(ranges)
+    assert np.all(np.diff(registry.bands.flatten()) >= 0)
+    assert np.array_equal(registry.mask(f), _explicit_brute_force(f, ranges))
+
+    # Touching bands are not merged: their common edge is not flagged.
+    registry = xrfi.RFIBandRegistry(ranges[-6:])
+    assert registry.bands.tolist() == [[60, 61], [61, 62], [70, 72], [90, 93]]
+    assert not registry.mask(np.array([61.0]))[0]
+
+
+def test_rfi_band_registry_cache():
+    registry = xrfi.RFIBandRegistry([[60, 70]], max_cache=2)
+    f = np.linspace(50, 100, 100)
+
+    mask = registry.mask(f)
+    assert registry.mask(f.copy()) is mask
+    assert not mask.flags.writeable
+
+    registry.mask(f[:50])
+    registry.mask(f[:20])
+    assert registry.mask(f) is not mask
+
+
+def test_xrfi_explicit_file(tmpdir):
+    fname = tmpdir / "rfi.yaml"
+    with open(fname, "w") as fl:
+        yaml.dump({"rfi_ranges": [[60, 70], [65, 80]]}, fl)
+
+    f = np.linspace(50, 100, 100)
+    flags = xrfi.xrfi_explicit(f, rfi_file=fname, extra_rfi=[[90, 95]])
+    assert np.array_equal(
+        flags, _explicit_brute_force(f, [[60, 70], [65, 80], [90, 95]])
+    )
+
+    # The flags can be modified without changing the cached flags.
+    flags[:] = False
+    assert np.any(xrfi.xrfi_explicit(f, rfi_file=fname, extra_rfi=[[90, 95]]))
+
+    # Modified files are read again.
+    with open(fname, "w") as fl:
+        yaml.dump({"rfi_ranges": [[50, 55]]}, fl)
+    os.utime(fname, ns=(0, 10 ** 18))
+    assert np.array_equal(
+        xrfi.xrfi_explicit(f, rfi_file=fname), _explicit_brute_force(f, [[50, 55]])
+    )
+
+
+@pytest.fixture(scope="module")
+def pipeline_stages():
+    return [
+        {"flagger": "explicit", "extra_rfi": [[80, 85]]},
+        {"flagger": "medfilt", "kt": 2, "kf": 5, "name": "median filter"},
+        {"flagger": "watershed", "tol": 0.2},
+    ]
+
+
+def test_pipeline(sky_pl_1d, freq, pipeline_stages):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d] * 20)
+    sky += np.random.normal(scale=sky / 100)
+    sky[np.random.random(sky.shape) < 0.01] += 50
+    sky[7, ::3] += 50
+
+    pipeline = xrfi.XRFIPipeline(pipeline_stages)
+    flags, info = pipeline.run(sky, freq=freq)
+
+    # The same as calling each flagger by hand.
+    expected = np.broadcast_to(
+        xrfi.xrfi_explicit(freq, extra_rfi=[[80, 85]]), sky.shape
+    )
+    expected = expected | xrfi.xrfi_medfilt(sky, flags=expected.copy(), kt=2, kf=5)[0]
+    expected = expected | xrfi.xrfi_watershed(flags=expected, tol=0.2)[0]
+    assert np.array_equal(flags, expected)
+    assert np.all(flags[7])
+
+    stats = info["stages"]
+    assert [stat["name"] for stat in stats] == [
+        "explicit",
+        "median filter",
+        "watershed",
+    ]
+    assert stats[-1]["n_flags"] == np.sum(flags)
+    assert sum(stat["n_new_flags"] for stat in stats) == np.sum(flags)
+    assert all(stat["time"] > 0 for stat in stats)
+    assert all(stat["peak_memory"] is None for stat in stats)
+
+    # The flag buffers are re-used by the next run.
+    again, _ = pipeline.run(sky, freq=freq)
+    assert again is flags
+
+    out = np.zeros(sky.shape, dtype=bool)
+    assert pipeline.run(sky, freq=freq, out=out)[0] is out
+    assert np.array_equal(out, expected)
+
+
+def test_pipeline_trace_memory(sky_pl_1d, freq, pipeline_stages):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d] * 20)
+    sky += np.random.normal(scale=sky / 100)
+    sky[np.random.random(sky.shape) < 0.01] += 50
+
+    expected, _ = xrfi.XRFIPipeline(pipeline_stages).run(sky, freq=freq)
+    expected = expected.copy()
+
+    pipeline = xrfi.XRFIPipeline(pipeline_stages, trace_memory=True)
+    flags, info = pipeline.run(sky, freq=freq)
+    assert np.array_equal(flags, expected)
+    assert info["stages"][1]["peak_memory"] > sky.nbytes
+    assert not tracemalloc.is_tracing()
+    assert repr(pipeline) == repr(xrfi.XRFIPipeline(pipeline_stages))
+
+
+def test_pipeline_from_yaml(tmpdir, pipeline_stages):
+    fname = tmpdir / "pipeline.yaml"
+    with open(fname, "w") as fl:
+        yaml.dump({"stages": pipeline_stages}, fl)
+
+    pipeline = xrfi.XRFIPipeline.from_yaml(fname)
+    assert repr(pipeline) == repr(xrfi.XRFIPipeline(pipeline_stages))
+
+
+def test_pipeline_bad_input(sky_pl_1d):
+    with pytest.raises(ValueError):
+        xrfi.XRFIPipeline([{"flagger": "unknown"}])
+
+    with pytest.raises(ValueError):
+        xrfi.XRFIPipeline([{"kf": 5}])
+
+    with pytest.raises(ValueError):
+        xrfi.XRFIPipeline([{"flagger": "explicit"}]).run(sky_pl_1d)
+
+
+@pytest.mark.parametrize(
+    "func,kwargs",
+    [
+        (xrfi.xrfi_medfilt, {"kt": 2, "kf": 5}),
+        (xrfi.xrfi_medfilt, {"kt": 2, "kf": 5, "accumulate": True, "max_iter": 3}),
+        (xrfi.xrfi_model, {}),
+        (xrfi.xrfi_watershed, {"tol": 0.1}),
+        (partial(xrfi.xrfi_multires, "medfilt"), {"kt": 2, "kf": 5, "factor": 4}),
+    ],
+)
+def test_packed_flags(sky_pl_1d, func, kwargs):
+    np.random.seed(1010)
+    sky = np.array([sky_pl_1d] * 10)
+    sky += np.random.normal(scale=sky / 100)
+    sky[np.random.random(sky.shape) < 0.02] += 50
+    flags = np.random.random(sky.shape) < 0.05
+
+    packed = PackedFlags.from_bool(flags)
+    bool_flags = flags.copy()
+    out, _ = func(sky, flags=packed, **kwargs)
+    expected, _ = func(sky, flags=bool_flags, **kwargs)
+
+    assert isinstance(out, PackedFlags)
+    assert np.array_equal(out.to_bool(), expected)
+
+    # In-place updates are kept.
+    assert np.array_equal(packed.to_bool(), bool_flags)
+
+
+@pytest.mark.parametrize("watershed", [2, (2, 0.5), np.array([0.2, 0.5, 1, 0.5, 0.2])])
+def test_watershed_flags(watershed):
+    np.random.seed(1234)
+    flags = np.random.random((5, 100)) < 0.05
+    abs_resid = np.abs(np.random.normal(scale=3, size=(5, 100)))
+    std = np.ones((5, 100))
+
+    kernel = xrfi._get_watershed_kernel(watershed)
+    half = len(kernel) // 2
+
+    expected = np.zeros_like(flags)
+    for t, channel in zip(*np.where(flags)):
+        for i, value in enumerate(kernel):
+            ch = channel + i - half
+            if 0 <= ch < 100 and abs_resid[t, ch] > value * 3 * std[t, ch]:
+                expected[t, ch] = True
+
+    # 1D watersheds are applied along frequency for 2D flags.
+    out = xrfi.watershed_flags(flags, abs_resid, std, 3, watershed)
+    assert np.array_equal(out, expected)
+    assert np.array_equal(
+        xrfi.watershed_flags(flags[0], abs_resid[0], std[0], 3, watershed), expected[0]
+    )
+
+    # A 2D watershed can extend the flags over time as well.
+    out = xrfi.watershed_flags(flags, abs_resid, std, 3, np.array([[0], [1], [0]]))
+    assert np.all(out[1:][flags[:-1]])
+    assert np.all(out[:-1][flags[1:]])
+
+    with pytest.raises(ValueError):
+        xrfi.watershed_flags(flags, abs_resid, std, 3, np.ones(4))
+
+
+def test_model_sweep(sky_pl_1d, rfi_regular_1d):
+    np.random.seed(1010)
+    sky = sky_pl_1d + np.random.normal(scale=sky_pl_1d / 1000)
+    sky += rfi_regular_1d * sky_pl_1d.max()
+
+    # A gap of flagged data wider than the window used to make the sweep hang.
+    weights = np.ones_like(sky)
+    weights[300:500] = 0
+
+    flags = xrfi.xrfi_model_sweep(
+        sky, weights=weights, window_width=50, use_median=True, n_sigma=5
+    )
+    assert np.all(flags[rfi_regular_1d > 0])
+    assert np.all(flags[300:500])
+
+    # 2D arrays are swept row-by-row.
+    flags2d = xrfi.xrfi_model_sweep(
+        np.array([sky, sky]),
+        weights=np.array([weights, np.zeros_like(weights)]),
+        window_width=50,
+        use_median=True,
+        n_sigma=5,
+    )
+    assert np.array_equal(flags2d[0], flags)
+    assert np.all(flags2d[1])
+
+    with pytest.raises(xrfi.NoDataError):
+        xrfi.xrfi_model_sweep(sky, weights=np.zeros_like(sky))
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_model_sweep_after_gap(monkeypatch, sky_pl_1d, backend):
+    if backend == "numba":
+        pytest.importorskip("numba")
+    monkeypatch.setattr(xrfi, "BACKEND", backend)
+    np.random.seed(1010)
+    sky = sky_pl_1d + np.random.normal(scale=sky_pl_1d / 1000)
+
+    # Windows just after the gap have fewer data than terms, and are fit exactly.
+    weights = np.ones_like(sky)
+    weights[300:500] = 0
+
+    flags = xrfi.xrfi_model_sweep(
+        sky, weights=weights, window_width=50, use_median=True, n_sigma=5
+    )
+    assert not np.any(flags[500:550])
+
+
 def test_watershed():
     rfi = np.zeros((10, 10), dtype=bool)
     out, _ = xrfi.xrfi_watershed(flags=rfi)
@@ -259,3 +955,114 @@ def test_watershed():
     rfi = np.repeat([0, 1], 48).reshape((3, 32))
     out, _ = xrfi.xrfi_watershed(flags=rfi, tol=0.2)
     assert np.all(out)
+
+
+def _with_backends(monkeypatch, func, *args, **kwargs):
+    """Call a function with each backend, returning the results of each."""
+    results = []
+    for backend in ["numpy", "numba"]:
+        monkeypatch.setattr(xrfi, "BACKEND", backend)
+        np.random.seed(1234)
+        results.append(
+            func(
+                *args,
+                **{
+                    key: val.copy() if isinstance(val, np.ndarray) else val
+                    for key, val in kwargs.items()
+                },
+            )
+        )
+    return results
+
+
+@pytest.fixture(scope="module")
+def rfi_waterfall(sky_pl_1d):
+    np.random.seed(4321)
+    sky = np.outer(np.ones(12), sky_pl_1d)
+    sky += np.random.normal(scale=sky / 100)
+    rfi = np.random.random(sky.shape) < 0.03
+    sky[rfi] += np.random.exponential(size=np.sum(rfi)) * sky_pl_1d.max() / 20
+    sky[np.random.random(sky.shape) < 0.005] = np.inf
+    flags = np.random.random(sky.shape) < 0.05
+    return sky, flags
+
+
+@pytest.mark.parametrize("mode", ["nearest", "reflect", "constant"])
+@pytest.mark.parametrize("size", [1, 6, 9, (1, 7), (3, 4)])
+def test_backends_median_filter(monkeypatch, rfi_waterfall, mode, size):
+    pytest.importorskip("numba")
+    data, flags = rfi_waterfall
+    if np.isscalar(size):
+        data, flags = data[0], flags[0]
+
+    numpy, numba = _with_backends(
+        monkeypatch, xrfi.flagged_median_filter, data, size, flags=flags, mode=mode
+    )
+    assert np.array_equal(numpy, numba, equal_nan=True)
+
+    where = np.roll(flags, 3)
+    numpy, numba = _with_backends(
+        monkeypatch,
+        lambda: xrfi.flagged_median_filter(
+            data, size, flags=flags, mode=mode, where=where, out=np.zeros_like(data)
+        ),
+    )
+    assert np.array_equal(numpy, numba, equal_nan=True)
+
+
+@pytest.mark.parametrize(
+    "func,kwargs",
+    [
+        (xrfi.xrfi_medfilt, {"kf": 8, "kt": 2, "max_iter": 5}),
+        (xrfi.xrfi_medfilt, {"kf": 8, "kt": None, "max_iter": 5, "incremental": True}),
+        (xrfi.xrfi_model, {"watershed": 3}),
+        (xrfi.xrfi_model, {"watershed": np.array([0.5, 1, np.nan, 1, 0.2])}),
+        (xrfi.xrfi_model_sweep, {"window_width": 50}),
+        (xrfi.xrfi_model_sweep, {"window_width": 50, "use_median": True}),
+    ],
+)
+def test_backends_flags(monkeypatch, rfi_waterfall, func, kwargs):
+    pytest.importorskip("numba")
+    data, flags = rfi_waterfall
+
+    if func is xrfi.xrfi_model_sweep:
+        kwargs = dict(kwargs, weights=(~flags).astype(float))
+    elif func is xrfi.xrfi_model:
+        data = np.where(np.isfinite(data), data, 0)
+        kwargs = dict(kwargs, flags=flags)
+    else:
+        kwargs = dict(kwargs, flags=flags)
+
+    numpy, numba = _with_backends(monkeypatch, func, data, **kwargs)
+    if isinstance(numpy, tuple):
+        numpy, numba = numpy[0], numba[0]
+
+    assert np.any(numpy & ~flags)
+    assert np.array_equal(numpy, numba)
+
+
+@pytest.mark.parametrize(
+    "watershed", [2, np.array([[0.5, np.nan, 2], [1, 1, 0.2], [0, 0.5, 0.2]])]
+)
+def test_backends_watershed(monkeypatch, watershed):
+    pytest.importorskip("numba")
+    np.random.seed(1234)
+    flags = np.random.random((20, 50)) < 0.05
+    abs_resid = np.abs(np.random.normal(size=flags.shape))
+
+    numpy, numba = _with_backends(
+        monkeypatch, xrfi.watershed_flags, flags, abs_resid, 0.3, 3, watershed
+    )
+    assert np.any(numpy)
+    assert np.array_equal(numpy, numba)
+
+
+def test_bad_backend(monkeypatch, sky_pl_1d):
+    monkeypatch.setattr(xrfi, "BACKEND", "fortran")
+    with pytest.raises(ValueError):
+        xrfi.flagged_median_filter(sky_pl_1d, size=3)
+
+    monkeypatch.setattr(xrfi, "BACKEND", "numba")
+    monkeypatch.setattr(xrfi, "_xrfi_numba", None)
+    with pytest.raises(ImportError):
+        xrfi.flagged_median_filter(sky_pl_1d, size=3)